@@ -37,6 +37,7 @@ from display.ui_settings import (SimpleButtonSettings, FancyButtonSettings,
                                  DisplayRectSettings, PageSettings,
                                  TextSetting)
 from display.selectors import AlarmLimitSelector, AlarmLimitSelectorPair
+from display.timed_plot import TimedPlotWidget
 
 from utils.alarm_limits import AlarmLimits
 from utils.alarm_limit_type import AlarmLimitType, AlarmLimitPair
@@ -272,7 +273,8 @@ def initializeGraphWidget(window: MainWindow) -> None:
     window.pressure_data = np.empty([
         window.graph_width,
     ])
-    window.pressure_graph = pg.PlotWidget()
+    # repaints of the pressure graph finish the packet-to-pixel latency trace
+    window.pressure_graph = TimedPlotWidget()
     window.pressure_graph.setYRange(-45, 70, padding=0)
 
     window.pressure_graph_line = window.pressure_graph.plot(
@@ -733,6 +735,14 @@ def initializeSettingsWidget(window: MainWindow) -> None:
     settings_change_alarm_limits_button.clicked.connect(
         lambda: window.display(10))
 
+    settings_patient_history_button = window.makeSimpleDisplayButton(
+        "Patient History",
+        button_settings=SimpleButtonSettings(
+            valueSetting=TextSetting("Arial Black", 14, False),
+        ),
+        size=(200, 60))
+    settings_patient_history_button.clicked.connect(window.showPatientHistory)
+
     settings_back_button = window.makeSimpleDisplayButton(
         "Back to Main",
         button_settings=SimpleButtonSettings(
@@ -746,6 +756,7 @@ def initializeSettingsWidget(window: MainWindow) -> None:
     h_box_7mid1_v2.addWidget(settings_change_patient_button)
     h_box_7mid1_v2.addWidget(settings_change_datetime_button)
     h_box_7mid1_v2.addWidget(settings_change_alarm_limits_button)
+    h_box_7mid1_v2.addWidget(settings_patient_history_button)
     h_box_7bottom.addWidget(settings_back_button)
     h_box_7mid1.addLayout(h_box_7mid1_v1)
     h_box_7mid1.addLayout(h_box_7mid1_v2)
@@ -1381,6 +1392,67 @@ def initializeReadyWidget(window: MainWindow) -> None:
 
     window.page["17"].setLayout(v_box_17)
 
+def initializePatientHistoryWidget(window: MainWindow) -> None:
+    """ Filled from the session store by window.showPatientHistory """
+    v_box_18 = QVBoxLayout()
+    v_box_18.setSpacing(2)
+    h_box_18top = QHBoxLayout()
+    h_box_18bottom = QHBoxLayout()
+    h_box_18top.setAlignment(Qt.AlignCenter)
+    h_box_18bottom.setAlignment(Qt.AlignCenter)
+
+    label_style = {'color': '#20c7ff', 'font-size': '9pt'}
+    history_pen = pg.mkPen(width=2, color="#e9840e")
+    history_peep_pen = pg.mkPen(width=2, color="#20c7ff")
+
+    window.history_summary_label = QLabel()
+    window.history_summary_label.setFont(TextSetting("Arial", 12, True).font)
+    window.history_summary_label.setStyleSheet("QLabel {color: #FFFFFF ;}")
+    window.history_summary_label.setWordWrap(True)
+
+    # trends over the last hour, x in minutes before now
+    window.history_pressure_graph = pg.PlotWidget()
+    window.history_ppeak_line = window.history_pressure_graph.plot(pen=history_pen)
+    window.history_peep_line = window.history_pressure_graph.plot(pen=history_peep_pen)
+    window.history_pressure_graph.setYRange(0, 50, padding=0)
+    window.history_pressure_graph.getAxis("left").setLabel("PIP/PEEP", **label_style)
+
+    window.history_volume_graph = pg.PlotWidget()
+    window.history_tv_line = window.history_volume_graph.plot(pen=history_pen)
+    window.history_volume_graph.setYRange(0, 900, padding=0)
+    window.history_volume_graph.getAxis("left").setLabel("TV (mL)", **label_style)
+
+    for graph in [window.history_pressure_graph, window.history_volume_graph]:
+        graph.setStyleSheet("border: 0;")
+        graph.setBackground("#232323")
+        graph.setMouseEnabled(False, False)
+        graph.setXRange(-60, 0, padding=0)
+        graph.setFixedHeight(80)
+    window.history_pressure_graph.getPlotItem().hideAxis('bottom')
+
+    window.history_events_label = QLabel()
+    window.history_events_label.setFont(TextSetting("Arial", 11, False).font)
+    window.history_events_label.setStyleSheet("QLabel {color: #FFFFFF ;}")
+    window.history_events_label.setWordWrap(True)
+
+    history_back_button = window.makeSimpleDisplayButton(
+        "Back to Settings",
+        button_settings=SimpleButtonSettings(
+            valueSetting=TextSetting("Arial Black", 14, False),
+        ),
+        size=(200, 40))
+    history_back_button.clicked.connect(lambda: window.display(6))
+
+    h_box_18top.addWidget(window.history_summary_label)
+    h_box_18bottom.addWidget(history_back_button)
+    v_box_18.addLayout(h_box_18top)
+    v_box_18.addWidget(window.history_pressure_graph)
+    v_box_18.addWidget(window.history_volume_graph)
+    v_box_18.addWidget(window.history_events_label)
+    v_box_18.addLayout(h_box_18bottom)
+
+    window.page["18"].setLayout(v_box_18)
+
 def initializeSetupWidget(window: MainWindow) -> None:
     window.setup_stack = QStackedWidget()
     for step in range(1 , 5):
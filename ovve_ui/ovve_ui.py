@@ -35,7 +35,6 @@ except:
 
 import uuid
 from copy import deepcopy
-from logging.handlers import TimedRotatingFileHandler
 from random import randint
 from typing import Union, Optional, Tuple
 
@@ -66,18 +65,28 @@ from display.widgets import (initializeHomeScreenWidget, initializeModeWidget,
                              initializeStopVentilationAndPowerDownScreen, 
                              initializePowerDownScreen, initializeLostCommsScreen,
                              initializeCalibWidget, initializeReadyWidget,
-                             initializeSetupWidget)
+                             initializePatientHistoryWidget, initializeSetupWidget)
 
 from utils.params import Params
 from utils.settings import Settings
 from utils.Alarm import Alarm, AlarmHandler, AlarmType
 from utils.comms_simulator import CommsSimulator
 from utils.comms_link import CommsLink
+from utils.comms_async import AsyncCommsLink
+from utils.comms_process import ProcessCommsLink
+from utils.waveform_batch import WaveformBlock
+from utils.status_diff import StatusChange
 from utils.ranges import Ranges
 from utils.alarm_limits import AlarmLimits
 from utils.alarm_limit_type import AlarmLimitType
 from utils.control_state import ControlState
 from utils.ui_calibration_state import UICalibrationState
+from utils.latency_trace import trace
+from utils.log_queue import LogPipeline
+from utils.log_index import IndexedRotatingFileHandler, INDEX_SUFFIX
+from utils.segment_compressor import SegmentCompressor
+from utils.retention import RetentionManager, RetentionStore, is_capture_artifact
+from utils.session_store import SessionStore, DEFAULT_PATH as SESSION_DB_PATH
 
 # Setup logger at global scope
 logger = logging.getLogger()
@@ -100,7 +109,13 @@ class MainWindow(QWidget):
                  port: str,
                  is_sim: bool = False,
                  windowed: bool = False,
-                 dev_mode: bool = False) -> None:
+                 dev_mode: bool = False,
+                 read_mode: str = 'select',
+                 engine: str = 'thread',
+                 display_rate: float = 25.0,
+                 log_budget: int = 1024 * 1024 * 1024,
+                 capture_budget: int = 1024 * 1024 * 1024,
+                 session_db: Optional[str] = None) -> None:
         super().__init__()
         self.settings = Settings()
         self.local_settings = Settings()  # local settings are changed with UI
@@ -109,8 +124,15 @@ class MainWindow(QWidget):
         self.windowed = windowed
         self.dev_mode = dev_mode
         self.last_main_update_time = 0
+        self.last_waveform_display_time = 0
         self.main_update_interval = 1.0
+        # shows a change that arrived too soon after the last update
+        self.main_update_timer = QTimer()
+        self.main_update_timer.setSingleShot(True)
+        self.main_update_timer.timeout.connect(self.updateMainDisplays)
         self.calibration_complete = False
+        # only control state changes are logged
+        self.last_control_state = None
 
         self.patient_id = uuid.uuid4()
         self.patient_id_display = 1
@@ -135,7 +157,7 @@ class MainWindow(QWidget):
 
         initializeHomeScreenWidget(self)
 
-        self.page = {str(i): QWidget() for i in range(1, 18)}
+        self.page = {str(i): QWidget() for i in range(1, 19)}
         lim = AlarmLimits()
         self.alarm_limits = lim.alarm_limits
         self.alarm_limit_pairs = lim.alarm_limit_pairs
@@ -143,6 +165,10 @@ class MainWindow(QWidget):
         self.initializeWidgets()
         self.addStackWidgets()
 
+        # traces of params drawn since the last pressure graph repaint
+        self.pending_traces = []
+        self.pressure_graph.painted.connect(self.graph_painted)
+
         self.main_stack = QStackedWidget()
         self.main_stack.addWidget(self.home_screen_widget)
         self.main_stack.addWidget(self.setup_stack)
@@ -154,8 +180,12 @@ class MainWindow(QWidget):
         palette.setColor(QtGui.QPalette.Background, QColor("#2C2C2C"))
         self.setPalette(palette)
 
-        if not is_sim:
-            self.comms_handler = CommsLink(port)
+        if not is_sim and engine == 'asyncio':
+            self.comms_handler = AsyncCommsLink(port, read_mode, display_rate=display_rate)
+        elif not is_sim and engine == 'process':
+            self.comms_handler = ProcessCommsLink(port, read_mode, display_rate=display_rate)
+        elif not is_sim:
+            self.comms_handler = CommsLink(port, read_mode, display_rate=display_rate)
         else:
             self.comms_handler = CommsSimulator()
 
@@ -173,14 +203,41 @@ class MainWindow(QWidget):
 
         self.ui_calibration_state = UICalibrationState.UNCALIBRATED
         self.comms_handler.new_params.connect(self.update_ui_params)
+        self.comms_handler.new_waveform.connect(self.update_ui_waveform)
+        self.comms_handler.new_status.connect(self.update_ui_status)
+        self.graph_reader = None
+        if self.comms_handler.samples is not None:
+            self.graph_reader = self.comms_handler.samples.reader('graphs')
         self.comms_handler.new_alarms.connect(self.update_ui_alarms)
         self.comms_handler.lost_comms_signal.connect(self.lost_comms)
 
+        # Per-patient history in SQLite for the settings page, optional
+        self.session_store = None
+        if session_db:
+            try:
+                self.session_store = SessionStore(session_db, self.comms_handler.samples)
+            except (RuntimeError, OSError) as e:
+                self.logger.warning("No session history: " + str(e))
+        if self.session_store is not None:
+            self.session_store.start_session(self.patient_id, self.patient_id_display)
+            self.comms_handler.new_alarms.connect(self.session_store.record_alarms)
+            self.session_store.start()
+
         self.new_settings_signal.connect(self.comms_handler.update_settings)
         self.ready_to_calibrate_signal.connect(self.comms_handler.ready_to_calibrate)
         self.ready_to_ventilate_signal.connect(self.comms_handler.ready_to_ventilate)
         self.comms_handler.start()
 
+        # Oldest logs and captures are deleted to stay within the budgets,
+        # the current patient's logs and the open capture files are kept
+        self.retention = RetentionManager([
+            RetentionStore(os.path.join("/tmp", "ovve_logs"), log_budget,
+                           protect=lambda: [self.logpath]),
+            RetentionStore('/home/pi/logs', capture_budget,
+                           protect=self.comms_handler.live_files,
+                           match=is_capture_artifact)])
+        self.retention.start()
+
         # If running on the RPi, the GPIO library will be loaded
         # Detect an active-low interrupt on BCM4
         if GPIO:
@@ -213,6 +270,7 @@ class MainWindow(QWidget):
         initializePowerDownScreen(self)
         initializeCalibWidget(self)
         initializeReadyWidget(self)
+        initializePatientHistoryWidget(self)
 
         initializeSetupWidget(self)
 
@@ -225,6 +283,7 @@ class MainWindow(QWidget):
 
     def setupLogging(self, logger, patient_id):
         logpath = os.path.join("/tmp", "ovve_logs", str(patient_id))
+        self.logpath = logpath
 
 
         # Create all directories in the log path
@@ -235,14 +294,28 @@ class MainWindow(QWidget):
 
         # The TimedRotatingFileHandler will write a new file each hour
         # After two weeks, the oldest logs will start being deleted
-        fh = TimedRotatingFileHandler(logfileroot,
-                                      when='H',
-                                      interval=1,
-                                      backupCount=336)
+        # Times and alarms are indexed in <logfileroot>.idx
+        self.fh = IndexedRotatingFileHandler(logfileroot,
+                                             when='H',
+                                             interval=1,
+                                             backupCount=336)
 
         # Set the filehandler to log raw packets, warnings, and higher
         # Raw packets are logged at custom log level 25, just above INFO
-        fh.setLevel(logging.DEBUG)
+        self.fh.setLevel(logging.DEBUG)
+
+        # Hourly backups are compressed in the background as they roll over,
+        # and those earlier runs left in any patient's directory at start
+        self.log_compressor = SegmentCompressor()
+        self.log_compressor.attach(self.fh)
+        logroot = os.path.dirname(logpath)
+        for name in sorted(os.listdir(logroot)):
+            if os.path.isdir(os.path.join(logroot, name)):
+                self.log_compressor.submit_pending(
+                    os.path.join(logroot, name),
+                    lambda backup, prefix=name + ".log.": (backup.startswith(prefix) and
+                                                          not backup.endswith(INDEX_SUFFIX)))
+        self.log_compressor.start()
 
         # Log to console with human-readable output
         ch = logging.StreamHandler()
@@ -251,17 +324,15 @@ class MainWindow(QWidget):
         # TODO: Create a custom handler for Ignition
 
         # create formatter and add it to the handlers
-        formatter = logging.Formatter(
+        self.formatter = logging.Formatter(
             '%(asctime)s - %(levelname)s - %(message)s')
-        fh.setFormatter(formatter)
-        ch.setFormatter(formatter)
-
-        # add the handlers to the logger
-        logger.addHandler(fh)
+        self.fh.setFormatter(self.formatter)
+        ch.setFormatter(self.formatter)
 
+        # The handlers run on a listener thread, the logger only queues
         # Only log to console in dev mode
-        if (self.dev_mode):
-            logger.addHandler(ch)
+        handlers = [self.fh, ch] if self.dev_mode else [self.fh]
+        self.log_pipeline = LogPipeline(logger, handlers)
 
     def updateTimeLabel(self):
         self.datetime = QDateTime.currentDateTime()
@@ -361,18 +432,55 @@ class MainWindow(QWidget):
                            if rect_settings is None else rect_settings)
 
 
+    def update_ui_waveform(self, block: WaveformBlock) -> None:
+        # fast channel, one pass per display tick: graphs get every sample
+        # since the last, everything else follows new_status
+        if self.graph_reader is None:
+            # blocks still queued after closeEvent, the ring may be gone
+            return
+        params = block.params
+        if params.timestamps is not None:
+            params.timestamps.append(time.perf_counter())
+        # newest packet, its status fields are the ones new_status sent last
+        self.params = params
+        self.updateWaveformDisplays()
+        samples = self.graph_reader.read(block.head)
+        if self.controller_running():
+            running = samples[samples['run_state'] > 0]
+            if len(running) and params.timestamps is not None:
+                self.pending_traces.append(params.timestamps)
+            self.updateGraphBlock(running['pressure'], running['flow'], running['volume'])
+
+    def update_ui_status(self, change: StatusChange) -> None:
+        # slow channel, only sent when a status field changes. Every packet
+        # is in the session recording, the log only gets the change.
+        self.logger.info("Status change: " + json.dumps(change.changed))
+        self.update_status(change.params)
+
     def update_ui_params(self, params: Params) -> None:
+        # every packet, without a display rate or from the simulator
+        if params.timestamps is not None:
+            params.timestamps.append(time.perf_counter())
+        self.update_status(params)
+        self.updateWaveformDisplays()
+        if self.controller_running() and self.params.run_state > 0:
+            # queued first, updateGraphs may repaint before it returns
+            if params.timestamps is not None:
+                self.pending_traces.append(params.timestamps)
+            self.updateGraphs()
+
+    def update_status(self, params: Params) -> None:
         self.params = params
-        try:
-            self.logger.info(self.params.to_JSON())
-        except:
-            pass
+        if self.session_store is not None:
+            self.session_store.record_params(params)
         self.update_ui_alarms()
         self.updateMainDisplays()
 
-        self.logger.debug("Control state: " + str(self.params.control_state))
+        changed = self.params.control_state != self.last_control_state
+        self.last_control_state = self.params.control_state
         if (self.params.control_state == ControlState.UNCALIBRATED):
-            self.logger.debug("Control state is UNCALIBRATED")
+            if changed:
+                self.logger.debug("Control state is UNCALIBRATED")
             self.setUICalibrationState(UICalibrationState.UNCALIBRATED)
             self.main_stack.setCurrentIndex(1)
         elif (self.params.control_state == ControlState.SENSOR_CALIBRATION and
@@ -388,11 +496,31 @@ class MainWindow(QWidget):
             # Note, the UI calibration state will be set to CALIBRATION_DONE
             # When the user acknowledges the startup message raised by this dialog
             self.display(16)
-        elif (self.params.control_state == ControlState.HALT):
+        elif (self.params.control_state == ControlState.HALT and changed):
             self.logger.debug("Control state is HALT")
-        else:   # Controller is idle or ventilating
-            if self.params.run_state > 0:
-                self.updateGraphs()
+
+    def controller_running(self) -> bool:
+        """ Idle or ventilating: not halted or in a calibration step update_status handles """
+        control_state = self.params.control_state
+        if control_state in (ControlState.UNCALIBRATED, ControlState.HALT):
+            return False
+        if control_state == ControlState.SENSOR_CALIBRATION:
+            return self.ui_calibration_state != UICalibrationState.UNCALIBRATED
+        if control_state == ControlState.SENSOR_CALIBRATION_DONE:
+            return self.ui_calibration_state != UICalibrationState.SENSOR_CALIBRATION
+        return True
+
+    def graph_painted(self) -> None:
+        if self.pending_traces:
+            paintTime = time.perf_counter()
+            for timestamps in self.pending_traces:
+                timestamps.append(paintTime)
+                trace.record(timestamps)
+            self.pending_traces = []
+
+    def dump_latency_trace(self) -> None:
+        for line in trace.summary():
+            self.logger.warning(line)
 
     def update_ui_alarms(self) -> None:
         if ((self.alarm_handler.alarms_pending() > 0) and 
@@ -427,6 +555,9 @@ class MainWindow(QWidget):
 
     def setUICalibrationState(self, uiCalibrationState):
         self.ui_calibration_state = uiCalibrationState
+        if uiCalibrationState == UICalibrationState.CALIBRATION_DONE:
+            # alarms raised during calibration are held until now
+            self.update_ui_alarms()
 
     def enableStartButton(self):
         self.start_stop_button_main.button_settings = SimpleButtonSettings(
@@ -461,7 +592,11 @@ class MainWindow(QWidget):
 
     def updateMainDisplays(self) -> None:
         t_now = time.time()
-        if (t_now - self.last_main_update_time) > self.main_update_interval:
+        wait = self.last_main_update_time + self.main_update_interval - t_now
+        if wait > 0:
+            if not self.main_update_timer.isActive():
+                self.main_update_timer.start(int(wait * 1000) + 1)
+        else:
             self.last_main_update_time = t_now
             self.mode_button_main.updateValue(
                 self.get_mode_display(self.params.mode))
@@ -472,7 +607,6 @@ class MainWindow(QWidget):
             self.resp_rate_display_main.updateValue(
                 round(self.params.resp_rate_meas, 2))
             self.peep_display_main.updateValue(round(self.params.peep, 1))
-            self.tv_insp_display_main.updateValue(round(self.params.tv_insp))
             # self.tv_exp_display_main.updateValue(self.params.tv_exp)
             self.ppeak_display_main.updateValue(round(self.params.ppeak, 1))
             self.pplat_display_main.updateValue(round(self.params.pplat, 1))
@@ -501,6 +635,13 @@ class MainWindow(QWidget):
 
             #TODO: Get battery level converted to percentage
 
+    def updateWaveformDisplays(self) -> None:
+        # fields that change every packet, sampled at the main display rate
+        t_now = time.time()
+        if (t_now - self.last_waveform_display_time) > self.main_update_interval:
+            self.last_waveform_display_time = t_now
+            self.tv_insp_display_main.updateValue(round(self.params.tv_insp))
+
     def updatePageDisplays(self) -> None:
         self.mode_page_value_label.setText(
             self.get_mode_display(self.settings.mode))
@@ -520,7 +661,7 @@ class MainWindow(QWidget):
         self.pressure_graph_cache_line.setPos(self.graph_ptr + 2, 0)
         self.pressure_graph_line.show()
 
-        QtGui.QApplication.processEvents()
+        QApplication.processEvents()
 
         self.flow_data[self.graph_ptr] = self.params.flow
         self.flow_graph_line.setData(self.flow_data[:self.graph_ptr + 1])
@@ -528,7 +669,7 @@ class MainWindow(QWidget):
         self.flow_graph_cache_line.setPos(self.graph_ptr + 2, 0)
         self.flow_graph_line.show()
 
-        QtGui.QApplication.processEvents()
+        QApplication.processEvents()
 
         self.volume_data[self.graph_ptr] = self.params.tv_meas
         self.volume_graph_line.setData(self.volume_data[:self.graph_ptr + 1])
@@ -537,7 +678,7 @@ class MainWindow(QWidget):
         self.volume_graph_cache_line.setPos(self.graph_ptr + 2, 0)
         self.volume_graph_line.show()
 
-        QtGui.QApplication.processEvents()
+        QApplication.processEvents()
 
         self.graph_ptr = (self.graph_ptr + 1) % self.graph_width
 
@@ -547,21 +688,56 @@ class MainWindow(QWidget):
             self.flow_graph_cache_line.show()
             self.flow_graph_line.setData(np.empty(0, ))
 
-            QtGui.QApplication.processEvents()
+            QApplication.processEvents()
 
             self.pressure_graph_cache_line.setData(self.pressure_data)
             self.pressure_graph_cache_line.setPos(0, 0)
             self.pressure_graph_cache_line.show()
             self.pressure_graph_line.setData(np.empty(0, ))
 
-            QtGui.QApplication.processEvents()
+            QApplication.processEvents()
 
             self.volume_graph_cache_line.setData(self.volume_data)
             self.volume_graph_cache_line.setPos(0, 0)
             self.volume_graph_cache_line.show()
             self.volume_graph_line.setData(np.empty(0, ))
 
-            QtGui.QApplication.processEvents()
+            QApplication.processEvents()
+
+    def updateGraphBlock(self, pressure: np.ndarray, flow: np.ndarray,
+                         volume: np.ndarray) -> None:
+        # Same sweep as updateGraphs, but stores a block of samples and
+        # redraws each graph once
+        count = len(pressure)
+        if count == 0:
+            return
+        if count > self.graph_width:
+            # only the newest sweep can be seen
+            skip = count - self.graph_width
+            pressure, flow, volume = pressure[skip:], flow[skip:], volume[skip:]
+            self.graph_ptr = (self.graph_ptr + skip) % self.graph_width
+            count = self.graph_width
+        wrapped = self.graph_ptr + count >= self.graph_width
+        idx = (self.graph_ptr + np.arange(count)) % self.graph_width
+        self.graph_ptr = (self.graph_ptr + count) % self.graph_width
+        ptr = self.graph_ptr
+
+        for data, values, line, cache_line in (
+                (self.pressure_data, pressure, self.pressure_graph_line, self.pressure_graph_cache_line),
+                (self.flow_data, flow, self.flow_graph_line, self.flow_graph_cache_line),
+                (self.volume_data, volume, self.volume_graph_line, self.volume_graph_cache_line)):
+            data[idx] = values
+            if ptr == 0:
+                cache_line.setData(data)
+                cache_line.setPos(0, 0)
+                line.setData(np.empty(0, ))
+            else:
+                line.setData(data[:ptr])
+                cache_line.setData(data[ptr + 1:])
+                cache_line.setPos(ptr + 1, 0)
+            line.show()
+            if wrapped:
+                cache_line.show()
 
     def incrementMode(self) -> None:
         self.local_settings.mode += 1
@@ -719,14 +895,17 @@ class MainWindow(QWidget):
 
         self.logfileroot = os.path.join(self.logpath,
                                         str(self.patient_id) + ".log")
-        self.logger.removeHandler(self.fh)
-        self.fh = TimedRotatingFileHandler(self.logfileroot,
-                                           when='H',
-                                           interval=1,
-                                           backupCount=336)
-        self.fh.setLevel(logging.DEBUG)
-        self.fh.setFormatter(self.formatter)
-        self.logger.addHandler(self.fh)
+        fh = IndexedRotatingFileHandler(self.logfileroot,
+                                        when='H',
+                                        interval=1,
+                                        backupCount=336)
+        fh.setLevel(logging.DEBUG)
+        fh.setFormatter(self.formatter)
+        self.log_compressor.attach(fh)
+        self.log_pipeline.replace_handler(self.fh, fh)
+        self.fh = fh
+        if self.session_store is not None:
+            self.session_store.start_session(self.patient_id, self.patient_id_display)
 
         self.generate_new_patient_id_page_button.show()
         self.display(6)
@@ -818,15 +997,60 @@ class MainWindow(QWidget):
         #self.settings_callback(self.settings)
         settings_str = self.settings.to_JSON()
         self.logger.info(settings_str)
+        if self.session_store is not None:
+            self.session_store.record_settings(self.settings)
         j = json.loads(settings_str)
         self.new_settings_signal.emit(j)
 
+    def showPatientHistory(self) -> None:
+        store = self.session_store
+        now = time.time()
+        info = store.session_info(self.patient_id) if store is not None else None
+        if info is None:
+            self.history_summary_label.setText(
+                "No history recorded" if store is None else "No history yet")
+            trend = np.zeros((0, 6))
+            events = []
+        else:
+            started, ended, settingsChanges, alarms = info
+            self.history_summary_label.setText(
+                f"Patient {self.patient_id_display} since "
+                f"{time.strftime('%H:%M', time.localtime(started))}, "
+                f"{int((now - started) // 60)} min, {settingsChanges} setting changes, "
+                f"{alarms} alarms")
+            # 10 s steps over the last hour
+            trend = store.trend(self.patient_id, now - 3600, 10)
+            events = [(t, "Settings: " + self.get_mode_display(mode) + f" RR {rr} TV {tv} "
+                       "I:E " + self.get_ie_ratio_display(ie) + (" running" if run else " stopped"))
+                      for t, run, mode, rr, tv, ie in store.settings_history(self.patient_id)]
+            for t, bits, raised, cleared in store.alarm_history(self.patient_id):
+                changed, text = (raised, "Alarm: ") if raised else (cleared, "Cleared: ")
+                events.append((t, text + ", ".join(a.name for a in AlarmType
+                                                   if changed >> a.value & 1)))
+            events = sorted(events, reverse=True)[:3]
+        minutes = (trend[:, 0] - now) / 60
+        self.history_ppeak_line.setData(minutes, trend[:, 1])
+        self.history_peep_line.setData(minutes, trend[:, 2])
+        self.history_tv_line.setData(minutes, trend[:, 3])
+        self.history_events_label.setText("\n".join(
+            time.strftime('%H:%M:%S ', time.localtime(t)) + text for t, text in events))
+        self.display(17)
+
     def set_settings_callback(
             self, settings_callback: Callable[[Settings], None]) -> None:
         self.settings_callback = settings_callback
 
     def closeEvent(self, *args, **kwargs) -> None:
-        self.comms_handler.terminate()
+        # first, its last batch reads the comms engine's sample ring
+        if self.session_store is not None:
+            self.session_store.stop()
+        # the process engine closes its shared ring on the way out
+        self.graph_reader = None
+        self.comms_handler.stop()
+        # terminating the process engine's thread early would leave its
+        # child and shared ring behind
+        if not self.comms_handler.wait(int(self.comms_handler.STOP_WAIT * 1000)):
+            self.comms_handler.terminate()
 
     def pwrButtonHandler(self):        
         # If ventilating, display message to stop ventilation and power down
@@ -913,6 +1137,9 @@ class MainWindow(QWidget):
             elif event.key() == QtCore.Qt.Key_V:
                 self.ready_to_ventilate_signal.emit()
 
+            elif event.key() == QtCore.Qt.Key_L:
+                self.dump_latency_trace()
+
 
 def main() -> None:
     parser = argparse.ArgumentParser(description='User interface for OVVE')
@@ -937,16 +1164,64 @@ def main() -> None:
     parser.add_argument('-p',
                         "--port",
                         default='/dev/ttyUSB0',
-                        help='Serial port for communication with MCU')
+                        help='Serial port for communication with MCU, or tcp://HOST:PORT, '
+                        'tcp-listen://HOST:PORT or pty for a stand-in')
+
+    parser.add_argument('-r',
+                        "--read_mode",
+                        choices=['select', 'poll'],
+                        default='select',
+                        help='Serial read loop: wake on data (select) or poll every 10ms (poll)')
+
+    parser.add_argument('-e',
+                        "--engine",
+                        choices=['thread', 'asyncio', 'process'],
+                        default='thread',
+                        help='Comms engine: blocking loop (thread), coroutines (asyncio) '
+                        'or a supervised child process (process)')
+
+    parser.add_argument('-l',
+                        "--latency_trace",
+                        action='store_true',
+                        help='Time each sample from serial read to graph repaint, '
+                        'reported with the comms stats and on the L key in developer mode')
+
+    parser.add_argument("--display_rate",
+                        type=float,
+                        default=25.0,
+                        help='Waveform blocks sent to the UI per second, 0 sends every packet')
+
+    parser.add_argument("--log_budget",
+                        type=int,
+                        default=1024,
+                        help='MiB of patient logs kept in /tmp/ovve_logs, oldest deleted first')
+
+    parser.add_argument("--capture_budget",
+                        type=int,
+                        default=1024,
+                        help='MiB of serial captures kept in /home/pi/logs, oldest deleted first')
+
+    parser.add_argument("--session_db",
+                        nargs='?',
+                        const=SESSION_DB_PATH,
+                        help='Keep patient history and trends in this SQLite database '
+                        '(default path if given without one)')
     args = parser.parse_args()
 
+    trace.enabled = args.latency_trace
+
     app = QApplication(sys.argv)
-    window = MainWindow(args.port, args.sim, args.windowed, args.dev_mode)
+    window = MainWindow(args.port, args.sim, args.windowed, args.dev_mode,
+                        args.read_mode, args.engine, args.display_rate,
+                        args.log_budget * 1024 * 1024, args.capture_budget * 1024 * 1024,
+                        args.session_db)
     if window.windowed:
         window.showNormal()
     else:
         window.showFullScreen()
     app.exec_()
+    window.retention.stop()
+    window.log_pipeline.stop()
     sys.exit()
 
 
@@ -165,7 +165,9 @@ class AlarmHandler(QtCore.QObject):
      by the comms handler when alarm bits are received
     '''
     def set_active_alarms(self, alarmbits: int) -> None:
-        self.logger.debug("Got alarm signal " + str(bin(alarmbits)))
+        # only called when the bits change, indexed by utils.log_index
+        self.logger.info("Got alarm signal " + str(bin(alarmbits)),
+                         extra={'alarm_bits': alarmbits})
         self._lock.acquire()
     
         self._active_alarmbits = alarmbits
@@ -0,0 +1,319 @@
+# Copyright 2020 LifeMech  Inc
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+# associated documentation files (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge, publish, distribute,
+# sublicense, and/or sell copies of the Software, and to permit persons to whom the Software
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or
+# substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING
+# BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+
+
+"""
+Raw serial capture: every received byte goes to binary.log and text
+packets from the MCU go to text.log, in a new pair of files every 8 MiB.
+Writes collect in a userspace buffer that goes to the SD card when it is
+full or flush_interval after the oldest unwritten byte, not per read.
+
+fsync policies, from least wear to most crash-safety:
+    'never'   the kernel writes back when it likes (~30 s on Linux)
+    'rotate'  a finished pair is synced once it is rotated out
+    'flush'   every buffer flush is synced, a crash loses at most
+              flush_interval of capture
+
+A write that fails (e.g. a full card, see utils.retention) drops the
+buffer and is counted, it is never raised into the comms thread. If the
+next pair cannot be opened at rotation, capture is off and the bytes are
+counted as dropped until the next max_size, when opening is tried again.
+
+segment_handler is called with the path of each file of a pair once
+it is rotated out, and a function that syncs (as the policy says) and
+closes it. The handler calls that on its own thread before reading the
+file, e.g. SegmentCompressor.submit, so the RX thread never waits on an
+fsync. Without a handler the pair is closed in place.
+"""
+import logging
+import os
+import struct
+import time
+from datetime import datetime
+from functools import partial
+from typing import Callable, Optional
+
+BUFFER_SIZE = 64 * 1024
+FLUSH_INTERVAL = 1.0
+#max 8Mbyte per file so it fit's in one e-mail
+MAX_FILE_SIZE = 8 * 1024 * 1024
+FSYNC_POLICIES = ('never', 'rotate', 'flush')
+# binary.log.ts sidecar: time.time() when the byte at offset was received
+TS_STRUCT = struct.Struct('<dQ')
+TS_INTERVAL = 0.1
+# failed writes are logged at most this often
+ERROR_LOG_INTERVAL = 10.0
+
+
+class CaptureWriter():
+    """
+    One buffered capture file, sizes are counted rather than asked for.
+    With timestamps a TS_STRUCT entry goes to path + '.ts' at most every
+    TS_INTERVAL, for replay and seeking by time.
+    """
+    def __init__(self, path: str, buffer_size: int, sync_on_flush: bool,
+                 timestamps: bool = False) -> None:
+        self.path = path
+        self.file = open(path, "wb", buffering=0)
+        self.buffer = bytearray()
+        self.buffer_size = buffer_size
+        self.sync_on_flush = sync_on_flush
+        self.size = 0
+        self._flushDue = None
+        self.tsFile = open(path + '.ts', "wb", buffering=0) if timestamps else None
+        self.tsBuffer = bytearray()
+        self._nextStamp = 0.0
+        self._nextErrorLog = 0.0
+        #statistics
+        self.statBytesWritten = 0
+        self.statFlushes = 0
+        self.statFsyncs = 0
+        self.statWriteErrors = 0
+        self.statBytesDropped = 0
+
+    def write(self, byteData, now: float) -> None:
+        if not byteData:
+            return
+        if self._flushDue is None:
+            self._flushDue = now
+        if self.tsFile is not None and now >= self._nextStamp:
+            self._nextStamp = now + TS_INTERVAL
+            self.tsBuffer += TS_STRUCT.pack(time.time(), self.size)
+        self.buffer += byteData
+        self.size += len(byteData)
+        if len(self.buffer) >= self.buffer_size:
+            self.flush()
+
+    def due(self, now: float, interval: float) -> bool:
+        return self._flushDue is not None and now - self._flushDue >= interval
+
+    def flush(self) -> None:
+        if self.buffer:
+            size = len(self.buffer)
+            try:
+                write_all(self.file, self.buffer)
+                self.statFlushes += 1
+                if self.tsBuffer:
+                    write_all(self.tsFile, self.tsBuffer)
+                if self.sync_on_flush:
+                    self.sync()
+            except OSError as e:
+                # only what was not written is dropped
+                self.write_error(e)
+            self.statBytesWritten += size - len(self.buffer)
+            self.buffer.clear()
+            self.tsBuffer.clear()
+        self._flushDue = None
+
+    def write_error(self, e: OSError) -> None:
+        self.statWriteErrors += 1
+        self.statBytesDropped += len(self.buffer)
+        now = time.monotonic()
+        if now >= self._nextErrorLog:
+            self._nextErrorLog = now + ERROR_LOG_INTERVAL
+            logging.getLogger().warning('Capture write to %s failed, %d bytes dropped: %s',
+                                        self.path, self.statBytesDropped, e)
+
+    def sync(self) -> None:
+        os.fsync(self.file.fileno())
+        self.statFsyncs += 1
+
+    def close(self, sync: bool) -> None:
+        if self.file.closed:
+            return
+        self.flush()
+        if sync and not self.sync_on_flush:
+            try:
+                self.sync()
+            except OSError as e:
+                self.write_error(e)
+        self.file.close()
+        if self.tsFile is not None:
+            self.tsFile.close()
+
+
+def write_all(f, data: bytearray) -> None:
+    """ Writes data to an unbuffered file, where a write may be short, emptying it """
+    while data:
+        with memoryview(data) as view:
+            n = f.write(view)
+        del data[:n]
+
+
+def is_capture_file(name: str) -> bool:
+    return name.endswith('] binary.log') or name.endswith('] text.log')
+
+
+class CaptureLog():
+    def __init__(self, log_dir: str = '/home/pi/logs',
+                 flush_interval: float = FLUSH_INTERVAL,
+                 fsync: str = 'rotate',
+                 buffer_size: int = BUFFER_SIZE,
+                 max_size: int = MAX_FILE_SIZE,
+                 segment_handler: Optional[Callable[[str, Callable], None]] = None) -> None:
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError('unknown fsync policy ' + fsync)
+        self.dirName=log_dir
+        if not os.path.exists(self.dirName):
+            os.makedirs(self.dirName)
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self.buffer_size = buffer_size
+        self.max_size = max_size
+        self.segment_handler = segment_handler
+        self.binaryLog = None
+        self.textLog = None
+        #statistics, including files already rotated out
+        self.statBytesWritten = 0
+        self.statFlushes = 0
+        self.statFsyncs = 0
+        self.statRotations = 0
+        self.statBytesDropped = 0
+        # written only by the segment_handler's thread
+        self.statSegmentFsyncs = 0
+        self.statOpenErrors = 0
+        # bytes received while capture is off
+        self.skipped = 0
+        self.open_files()
+
+    def writers(self) -> list:
+        return [writer for writer in (self.binaryLog, self.textLog) if writer is not None]
+
+    def open_files(self) -> None:
+        for writer in self.writers():
+            self.statBytesWritten += writer.statBytesWritten
+            self.statFlushes += writer.statFlushes
+            self.statFsyncs += writer.statFsyncs
+            self.statBytesDropped += writer.statBytesDropped
+        self.binaryLog = None
+        self.textLog = None
+        # retention removes directories it emptied
+        os.makedirs(self.dirName, exist_ok=True)
+        # never reuse a name, a restart must not truncate the last pair
+        dateStr=datetime.now().isoformat(timespec='seconds')
+        stamp = dateStr
+        n = 0
+        while os.path.exists(str(self.dirName)+"/["+stamp+"] binary.log"):
+            n += 1
+            stamp = dateStr + "." + str(n)
+        syncOnFlush = self.fsync == 'flush'
+        binaryLog = CaptureWriter(str(self.dirName)+"/["+stamp+"] binary.log",
+                                  self.buffer_size, syncOnFlush, timestamps=True)
+        try:
+            self.textLog = CaptureWriter(str(self.dirName)+"/["+stamp+"] text.log",
+                                         self.buffer_size, syncOnFlush, timestamps=True)
+        except OSError:
+            # no half pair left behind
+            binaryLog.close(False)
+            for path in (binaryLog.path, binaryLog.path + '.ts'):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            raise
+        self.binaryLog = binaryLog
+
+    def reopen(self) -> None:
+        try:
+            self.open_files()
+        except OSError as e:
+            # e.g. a full card, never raised into the comms thread
+            self.statOpenErrors += 1
+            logging.getLogger().warning('Capture files in %s could not be opened, '
+                                        'capture is off: %s', self.dirName, e)
+
+    def write_binary(self, byteData) -> None:
+        """ Called after every read, also with no data, so flushes stay on time """
+        if self.binaryLog is None:
+            self.statBytesDropped += len(byteData)
+            self.skipped += len(byteData)
+            if self.skipped > self.max_size:
+                self.skipped = 0
+                self.reopen()
+            return
+        now = time.monotonic()
+        self.binaryLog.write(byteData, now)
+        self.poll(now)
+        # Assumes that binaryFile larger than textLogFile
+        if self.binaryLog.size > self.max_size:
+            self.statRotations += 1
+            self.rotate()
+
+    def write_text(self, byteData) -> None:
+        if self.textLog is None:
+            self.statBytesDropped += len(byteData)
+            return
+        now = time.monotonic()
+        self.textLog.write(byteData, now)
+        self.poll(now)
+
+    def rotate(self) -> None:
+        finished = (self.binaryLog, self.textLog)
+        if self.segment_handler is None:
+            self.close()
+            self.reopen()
+            return
+        # only the buffers are written here, sync and close happen on the
+        # handler's thread
+        for writer in finished:
+            writer.flush()
+        self.reopen()
+        for writer in finished:
+            self.segment_handler(writer.path, partial(self.close_segment, writer))
+
+    def close_segment(self, writer: CaptureWriter) -> None:
+        fsyncs = writer.statFsyncs
+        writer.close(self.fsync != 'never')
+        self.statSegmentFsyncs += writer.statFsyncs - fsyncs
+
+    def poll(self, now: float) -> None:
+        for writer in self.writers():
+            if writer.due(now, self.flush_interval):
+                writer.flush()
+
+    def flush(self) -> None:
+        for writer in self.writers():
+            writer.flush()
+
+    def live_files(self) -> list:
+        """ Paths of the pair being written, with their sidecars """
+        paths = []
+        for writer in self.writers():
+            paths.append(writer.path)
+            if writer.tsFile is not None:
+                paths.append(writer.path + '.ts')
+        return paths
+
+    def close(self) -> None:
+        sync = self.fsync != 'never'
+        for writer in self.writers():
+            writer.close(sync)
+
+    def bytes_written(self) -> int:
+        """ Total bytes handed to the card, for endurance budgeting """
+        return self.statBytesWritten + sum(w.statBytesWritten for w in self.writers())
+
+    def stats_summary(self) -> list:
+        writers = self.writers()
+        flushes = self.statFlushes + sum(w.statFlushes for w in writers)
+        fsyncs = self.statFsyncs + self.statSegmentFsyncs + sum(w.statFsyncs for w in writers)
+        dropped = self.statBytesDropped + sum(w.statBytesDropped for w in writers)
+        return ['Capture log: written:' + str(self.bytes_written()) + ' flushes:' + str(flushes) +
+                ' fsyncs:' + str(fsyncs) + ' rotations:' + str(self.statRotations) +
+                ' dropped:' + str(dropped) + ' open errors:' + str(self.statOpenErrors) +
+                ' fsync policy:' + self.fsync]
@@ -0,0 +1,157 @@
+# Copyright 2020 LifeMech  Inc
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+# associated documentation files (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge, publish, distribute,
+# sublicense, and/or sell copies of the Software, and to permit persons to whom the Software
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or
+# substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING
+# BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+
+
+"""
+Offline decoding of [date] binary.log captures. The file is memory
+mapped and handled as one array: sync sequences are found with a single
+vectorized compare, the headers of all candidates are checked at once,
+and the CRCs of all frames of the same length are computed together.
+Frames are checked like FrameDecoder checks them, except that a frame
+with a bad CRC does not hide the ones starting inside it, so a damaged
+capture can give a few more packets than the UI saw.
+"""
+import mmap
+import os
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from utils import crc
+from utils.frame_decoder import SYNC, PROTOCOL_VERSION, MAX_PAYLOAD_LEN, HEADER_LEN, CRC_LEN
+from utils.in_packet import STATUS_RAW_DTYPE, decode_status_array
+from utils.segment_compressor import SUFFIX, SegmentReader, read_timestamps
+from utils.session_recorder import STATUS_DTYPE
+
+PACKET_TYPE_STATUS = 0x01
+
+# one entry per frame with a valid header
+FRAME_DTYPE = np.dtype([('offset', '<i8'), ('seq_num', '<u2'), ('type', 'u1'),
+                        ('length', 'u1'), ('crc_ok', '?')])
+
+
+def load_capture(path: str) -> np.ndarray:
+    """
+    The bytes of a capture as a uint8 array, mapped rather than read for
+    plain files. Compressed segments are decompressed into memory.
+    """
+    if path.endswith(SUFFIX):
+        reader = SegmentReader(path)
+        data = b''.join(reader.blocks())
+        reader.close()
+        return np.frombuffer(data, np.uint8)
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return np.zeros(0, np.uint8)
+        # the mapping stays valid after the file is closed
+        return np.frombuffer(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ), np.uint8)
+
+
+def scan_frames(buf: np.ndarray) -> np.ndarray:
+    """
+    Every frame with a sync, version 4 and a complete length in buf, as a
+    FRAME_DTYPE array in file order. A valid frame hides any sync bytes
+    inside it, as in the streaming decoder.
+    """
+    end = len(buf) - HEADER_LEN - CRC_LEN
+    if end < 0:
+        return np.zeros(0, FRAME_DTYPE)
+    starts = np.flatnonzero((buf[:end + 1] == SYNC[0]) & (buf[1:end + 2] == SYNC[1]) &
+                            (buf[2:end + 3] == SYNC[2]))
+    starts = starts[buf[starts + 5] == PROTOCOL_VERSION]
+    lengths = buf[starts + 7]
+    keep = (lengths <= MAX_PAYLOAD_LEN) & (starts + lengths <= end)
+    starts = starts[keep]
+    lengths = lengths[keep]
+
+    frames = np.zeros(len(starts), FRAME_DTYPE)
+    frames['offset'] = starts
+    frames['seq_num'] = buf[starts + 3] | (buf[starts + 4].astype(np.uint16) << 8)
+    frames['type'] = buf[starts + 6]
+    frames['length'] = lengths
+    # the CRC covers the header after the sync and the payload
+    for length in np.unique(lengths):
+        group = np.flatnonzero(lengths == length)
+        first = starts[group]
+        rows = sliding_window_view(buf, HEADER_LEN - 3 + int(length))[first + 3]
+        crcEnd = first + HEADER_LEN + int(length)
+        received = buf[crcEnd] | (buf[crcEnd + 1].astype(np.uint16) << 8)
+        frames['crc_ok'][group] = crc.compute_rows(rows) == received
+
+    valid = frames[frames['crc_ok']]
+    ends = valid['offset'] + HEADER_LEN + valid['length'] + CRC_LEN
+    if len(valid) > 1 and np.any(valid['offset'][1:] < ends[:-1]):
+        # rare: a sync and good CRC inside another frame, drop the inner one
+        hidden = np.zeros(len(valid), bool)
+        lastEnd = -1
+        for i in range(len(valid)):
+            if valid['offset'][i] < lastEnd:
+                hidden[i] = True
+            else:
+                lastEnd = ends[i]
+        frames['crc_ok'][np.isin(frames['offset'], valid['offset'][hidden])] = False
+    return frames
+
+
+def decode_status(buf: np.ndarray, frames: np.ndarray, stamps: tuple = ((), ())) -> np.ndarray:
+    """
+    The status packets among frames as a STATUS_DTYPE array, the same
+    layout as utils.session_recorder.decode_status. time is interpolated
+    from (offsets, times) of a .ts sidecar, nan without one.
+    """
+    status = frames[frames['crc_ok'] & (frames['type'] == PACKET_TYPE_STATUS) &
+                    (frames['length'] >= STATUS_RAW_DTYPE.itemsize)]
+    out = np.zeros(len(status), STATUS_DTYPE)
+    if not len(status):
+        return out
+    payloadStart = status['offset'] + HEADER_LEN
+    rows = sliding_window_view(buf, STATUS_RAW_DTYPE.itemsize)[payloadStart]
+    raw = rows.view(STATUS_RAW_DTYPE).reshape(-1)
+    offsets, times = stamps
+    if len(offsets):
+        out['time'] = np.interp(status['offset'], offsets, times)
+    else:
+        out['time'] = np.nan
+    decode_status_array(raw, status['seq_num'], out)
+    return out
+
+
+def read_capture(path: str) -> tuple:
+    """ (status array, frames) of a capture file or compressed segment """
+    buf = load_capture(path)
+    frames = scan_frames(buf)
+    base = path[:-len(SUFFIX)] if path.endswith(SUFFIX) else path
+    return decode_status(buf, frames, read_timestamps(base)), frames
+
+
+def summary(frames: np.ndarray, status: np.ndarray) -> dict:
+    """ Counts as in CommsProtocol, all packet types share the sequence """
+    valid = frames[frames['crc_ok']]
+    gaps = (np.diff(valid['seq_num'].astype(np.int64)) - 1) % 65536
+    gaps = gaps[gaps != 0]
+    return {
+        'frames': int(len(valid)),
+        'crc_errors': int(len(frames) - len(valid)),
+        'status_packets': int(len(status)),
+        'other_packets': int(len(valid) - len(status)),
+        'seq_errors': int(len(gaps)),
+        # a jump backwards is the MCU restarting, not lost frames
+        'lost_frames': int(np.sum(gaps[gaps < 0x8000])),
+        'first_time': float(status['time'][0]) if len(status) else None,
+        'last_time': float(status['time'][-1]) if len(status) else None,
+    }
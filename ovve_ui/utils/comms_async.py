@@ -0,0 +1,196 @@
+# Copyright 2020 LifeMech  Inc
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+# associated documentation files (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge, publish, distribute,
+# sublicense, and/or sell copies of the Software, and to permit persons to whom the Software
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or
+# substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING
+# BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+
+
+"""
+asyncio comms engine. Runs reading, decoding, replying, capture logging and
+stats reporting as separate coroutines joined by bounded queues, so slow
+log I/O never delays the command reply.
+"""
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.comms_link import CommsLink
+from utils.latency_histogram import LatencyHistogram
+from utils.transports import TransportError
+
+RX_QUEUE_SIZE = 256
+LOG_QUEUE_SIZE = 1024
+# display ticks and stats when no batcher sets the pace
+TICK_INTERVAL = 1.0
+
+
+class AsyncCommsLink(CommsLink):
+    """
+    Drop-in replacement for CommsLink: same constructor, slots and
+    new_params/new_alarms/lost_comms_signal signals, which are emitted from
+    the event loop running in this thread.
+    """
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.statRxQueueDrops = 0
+        self.statLogQueueDrops = 0
+        self.stageLatency = {
+            'rx-queue': LatencyHistogram('Async rx queue wait'),
+            'decode': LatencyHistogram('Async decode'),
+            'reply': LatencyHistogram('Async reply'),
+            'log': LatencyHistogram('Async log write'),
+        }
+        self.engine.stats_handler = self.log_queue_stats
+
+    def _put(self, queue: asyncio.Queue, item) -> bool:
+        try:
+            queue.put_nowait(item)
+            return True
+        except asyncio.QueueFull:
+            return False
+
+    def _log(self, item) -> None:
+        if not self._put(self.logQueue, item):
+            self.statLogQueueDrops += 1
+
+    def _on_readable(self) -> None:
+        try:
+            byteData = self.transport.read_available(0)
+        except TransportError:
+            self.logger.exception('Transport read failed')
+            self.done = True
+            return
+        if byteData and not self._put(self.rxQueue, (time.perf_counter(), byteData)):
+            self.statRxQueueDrops += 1
+
+    async def reader(self) -> None:
+        loop = asyncio.get_event_loop()
+        fd = self.transport.fileno()
+        if fd is not None:
+            loop.add_reader(fd, self._on_readable)
+            try:
+                while not self.done:
+                    await asyncio.sleep(self.SER_TIMEOUT)
+            finally:
+                loop.remove_reader(fd)
+            return
+        # transports without a descriptor block in a dedicated thread
+        while not self.done:
+            try:
+                byteData = await loop.run_in_executor(self.readExecutor,
+                                                      self.transport.read_available,
+                                                      self.SER_TIMEOUT)
+            except TransportError:
+                self.logger.exception('Transport read failed')
+                self.done = True
+                return
+            if byteData:
+                rxTime = time.perf_counter()
+                await self.rxQueue.put((rxTime, byteData))
+
+    async def decoder(self) -> None:
+        while True:
+            rxTime, byteData = await self.rxQueue.get()
+            start = time.perf_counter()
+            self.stageLatency['rx-queue'].record(start - rxTime)
+            self._log(('binary', byteData))
+            self.protocol.feed(byteData, rxTime)
+            self.stageLatency['decode'].record(time.perf_counter() - start)
+
+    async def replier(self) -> None:
+        loop = asyncio.get_event_loop()
+        while True:
+            await self.replyPending.wait()
+            self.replyPending.clear()
+            start = time.perf_counter()
+            # the write may block on the UART, keep it off the event loop
+            await loop.run_in_executor(self.writeExecutor, self.protocol.send_reply)
+            self.stageLatency['reply'].record(time.perf_counter() - start)
+
+    async def log_writer(self) -> None:
+        loop = asyncio.get_event_loop()
+        capture = self.engine.capture
+        while True:
+            try:
+                kind, byteData = await asyncio.wait_for(self.logQueue.get(),
+                                                        capture.flush_interval)
+            except asyncio.TimeoutError:
+                # nothing came in, write out what the capture still buffers
+                await loop.run_in_executor(self.logExecutor, capture.poll,
+                                           time.monotonic())
+                continue
+            start = time.perf_counter()
+            if kind == 'binary':
+                await loop.run_in_executor(self.logExecutor, capture.write_binary, byteData)
+            else:
+                await loop.run_in_executor(self.logExecutor, capture.write_text, byteData)
+            self.stageLatency['log'].record(time.perf_counter() - start)
+
+    def log_queue_stats(self) -> None:
+        # called by the engine after its own stats report
+        self.logger.warning('Async queues: rx=' + str(self.rxQueue.qsize()) +
+                            ' (drops ' + str(self.statRxQueueDrops) + ') log=' +
+                            str(self.logQueue.qsize()) + ' (drops ' +
+                            str(self.statLogQueueDrops) + ')')
+        for histogram in self.stageLatency.values():
+            self.logger.warning(histogram.summary())
+
+    async def ticker(self) -> None:
+        # flushes the last samples of a burst once the display tick is due
+        # and reports stats
+        batcher = self.engine.batcher
+        interval = batcher.interval if batcher is not None else TICK_INTERVAL
+        while True:
+            await asyncio.sleep(interval)
+            self.engine.poll()
+
+    async def main(self) -> None:
+        self.rxQueue = asyncio.Queue(RX_QUEUE_SIZE)
+        self.logQueue = asyncio.Queue(LOG_QUEUE_SIZE)
+        self.replyPending = asyncio.Event()
+        self.protocol.reply_handler = self.replyPending.set
+        self.protocol.text_handler = lambda byteData: self._log(('text', bytes(byteData)))
+
+        coros = [self.decoder(), self.replier(), self.log_writer(), self.ticker()]
+        workers = [asyncio.ensure_future(coro) for coro in coros]
+        try:
+            await self.reader()
+        finally:
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+
+    def run(self) -> None:
+        if not self.engine.open():
+            self.engine.close()
+            return
+
+        self.readExecutor = ThreadPoolExecutor(1)
+        self.writeExecutor = ThreadPoolExecutor(1)
+        self.logExecutor = ThreadPoolExecutor(1)
+        # recorder blocks are written next to the capture, not on the loop
+        self.engine.recorder.executor = self.logExecutor
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            loop.run_until_complete(self.main())
+        except:
+            self.logger.exception("Async comms engine stopped")
+        finally:
+            loop.close()
+            for executor in (self.readExecutor, self.writeExecutor, self.logExecutor):
+                executor.shutdown(wait=True)
+            self.engine.recorder.executor = None
+            self.engine.close()
@@ -0,0 +1,129 @@
+# Copyright 2020 LifeMech  Inc
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+# associated documentation files (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge, publish, distribute,
+# sublicense, and/or sell copies of the Software, and to permit persons to whom the Software
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or
+# substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING
+# BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+
+
+"""
+Comms engine process started by utils.comms_process.ProcessCommsLink. No
+Qt in here: samples go into the shared ring, everything else goes back as
+tuples over the events pipe:
+    ('waveform', Params, head)  display tick, head is the ring position
+    ('status', StatusChange)    when a slow status field changes
+    ('params', Params)          every packet when display_rate is 0
+    ('alarms', alarmbits)
+    ('log', level, message)     records for the UI process's log files
+    ('metrics', dict)           LinkMetrics snapshot every STATS_INTERVAL
+    ('files', list)             the open log files, at start and with metrics
+and commands arrive over the commands pipe:
+    ('settings', dict) ('ackbits', int) ('calibrate',) ('ventilate',) ('stop',)
+"""
+import logging
+import sys
+import threading
+from multiprocessing.connection import Connection
+
+from utils.comms_engine import CommsEngine, BAUD, SER_TIMEOUT, SER_WRITE_TIMEOUT
+from utils.comms_protocol import CommsProtocol
+from utils.latency_trace import trace
+from utils.sample_ring import SharedSampleRing
+from utils.transports import make_transport
+from utils.waveform_batch import WAVEFORM_DTYPE
+
+# exit code when the port cannot be opened
+EXIT_NO_PORT = 2
+
+
+class PipeLogHandler(logging.Handler):
+    """ Forwards records to the UI process, which owns the log files """
+    def __init__(self, send) -> None:
+        logging.Handler.__init__(self)
+        self.send = send
+
+    def emit(self, record: logging.LogRecord) -> None:
+        try:
+            self.send(('log', record.levelno, self.format(record)))
+        except Exception:
+            self.handleError(record)
+
+
+def command_loop(commands: Connection, protocol: CommsProtocol, done: threading.Event) -> None:
+    while True:
+        try:
+            msg = commands.recv()
+        except (EOFError, OSError):
+            # the UI process is gone
+            break
+        kind = msg[0]
+        if kind == 'settings':
+            protocol.update_settings(msg[1])
+        elif kind == 'ackbits':
+            protocol.set_alarm_ackbits(msg[1])
+        elif kind == 'calibrate':
+            protocol.ready_to_calibrate()
+        elif kind == 'ventilate':
+            protocol.ready_to_ventilate()
+        elif kind == 'stop':
+            break
+    done.set()
+
+
+def run_child(port: str, read_mode: str, log_dir: str, display_rate: float,
+              ring_name: str, ring_capacity: int, trace_enabled: bool, log_level: int,
+              commands: Connection, events: Connection) -> None:
+    sendLock = threading.Lock()
+
+    def send(msg) -> None:
+        # the read loop and the TX writer both log
+        with sendLock:
+            events.send(msg)
+
+    # the UI process's level, its handlers decide where each record goes
+    logger = logging.getLogger()
+    logger.handlers = [PipeLogHandler(send)]
+    logger.setLevel(log_level)
+    trace.enabled = trace_enabled
+
+    ring = None
+    if display_rate > 0:
+        ring = SharedSampleRing(WAVEFORM_DTYPE, ring_capacity, ring_name)
+    engine = CommsEngine(make_transport(port, BAUD, SER_TIMEOUT, SER_WRITE_TIMEOUT),
+                         read_mode, log_dir, display_rate, ring,
+                         params_handler=lambda params: send(('params', params)),
+                         waveform_handler=lambda block: send(('waveform', block.params,
+                                                              block.head)),
+                         status_handler=lambda change: send(('status', change)),
+                         alarms_handler=lambda alarmbits: send(('alarms', alarmbits)))
+
+    def report() -> None:
+        send(('metrics', engine.protocol.metrics.snapshot()))
+        send(('files', engine.live_files()))
+    engine.stats_handler = report
+    send(('files', engine.live_files()))
+
+    done = threading.Event()
+    threading.Thread(target=command_loop, args=(commands, engine.protocol, done),
+                     name='commands', daemon=True).start()
+
+    if not engine.open():
+        engine.close()
+        sys.exit(EXIT_NO_PORT)
+    try:
+        engine.run(done.is_set)
+    finally:
+        engine.close()
+        if ring is not None:
+            ring.close()
@@ -0,0 +1,165 @@
+# Copyright 2020 LifeMech  Inc
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+# associated documentation files (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge, publish, distribute,
+# sublicense, and/or sell copies of the Software, and to permit persons to whom the Software
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or
+# substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING
+# BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+
+
+"""
+Qt-free comms engine shared by CommsLink (thread), AsyncCommsLink and the
+comms child process. It owns the protocol, TX writer, capture and session
+logs and the display batching; the front ends only supply the handlers
+and decide where the read loop runs.
+"""
+import logging
+import time
+from typing import Callable, Optional
+
+from utils.capture_log import CaptureLog, is_capture_file
+from utils.comms_protocol import CommsProtocol
+from utils.params import Params
+from utils.sample_ring import SampleRing
+from utils.segment_compressor import SegmentCompressor
+from utils.session_recorder import SessionRecorder
+from utils.status_diff import StatusDiff
+from utils.transports import Transport
+from utils.tx_writer import TxWriter
+from utils.waveform_batch import WaveformBatcher, WAVEFORM_DTYPE
+
+BAUD = 500000
+SER_TIMEOUT = 0.065
+SER_WRITE_TIMEOUT = None
+STATS_INTERVAL = 10.0
+# about 40 s at 100 samples/s, readers take their own cursor
+RING_CAPACITY = 4096
+
+
+class CommsEngine():
+    # With display_rate > 0 samples go into samples (a SampleRing is made
+    # when none is given), waveform_handler gets a WaveformBlock once per
+    # display tick and status_handler a StatusChange when a slow status
+    # field changes; with 0 params_handler gets every packet.
+    # stats_handler is called after each stats report.
+    def __init__(self, transport: Transport, read_mode: str = 'select',
+                 log_dir: str = '/home/pi/logs', display_rate: float = 25.0,
+                 samples: Optional[SampleRing] = None,
+                 params_handler: Optional[Callable[[Params], None]] = None,
+                 waveform_handler: Optional[Callable] = None,
+                 status_handler: Optional[Callable] = None,
+                 alarms_handler: Optional[Callable[[int], None]] = None,
+                 stats_handler: Optional[Callable[[], None]] = None) -> None:
+        self.logger = logging.getLogger()
+        self.transport = transport
+        self.read_mode = read_mode
+        self.stats_handler = stats_handler
+        self.samples = None
+        self.batcher = None
+        self.status = None
+        if display_rate > 0:
+            if samples is None:
+                samples = SampleRing(WAVEFORM_DTYPE, RING_CAPACITY)
+            self.samples = samples
+            self.batcher = WaveformBatcher(display_rate, waveform_handler, samples)
+            self.status = StatusDiff(status_handler)
+            params_handler = self.add_sample
+        # rotated capture pairs, and those an earlier run left, are
+        # compressed in the background
+        self.compressor = SegmentCompressor()
+        self.compressor.submit_pending(log_dir, is_capture_file)
+        self.compressor.start()
+        self.capture = CaptureLog(log_dir, segment_handler=self.compressor.submit)
+        self.recorder = SessionRecorder(log_dir)
+        self.protocol = CommsProtocol(transport, params_handler,
+                                      alarms_handler, self.capture.write_text)
+        self.protocol.recorder = self.recorder
+        # replies go out on their own thread so a blocked write
+        # (SER_WRITE_TIMEOUT = None) never stops reception
+        self.txWriter = TxWriter(self.protocol)
+        self.protocol.reply_handler = self.txWriter.post_reply
+        self.nextStats = time.monotonic() + STATS_INTERVAL
+
+    def add_sample(self, params: Params) -> None:
+        # status first, the UI draws the block with the state it came in
+        self.status.add(params)
+        self.batcher.add(params)
+
+    def open(self) -> bool:
+        """ Opens the transport and starts from a clean input buffer """
+        if not self.transport.open():
+            self.logger.error('Serial Initialization failed')
+            return False
+        time.sleep(1)
+        self.logger.debug('Serial Init Successful')
+        self.transport.reset_input_buffer()
+        self.protocol.reset()
+        self.nextStats = time.monotonic() + STATS_INTERVAL
+        return True
+
+    def read(self) -> bytes:
+        if self.read_mode == 'poll':
+            return self.transport.read(512)
+        return self.transport.read_available(SER_TIMEOUT)
+
+    def process(self, byteData, rxTime: float) -> None:
+        self.capture.write_binary(byteData)
+        self.protocol.feed(byteData, rxTime)
+
+    def poll(self) -> None:
+        """ Display tick, recorder flush and stats report, call at least every SER_TIMEOUT """
+        if self.batcher is not None:
+            self.batcher.poll(time.perf_counter())
+        now = time.monotonic()
+        # a quiet link must not hold recorded packets back
+        self.recorder.poll(now)
+        #do some statistics logging regularly
+        if now >= self.nextStats:
+            self.nextStats += STATS_INTERVAL
+            for line in self.stats_summary():
+                self.logger.warning(line)
+            if self.stats_handler is not None:
+                self.stats_handler()
+
+    def run(self, is_done: Callable[[], bool]) -> None:
+        """ Blocking read loop, returns once is_done() is true """
+        self.txWriter.start()
+        while not is_done():
+            byteData = self.read()
+            self.process(byteData, time.perf_counter())
+            self.poll()
+            if self.read_mode == 'poll':
+                time.sleep(0.01) #check every 10ms for new data packets
+
+    def live_files(self) -> list:
+        """ Files the engine has open, retention must keep them """
+        return self.capture.live_files() + [self.recorder.path]
+
+    def stats_summary(self) -> list:
+        lines = self.protocol.stats_summary()
+        if self.txWriter.is_alive():
+            lines += self.txWriter.stats_summary()
+        lines += self.recorder.stats_summary() + self.capture.stats_summary()
+        if self.batcher is not None:
+            lines += (self.batcher.stats_summary() + self.status.stats_summary() +
+                      self.samples.stats_summary())
+        return lines
+
+    def close(self) -> None:
+        if self.txWriter.is_alive():
+            self.txWriter.stop()
+            self.txWriter.join(1)
+        self.recorder.close()
+        self.capture.close()
+        self.compressor.stop()
+        self.transport.close()
@@ -0,0 +1,214 @@
+# Copyright 2020 LifeMech  Inc
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+# associated documentation files (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge, publish, distribute,
+# sublicense, and/or sell copies of the Software, and to permit persons to whom the Software
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or
+# substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING
+# BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+
+
+"""
+Runs the comms engine in its own process (utils.comms_child) so GUI
+rendering cannot starve the serial reader of the GIL. ProcessCommsLink
+has the same signals and slots as CommsLink, and restarts the child if it
+dies.
+"""
+import logging
+import multiprocessing
+import sys
+import threading
+import time
+from collections import deque
+
+from utils import comms_child
+from utils.comms_child import run_child
+from utils.latency_trace import trace
+from utils.params import Params
+from utils.sample_ring import SharedSampleRing
+from utils.status_diff import StatusChange
+from utils.waveform_batch import WaveformBlock, WAVEFORM_DTYPE
+from PyQt5.QtCore import QThread, pyqtSignal
+
+RING_CAPACITY = 4096
+# more restarts than this within RESTART_WINDOW seconds is a lost link
+MAX_RESTARTS = 5
+RESTART_WINDOW = 60.0
+RESTART_DELAY = 1.0
+# for each join of the child in stop_child, a terminate comes in between
+CHILD_JOIN_TIMEOUT = 1.0
+
+
+class ProcessCommsLink(QThread):
+    # seconds stop() may take: two joins, the pump noticing and the ring close
+    STOP_WAIT = 2 * CHILD_JOIN_TIMEOUT + 1.0
+    new_params = pyqtSignal(Params)
+    new_waveform = pyqtSignal(WaveformBlock)
+    new_status = pyqtSignal(StatusChange)
+    new_alarms = pyqtSignal(int)
+    lost_comms_signal = pyqtSignal()
+
+    def __init__(self, port: str, read_mode: str = 'select',
+                 log_dir: str = '/home/pi/logs', display_rate: float = 25.0) -> None:
+        QThread.__init__(self)
+        self.logger = logging.getLogger()
+        self.PORT = port
+        self.READ_MODE = read_mode
+        self.log_dir = log_dir
+        self.display_rate = display_rate
+        self.done = False
+        self.samples = None
+        if display_rate > 0:
+            self.samples = SharedSampleRing(WAVEFORM_DTYPE, RING_CAPACITY)
+        # spawn, so the child does not inherit Qt or our threads
+        self.ctx = multiprocessing.get_context('spawn')
+        self.child = None
+        self.commands = None
+        self.commandsLock = threading.Lock()
+        # replayed to a restarted child
+        self.settings_dict = None
+        self.ackbits = 0
+        self.calibrating = False
+        self.metrics = {}
+        self.liveFiles = []
+        #statistics
+        self.statRestarts = 0
+
+    def send(self, msg: tuple) -> None:
+        with self.commandsLock:
+            if self.commands is None:
+                return
+            try:
+                self.commands.send(msg)
+            except OSError:
+                # the child died, the supervisor restarts it and replays state
+                pass
+
+    def update_settings(self, settings_dict: dict) -> None:
+        self.settings_dict = settings_dict
+        self.send(('settings', settings_dict))
+
+    def ready_to_calibrate(self):
+        self.calibrating = True
+        self.send(('calibrate',))
+
+    def ready_to_ventilate(self):
+        self.calibrating = False
+        self.send(('ventilate',))
+
+    def set_alarm_ackbits(self, ackbits: int) -> None:
+        self.ackbits = ackbits
+        self.send(('ackbits', ackbits))
+
+    def stop(self) -> None:
+        self.done = True
+
+    def link_metrics(self) -> dict:
+        """ Latest link rates from the child, refreshed every 10 s """
+        return self.metrics
+
+    def live_files(self) -> list:
+        """ Log files the child has open, as last reported """
+        return self.liveFiles
+
+    def start_child(self):
+        commandsRx, commandsTx = self.ctx.Pipe(duplex=False)
+        eventsRx, eventsTx = self.ctx.Pipe(duplex=False)
+        ringName = self.samples.name if self.samples is not None else None
+        self.child = self.ctx.Process(target=run_child, name='comms', daemon=True,
+                                      args=(self.PORT, self.READ_MODE, self.log_dir,
+                                            self.display_rate, ringName, RING_CAPACITY,
+                                            trace.enabled, self.logger.getEffectiveLevel(),
+                                            commandsRx, eventsTx))
+        # spawn runs the parent's __main__ again in the child, for the UI
+        # script that is PyQt5, pyqtgraph and GPIO. The child only needs
+        # comms_child, so that is its main module.
+        main = sys.modules['__main__']
+        sys.modules['__main__'] = comms_child
+        try:
+            self.child.start()
+        finally:
+            sys.modules['__main__'] = main
+        # our copies of the child's ends, closed so its exit reads as EOF
+        commandsRx.close()
+        eventsTx.close()
+        with self.commandsLock:
+            self.commands = commandsTx
+        if self.settings_dict is not None:
+            self.send(('settings', self.settings_dict))
+        self.send(('ackbits', self.ackbits))
+        self.send(('calibrate',) if self.calibrating else ('ventilate',))
+        return eventsRx
+
+    def stop_child(self, events) -> None:
+        self.send(('stop',))
+        self.child.join(CHILD_JOIN_TIMEOUT)
+        if self.child.is_alive():
+            self.child.terminate()
+            self.child.join(CHILD_JOIN_TIMEOUT)
+        with self.commandsLock:
+            self.commands.close()
+            self.commands = None
+        events.close()
+
+    def pump(self, events) -> None:
+        """ Turns child events into signals until the child exits or stop() """
+        while not self.done:
+            if not events.poll(0.1):
+                if not self.child.is_alive():
+                    return
+                continue
+            try:
+                msg = events.recv()
+            except (EOFError, OSError):
+                return
+            kind = msg[0]
+            if kind == 'waveform':
+                self.new_waveform.emit(WaveformBlock(msg[1], msg[2]))
+            elif kind == 'status':
+                self.new_status.emit(msg[1])
+            elif kind == 'alarms':
+                self.new_alarms.emit(msg[1])
+            elif kind == 'params':
+                self.new_params.emit(msg[1])
+            elif kind == 'metrics':
+                self.metrics = msg[1]
+            elif kind == 'files':
+                self.liveFiles = msg[1]
+            elif kind == 'log':
+                self.logger.log(msg[1], msg[2])
+
+    def run(self) -> None:
+        restarts = deque()
+        while not self.done:
+            events = self.start_child()
+            self.logger.info('Comms process started, pid ' + str(self.child.pid))
+            self.pump(events)
+            self.stop_child(events)
+            if self.done:
+                break
+
+            now = time.monotonic()
+            restarts.append(now)
+            while restarts[0] < now - RESTART_WINDOW:
+                restarts.popleft()
+            if len(restarts) > MAX_RESTARTS:
+                self.logger.error('Comms process keeps exiting, giving up')
+                self.lost_comms_signal.emit()
+                return
+            self.statRestarts += 1
+            self.logger.error('Comms process exited with code ' + str(self.child.exitcode) +
+                              ', restarting (' + str(self.statRestarts) + ')')
+            time.sleep(RESTART_DELAY)
+
+        if self.samples is not None:
+            self.samples.close()
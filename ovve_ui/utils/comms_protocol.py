@@ -0,0 +1,226 @@
+# Copyright 2020 LifeMech  Inc
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+# associated documentation files (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge, publish, distribute,
+# sublicense, and/or sell copies of the Software, and to permit persons to whom the Software
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or
+# substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING
+# BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+
+
+"""
+Serial protocol engine: decodes status packets from the MCU and answers
+each one with a command packet. It has no Qt or pyserial dependency and
+runs over any utils.transports.Transport.
+"""
+import logging
+import time
+from threading import Lock
+from typing import Callable, Optional
+
+from utils.params import Params
+from utils.settings import Settings
+from utils.in_packet import InPacket, STATUS_STRUCT
+from utils.out_packet import OutPacket
+from utils.frame_decoder import FrameDecoder
+from utils.latency_histogram import LatencyHistogram
+from utils.latency_trace import trace
+from utils.link_metrics import LinkMetrics, GAP_LABELS, gap_bin
+from utils.transports import Transport, TransportError
+from utils.units import Units
+
+
+class CommsProtocol():
+    def __init__(self,
+                 transport: Optional[Transport] = None,
+                 params_handler: Optional[Callable[[Params], None]] = None,
+                 alarms_handler: Optional[Callable[[int], None]] = None,
+                 text_handler: Optional[Callable[[bytes], None]] = None,
+                 reply_handler: Optional[Callable[[], None]] = None) -> None:
+        self.logger = logging.getLogger()
+        self.transport = transport
+        self.params_handler = params_handler
+        self.alarms_handler = alarms_handler
+        self.text_handler = text_handler
+        # when set, called instead of replying inline; the owner must call
+        # send_reply() or build_command()/send_command() itself
+        self.reply_handler = reply_handler
+        # a utils.session_recorder.SessionRecorder for every packet in and out
+        self.recorder = None
+        self.settings = Settings()
+        self.settings_lock = Lock()
+        self.FALLBACK_IE = float(1 / 1.5)
+        self.lastSeq=-1
+        self.alarmbits = 0
+        # alarms_handler only hears about changes, None reports the next packet
+        self.reportedAlarmbits = None
+        self.ackbits = 0
+        self.enable_calibration = False
+        self.rxTime = 0.0
+        self.in_pkt = InPacket()
+        self.cmd_pkt = OutPacket()
+        self.decoder = FrameDecoder(self.processPacket)
+        #statistics (RX frame statistics are kept by the decoder)
+        self.statSeqError=0
+        self.statLostFrames=0
+        self.statSeqGaps=[0] * len(GAP_LABELS)
+        self.statRxBytes=0
+        self.statPacketTxCntOk=0
+        self.statPacketTxFailCnt=0
+        self.sequenceNoTx=0
+        self.replyLatency = LatencyHistogram('Serial RX-to-reply')
+        self.metrics = LinkMetrics()
+
+    def reset(self) -> None:
+        self.decoder.reset()
+        self.reportedAlarmbits = None
+
+    def feed(self, byteData: bytes, rxTime: Optional[float] = None) -> None:
+        """ Hands received bytes to the decoder, rxTime is when they were read """
+        self.rxTime = time.perf_counter() if rxTime is None else rxTime
+        self.statRxBytes += len(byteData)
+        self.decoder.feed(byteData)
+        self.metrics.update(self.rxTime, self.link_totals())
+
+    def link_totals(self) -> tuple:
+        """ Lifetime counters in LinkMetrics order """
+        decoder = self.decoder
+        return (decoder.statPacketRxCntOk, decoder.statPacketRxCntCrcFail,
+                decoder.statPacketRxCntHeaderFail, decoder.statPacketRxCntLenFail,
+                self.statSeqError, self.statLostFrames, self.statRxBytes,
+                self.statPacketTxCntOk, self.statPacketTxFailCnt, *self.statSeqGaps)
+
+    def update_settings(self, settings_dict: dict) -> None:
+        self.settings_lock.acquire()
+        self.settings.from_dict(settings_dict)
+        self.settings_lock.release()
+        self.logger.debug("Got updated settings from UI")
+        self.logger.debug(self.settings.to_JSON())
+
+    def ready_to_calibrate(self):
+        self.enable_calibration = True
+
+    def ready_to_ventilate(self):
+        self.enable_calibration = False
+
+    def set_alarm_ackbits(self, ackbits: int) -> None:
+        self.logger.debug("Commslink got ackbits :" + str(ackbits))
+        # If an alarm is not active, do not ack it
+        self.ackbits = ackbits & self.alarmbits
+
+    def create_cmd_pkt(self):
+        self.settings_lock.acquire()
+
+        self.cmd_pkt.data['mode_value'] = self.settings.mode
+        self.cmd_pkt.data['command'] = self.cmd_pkt.pack_command(self.settings.run_state, 0,
+            self.settings.should_shut_down, self.enable_calibration)
+        self.cmd_pkt.data['respiratory_rate_set'] = self.settings.resp_rate
+        self.cmd_pkt.data['tidal_volume_set'] = Units.ml_to_ecu(
+            self.settings.tv)
+
+        # The UI selects the I:E ratio from an enumeration.
+        # Get the fractional value from the enumeration and convert to fixed point.
+        # If the lookup somehow fails, set I:E to a safe fallback value.
+        ie_fraction = self.settings.ie_ratio_switcher.get(self.settings.ie_ratio_enum, self.FALLBACK_IE)
+        ie_ratio_fixed = self.cmd_pkt.ie_fraction_to_fixed(ie_fraction)
+        self.cmd_pkt.data['ie_ratio_set'] = ie_ratio_fixed
+
+        self.cmd_pkt.data['alarm_bits'] = self.ackbits
+
+        self.cmd_pkt.data['high_pressure_limit_set'] =  Units.cmh2o_to_ecu(self.settings.high_pressure_limit)
+        self.cmd_pkt.data['low_pressure_limit_set'] =  Units.cmh2o_to_ecu(self.settings.low_pressure_limit)
+        self.cmd_pkt.data['high_volume_limit_set'] =  Units.ml_to_ecu(self.settings.high_volume_limit)
+        self.cmd_pkt.data['low_volume_limit_set'] =  Units.ml_to_ecu(self.settings.low_volume_limit)
+        self.cmd_pkt.data['high_respiratory_rate_limit_set'] = self.settings.high_resp_rate_limit
+        self.cmd_pkt.data['low_respiratory_rate_limit_set'] = self.settings.low_resp_rate_limit
+
+        self.settings_lock.release()
+
+    def processPacket(self, byteData, packetType, sequenceNo):
+        decodeTime = time.perf_counter()
+        #handle public data packet
+        if ((self.lastSeq+1!=sequenceNo) and (self.lastSeq!=-1)):
+                self.logger.debug('Error in sequence -> likely packet drop')
+                self.statSeqError+=1
+                gap = (sequenceNo - self.lastSeq - 1) & 0xFFFF
+                self.statSeqGaps[gap_bin(gap)] += 1
+                # a jump backwards is the MCU restarting, not lost frames
+                if gap < 0x8000:
+                    self.statLostFrames += gap
+
+        self.lastSeq=sequenceNo
+
+        if packetType==0x01:
+            if len(byteData) < STATUS_STRUCT.size:
+                self.logger.debug('Status packet too short: ' + str(len(byteData)))
+                return
+            if self.recorder is not None:
+                self.recorder.record_status(sequenceNo, byteData)
+            self.in_pkt.from_bytes(byteData)
+
+            self.alarmbits = self.in_pkt.record.alarm_bits
+
+            if self.params_handler is not None:
+                params = self.in_pkt.to_params(sequenceNo)
+                if trace.enabled:
+                    params.timestamps = [self.rxTime, decodeTime, time.perf_counter()]
+                self.params_handler(params)
+            if self.alarms_handler is not None and self.alarmbits != self.reportedAlarmbits:
+                self.reportedAlarmbits = self.alarmbits
+                self.alarms_handler(self.alarmbits)
+
+            if self.reply_handler is not None:
+                self.reply_handler()
+            else:
+                self.send_reply()
+
+        elif packetType==0x80:
+            if self.text_handler is not None:
+                self.text_handler(byteData)
+
+    #build the command packet from the current settings and send it
+    def send_reply(self) -> bool:
+        return self.send_command(self.build_command(), self.rxTime)
+
+    #snapshot of the command payload, safe to hand to another thread
+    def build_command(self) -> tuple:
+        self.create_cmd_pkt()
+        return self.cmd_pkt.payload_values()
+
+    #frame and send a command from build_command(), rxTime is when the
+    #status it answers was read
+    def send_command(self, values: tuple, rxTime: float) -> bool:
+        if self.recorder is not None:
+            self.recorder.record_command(self.sequenceNoTx, values)
+        sent = self.sendPkts(self.cmd_pkt.to_frame(self.sequenceNoTx, values))
+        self.replyLatency.record(time.perf_counter() - rxTime)
+        return sent
+
+    #send a complete frame with a single write
+    def sendPkts(self, frame: bytearray) -> bool:
+        try:
+            self.transport.write(frame)
+            # every command is in the session recording, not the log
+            self.statPacketTxCntOk+=1
+            self.sequenceNoTx = (self.sequenceNoTx + 1) & 0xFFFF
+            return True
+
+        except TransportError:
+            self.statPacketTxFailCnt+=1
+            self.logger.exception('Serial write error')
+            return False
+
+    def stats_summary(self) -> list:
+        lines = [self.metrics.summary(), self.replyLatency.summary()]
+        if trace.enabled:
+            lines += trace.summary()
+        return lines
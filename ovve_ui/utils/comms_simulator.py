@@ -30,6 +30,8 @@ from utils.Alarm import AlarmType
 from utils.in_packet import InPacket
 from utils.out_packet import OutPacket
 from utils.control_state import ControlState
+from utils.waveform_batch import WaveformBlock
+from utils.status_diff import StatusChange
 
 from PyQt5 import QtCore
 from PyQt5.QtCore import QThread, pyqtSignal
@@ -37,6 +39,10 @@ from copy import deepcopy
 
 class CommsSimulator(QThread):
     new_params = pyqtSignal(Params)
+    new_waveform = pyqtSignal(WaveformBlock)  # not used, sends per sample
+    new_status = pyqtSignal(StatusChange)     # not used either
+    samples = None
+    STOP_WAIT = 1.0
     new_alarms = pyqtSignal(int)
     lost_comms_signal = pyqtSignal()
 
@@ -61,6 +67,9 @@ class CommsSimulator(QThread):
         self.settings.from_dict(settings_dict)
         self.settings_lock.release()
 
+    def stop(self) -> None:
+        self.done = True
+
     def ready_to_calibrate(self):
         self.logger.debug("CommsSim: ready to calibrate")
         self.enable_calibration = True
@@ -74,6 +83,10 @@ class CommsSimulator(QThread):
         self.ackbits = ackbits & self.alarmbits
         self.alarmbits = self.alarmbits &  ~self.ackbits
 
+    def live_files(self) -> list:
+        # the simulator writes no capture
+        return []
+
     def fireAlarm(self, key: int):
         self.firedAlarms.append(key)
 
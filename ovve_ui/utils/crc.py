@@ -18,22 +18,108 @@
 #
 
 
-import crc16
-import binascii
+"""
+CRC-16/XMODEM (poly 0x1021) as used by the v4 serial protocol. All frames
+are checked with an initial value of 0xFFFF.
+"""
 import logging
 
+import numpy as np
+
+try:
+    import crc16
+except ImportError:
+    crc16 = None
+
+CRC_INIT = 0xFFFF
+
+# Below this length the table loop is cheaper than calling into the crc16
+# extension (see utils/tools/bench_crc.py)
+EXTENSION_MIN_LEN = 8
+
+
+def _make_table() -> tuple:
+    table = []
+    for i in range(256):
+        crc = i << 8
+        for _ in range(8):
+            if crc & 0x8000:
+                crc = (crc << 1) ^ 0x1021
+            else:
+                crc <<= 1
+        table.append(crc & 0xFFFF)
+    return tuple(table)
+
+
+CRC16_TABLE = _make_table()
+
+
+def _load_extension():
+    # The crc16 extension fails at call time on Python >= 3.10 because it was
+    # built without PY_SSIZE_T_CLEAN, so probe it once with the check value.
+    if crc16 is None:
+        return None
+    try:
+        if crc16.crc16xmodem(b'123456789', 0) == 0x31C3:
+            return crc16.crc16xmodem
+    except Exception:
+        pass
+    return None
+
+
+_extension = _load_extension()
+
+
+def update_table(data, crc: int = CRC_INIT) -> int:
+    """ Table driven CRC over any bytes-like object """
+    table = CRC16_TABLE
+    for byte in data:
+        crc = ((crc << 8) & 0xFF00) ^ table[(crc >> 8) ^ byte]
+    return crc
+
+
+def compute_rows(rows: np.ndarray, crc: int = CRC_INIT) -> np.ndarray:
+    """
+    CRC of every row of a 2D uint8 array at once, one table step per
+    column for all rows, for checking many frames of the same length
+    """
+    table = np.array(CRC16_TABLE, np.uint16)
+    value = np.full(len(rows), crc, np.uint16)
+    for column in rows.T:
+        value = (value << 8) ^ table[(value >> 8) ^ column]
+    return value
+
+
+def compute(data, crc: int = CRC_INIT) -> int:
+    """ One-shot CRC over bytes, bytearray or memoryview """
+    if _extension is not None and len(data) >= EXTENSION_MIN_LEN:
+        try:
+            return _extension(data, crc)
+        except TypeError:
+            # the extension only takes read-only buffers
+            return _extension(bytes(data), crc)
+    return update_table(data, crc)
+
 
 class CRC():
-    def __init__(self) -> None:
+    """
+    Streaming CRC: call update() with consecutive chunks and read value.
+    """
+    def __init__(self, crc: int = CRC_INIT) -> None:
         self.logger = logging.getLogger()
-        pass
+        self.value = crc
+
+    def reset(self, crc: int = CRC_INIT) -> None:
+        self.value = crc
+
+    def update(self, buf) -> int:
+        self.value = compute(buf, self.value)
+        return self.value
 
     def check_crc(self, byteData: bytes) -> bool:
         # calculate CRC
         rcvdCRC = int.from_bytes(byteData[54:], byteorder='little')
-        # reverse HEX order
-        calcRcvCRC = self.crccitt(byteData[0:54].hex())
-        calcRcvCRC = int(calcRcvCRC, 16)
+        calcRcvCRC = compute(memoryview(byteData)[0:54])
         if calcRcvCRC != rcvdCRC:
             self.logger.warning(str(byteData))
             self.logger.warning("CRC check failed! rcvd: " + str(rcvdCRC) +
@@ -43,6 +129,5 @@ class CRC():
         return True
 
     def crccitt(self, hex_string):
-        byte_seq = binascii.unhexlify(hex_string)
-        crc = crc16.crc16xmodem(byte_seq, 0xffff)
+        crc = compute(bytes.fromhex(hex_string))
         return '{:04X}'.format(crc & 0xffff)
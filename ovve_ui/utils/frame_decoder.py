@@ -0,0 +1,134 @@
+# Copyright 2020 LifeMech  Inc
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+# associated documentation files (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge, publish, distribute,
+# sublicense, and/or sell copies of the Software, and to permit persons to whom the Software
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or
+# substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING
+# BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+
+
+"""
+Buffer based decoder for v4 serial frames from the MCU
+"""
+import logging
+import re
+import struct
+from typing import Callable
+
+from utils import crc
+
+# Frame layout:
+#   sync (0x26 0x56 0x7E) | seq (2, LE) | version (1) | type (1) | length (1)
+#   | payload (length) | crc (2, LE)
+# The CRC covers everything after the sync bytes up to the end of the payload.
+SYNC = b'\x26\x56\x7e'
+PROTOCOL_VERSION = 4
+MAX_PAYLOAD_LEN = 128
+HEADER_LEN = 8
+CRC_LEN = 2
+
+_HEADER = struct.Struct('<HBBB')
+_SYNC_RUN = re.compile(b'\x26+')
+
+
+def build_frame(sequenceNo: int, packetType: int, payload: bytes) -> bytes:
+    """ Builds a complete v4 frame, used by tools and stand-ins for the MCU """
+    body = _HEADER.pack(sequenceNo & 0xFFFF, PROTOCOL_VERSION, packetType, len(payload)) + payload
+    return SYNC + body + crc.compute(body).to_bytes(2, 'little')
+
+
+class FrameDecoder():
+    """
+    Scans whole receive buffers for frames instead of running a state
+    machine per byte. Calls packet_handler(payload, packetType, sequenceNo)
+    for each frame with a valid CRC, where payload is a memoryview into the
+    receive buffer. Partial frames are kept until the next call to feed().
+    """
+    def __init__(self, packet_handler: Callable[[memoryview, int, int], None]) -> None:
+        self.logger = logging.getLogger()
+        self.packet_handler = packet_handler
+        self.rxBuffer = b''
+        #statistics
+        self.statPacketRxCntOk = 0
+        self.statPacketRxCntCrcFail = 0
+        self.statPacketRxCntLenFail = 0
+        self.statPacketRxCntHeaderFail = 0
+
+    def reset(self) -> None:
+        self.rxBuffer = b''
+
+    def feed(self, byteData: bytes) -> None:
+        if self.rxBuffer:
+            buf = self.rxBuffer + byteData
+        else:
+            buf = bytes(byteData)
+        view = memoryview(buf)
+        end = len(buf)
+        pos = 0
+
+        while True:
+            idx = buf.find(SYNC, pos)
+            if idx < 0:
+                # keep a sync sequence that may be completed by the next read
+                if buf.endswith(SYNC[:2]):
+                    keep = 2
+                elif buf.endswith(SYNC[:1]):
+                    keep = 1
+                else:
+                    keep = 0
+                # bytes before pos belong to a frame already decoded
+                keep = min(keep, end - pos)
+                self._count_header_fails(buf, pos, end - keep)
+                self.rxBuffer = buf[end - keep:]
+                return
+            if idx != pos:
+                self._count_header_fails(buf, pos, idx)
+
+            if end - idx < HEADER_LEN:
+                self.rxBuffer = buf[idx:]
+                return
+
+            sequenceNo, version, packetType, packetLen = _HEADER.unpack_from(buf, idx + 3)
+            if version != PROTOCOL_VERSION:
+                pos = idx + 6 #resume after the version byte
+                continue
+            if packetLen > MAX_PAYLOAD_LEN: #128 is max
+                self.statPacketRxCntLenFail += 1
+                pos = idx + HEADER_LEN #resume after the length byte
+                continue
+
+            payloadEnd = idx + HEADER_LEN + packetLen
+            frameEnd = payloadEnd + CRC_LEN
+            if frameEnd > end:
+                self.rxBuffer = buf[idx:]
+                return
+
+            crcCalc = crc.compute(view[idx + 3:payloadEnd])
+            recCrc = buf[payloadEnd] | (buf[payloadEnd + 1] << 8)
+            if recCrc == crcCalc:
+                self.statPacketRxCntOk += 1
+                self.packet_handler(view[idx + HEADER_LEN:payloadEnd], packetType, sequenceNo)
+            else:
+                self.logger.debug("Got packet with wrong CRC! Rec: "+str(recCrc)+" Calc: "+str(crcCalc))
+                self.statPacketRxCntCrcFail += 1
+            pos = frameEnd
+
+    def _count_header_fails(self, buf: bytes, start: int, stop: int) -> None:
+        # Every run of first sync bytes in skipped data is a sync attempt that
+        # did not complete. A trailing run is the start of the next sync
+        # (S1S1S2S3) and is not counted.
+        if start >= stop:
+            return
+        skipped = buf[start:stop].rstrip(SYNC[:1])
+        if skipped:
+            self.statPacketRxCntHeaderFail += len(_SYNC_RUN.findall(skipped))
@@ -18,104 +18,156 @@
 #
 
 
+from collections import namedtuple
+import struct
+
+import numpy as np
+
 from utils.params import Params
 from utils.units import Units
 
+# v4 status payload, 48 bytes little endian
+STATUS_STRUCT = struct.Struct('<BBBBHHhhHHhhhhhhhhhhhhhHHH')
+
+StatusRecord = namedtuple('StatusRecord', [
+    'mode_value',
+    'control_state',
+    'run_state',
+    'battery_charge',
+    'battery_level',
+    'reserved',
+    'respiratory_rate_set',
+    'respiratory_rate_measured',
+    'tidal_volume_set',
+    'tidal_volume_measured',
+    'ie_ratio_set',
+    'ie_ratio_measured',
+    'peep_value_measured',
+    'peak_pressure_measured',
+    'plateau_value_measured',
+    'pressure_set',
+    'pressure_measured',
+    'flow_measured',
+    'volume_in_measured',
+    'volume_out_measured',
+    'volume_rate_measured',
+    'high_pressure_limit_set',
+    'low_pressure_limit_set',
+    'high_volume_limit_set',
+    'low_volume_limit_set',
+    'high_respiratory_rate_limit_set',
+    'low_respiratory_rate_limit_set',
+    'alarm_bits',
+])
+
+# the same payload as a NumPy record, for decoding many at once
+STATUS_RAW_DTYPE = np.dtype([
+    ('mode_value', 'u1'), ('state_bits', 'u1'), ('battery_bits', 'u1'), ('reserved', 'u1'),
+    ('respiratory_rate_set', '<u2'), ('respiratory_rate_measured', '<u2'),
+    ('tidal_volume_set', '<i2'), ('tidal_volume_measured', '<i2'),
+    ('ie_ratio_set', '<u2'), ('ie_ratio_measured', '<u2'),
+    ('peep_value_measured', '<i2'), ('peak_pressure_measured', '<i2'),
+    ('plateau_value_measured', '<i2'), ('pressure_set', '<i2'), ('pressure_measured', '<i2'),
+    ('flow_measured', '<i2'), ('volume_in_measured', '<i2'), ('volume_out_measured', '<i2'),
+    ('volume_rate_measured', '<i2'), ('high_pressure_limit_set', '<i2'),
+    ('low_pressure_limit_set', '<i2'), ('high_volume_limit_set', '<i2'),
+    ('low_volume_limit_set', '<i2'), ('high_respiratory_rate_limit_set', '<u2'),
+    ('low_respiratory_rate_limit_set', '<u2'), ('alarm_bits', '<u2'),
+])
+assert STATUS_RAW_DTYPE.itemsize == STATUS_STRUCT.size
+
+
+def ie_fixed_to_fraction_array(n: np.ndarray) -> np.ndarray:
+    """ InPacket.ie_fixed_to_fraction over an array """
+    n = n.astype(np.float64)
+    out = np.zeros(len(n))
+    with np.errstate(divide='ignore'):
+        low = (n > 0) & (n <= 128)
+        out[low] = 1.0 / (256 / n[low] - 1)
+        high = n > 128
+        out[high] = (n[high] / 256) / (1 - n[high] / 256)
+    return out
+
+
+def decode_status_array(raw: np.ndarray, seq: np.ndarray, out: np.ndarray) -> None:
+    """
+    Fills the Params fields of the structured array out from STATUS_RAW_DTYPE
+    payloads and their sequence numbers, with the conversions of to_params()
+    """
+    out['seq_num'] = seq
+    out['packet_version'] = 4
+    out['mode'] = raw['mode_value']
+    out['resp_rate_meas'] = raw['respiratory_rate_measured']
+    out['resp_rate_set'] = raw['respiratory_rate_set']
+    out['tv_meas'] = raw['tidal_volume_measured']
+    out['tv_set'] = raw['tidal_volume_set']
+    out['ie_ratio_meas'] = ie_fixed_to_fraction_array(raw['ie_ratio_measured'])
+    out['ie_ratio_set'] = ie_fixed_to_fraction_array(raw['ie_ratio_set'])
+    out['peep'] = raw['peep_value_measured'] * 0.01
+    out['ppeak'] = raw['peak_pressure_measured'] * 0.01
+    out['pplat'] = raw['plateau_value_measured'] * 0.01
+    out['pressure'] = raw['pressure_measured'] * 0.01
+    out['flow'] = raw['flow_measured'] * 0.01
+    out['tv_insp'] = raw['volume_in_measured']
+    out['tv_exp'] = raw['volume_out_measured']
+    out['tv_rate'] = raw['volume_rate_measured']
+    out['control_state'] = raw['state_bits'] & 0x1F
+    out['run_state'] = raw['state_bits'] & (1 << 7)
+    out['battery_level'] = raw['battery_bits'] & 0x7F
+    out['high_pressure_limit'] = raw['high_pressure_limit_set']
+    out['low_pressure_limit'] = raw['low_pressure_limit_set']
+    out['high_volume_limit'] = raw['high_volume_limit_set']
+    out['low_volume_limit'] = raw['low_volume_limit_set']
+    out['high_resp_rate_limit'] = raw['high_respiratory_rate_limit_set']
+    out['low_resp_rate_limit'] = raw['low_respiratory_rate_limit_set']
+    out['alarm_bits'] = raw['alarm_bits']
+    out['battery_charge'] = raw['battery_bits'] & (1 << 7)
+
+
 class InPacket():
 
     def __init__(self) -> None:
-        self.data={'mode_value': 0,
-                   'control_state': 0,
-                   'battery_status': 0,
-                   'reserved': 0,
-                   'respiratory_rate_set': 0,
-                   'respiratory_rate_measured': 0,
-                   'tidal_volume_set': 0,
-                   'tidal_volume_measured': 0,
-                   'ie_ratio_set': 0,
-                   'ie_ratio_measured': 0,
-                   'peep_value_measured': 0,
-                   'peak_pressure_measured': 0,
-                   'plateau_value_measurement': 0,
-                   'pressure_set': 0,
-                   'pressure_measured': 0,
-                   'flow_measured': 0,
-                   'volume_in_measured': 0,
-                   'volume_out_measured': 0,
-                   'volume_rate_measured': 0,
-                   'high_pressure_limit_set': 0,
-                   'low_pressure_limit_set': 0,
-                   'high_volume_limit_set': 0,
-                   'low_volume_limit_set': 0,
-                   'high_respiratory_rate_limit_set': 0,
-                   'low_respiratory_rate_limit_set': 0,
-                   'alarm_bits': 0,
-                   'run_state': 0
-                   }
-
-    # byteData must have already been checked for proper length and crc
-    def from_bytes(self, byteData: bytes) -> None:
-        self.data['mode_value']=byteData[0]
-        self.data['control_state']=byteData[1] & 0x1F
-        self.data['run_state'] = byteData[1] & (1 << 7)
-        self.data['battery_charge'] = byteData[2] & (1 << 7)
-        self.data['battery_level'] = byteData[2] & 0x7F
-        self.data['reserved'] = byteData[3]
-        self.data['respiratory_rate_set']=int.from_bytes(byteData[4:6], byteorder='little')
-        self.data['respiratory_rate_measured']=int.from_bytes(byteData[6:8], byteorder='little')
-        self.data['tidal_volume_set']=int.from_bytes(byteData[8:10], byteorder='little', signed=True)
-        self.data['tidal_volume_measured']=int.from_bytes(byteData[10:12], byteorder='little', signed=True)
-        self.data['ie_ratio_set']=int.from_bytes(byteData[12:14], byteorder='little')
-        self.data['ie_ratio_measured']=int.from_bytes(byteData[14:16], byteorder='little')
-        self.data['peep_value_measured']=int.from_bytes(byteData[16:18], byteorder='little', signed=True)
-        self.data['peak_pressure_measured']=int.from_bytes(byteData[18:20], byteorder='little', signed=True)
-        self.data['plateau_value_measured']=int.from_bytes(byteData[20:22], byteorder='little', signed=True)
-        self.data['pressure_set']=int.from_bytes(byteData[22:24], byteorder='little', signed=True)
-        self.data['pressure_measured']=int.from_bytes(byteData[24:26], byteorder='little', signed=True)
-        self.data['flow_measured']=int.from_bytes(byteData[26:28], byteorder='little', signed=True)
-        self.data['volume_in_measured']=int.from_bytes(byteData[28:30], byteorder='little', signed=True)
-        self.data['volume_out_measured']=int.from_bytes(byteData[30:32], byteorder='little', signed=True)
-        self.data['volume_rate_measured']=int.from_bytes(byteData[32:34], byteorder='little', signed=True)
-        self.data['high_pressure_limit_set']=int.from_bytes(byteData[34:36], byteorder='little', signed=True)
-        self.data['low_pressure_limit_set']=int.from_bytes(byteData[36:38], byteorder='little', signed=True)
-        self.data['high_volume_limit_set']=int.from_bytes(byteData[38:40], byteorder='little', signed=True)
-        self.data['low_volume_limit_set']=int.from_bytes(byteData[40:42], byteorder='little', signed=True)
-        self.data['high_respiratory_rate_limit_set']=int.from_bytes(byteData[42:44], byteorder='little')
-        self.data['low_respiratory_rate_limit_set']=int.from_bytes(byteData[44:46], byteorder='little')
-        self.data['alarm_bits']=int.from_bytes(byteData[46:48], byteorder='little')
+        self.record = StatusRecord(*([0] * len(StatusRecord._fields)))
 
+    # byteData must have already been checked for proper length and crc.
+    # Decodes straight out of the receive buffer, a memoryview is not copied.
+    def from_bytes(self, byteData, offset: int = 0) -> StatusRecord:
+        v = STATUS_STRUCT.unpack_from(byteData, offset)
+        self.record = StatusRecord(v[0], v[1] & 0x1F, v[1] & (1 << 7),
+                                   v[2] & (1 << 7), v[2] & 0x7F, *v[3:])
+        return self.record
 
     def to_params(self,sequenceNo) -> Params:
-        params = Params()
-        params.run_state = self.data['run_state']
-        params.control_state = self.data['control_state']
-        params.seq_num = sequenceNo
-        params.packet_version = 4
-        params.mode = self.data['mode_value']
-        params.resp_rate_meas = self.data['respiratory_rate_measured']
-        params.resp_rate_set = self.data['respiratory_rate_set']
-        params.tv_meas = Units.ecu_to_ml(self.data['tidal_volume_measured'])
-        params.tv_set = Units.ecu_to_ml(self.data['tidal_volume_set'])
-        params.ie_ratio_meas = self.ie_fixed_to_fraction(self.data['ie_ratio_measured'])
-        params.ie_ratio_set = self.ie_fixed_to_fraction(self.data['ie_ratio_set'])
-        params.peep = Units.ecu_to_cmh2o(self.data['peep_value_measured'])
-        params.ppeak = Units.ecu_to_cmh2o(self.data['peak_pressure_measured'])
-        params.pplat = Units.ecu_to_cmh2o(self.data['plateau_value_measured'])
-        params.pressure= Units.ecu_to_cmh2o(self.data['pressure_measured'])
-        params.flow = Units.ecu_to_slm(self.data['flow_measured'])
-        params.tv_insp = Units.ecu_to_ml(self.data['volume_in_measured'])
-        params.tv_exp = Units.ecu_to_ml(self.data['volume_out_measured'])
-        params.tv_rate = Units.ecu_to_ml(self.data['volume_rate_measured'])
-        params.battery_level = self.data['battery_level']
-        params.battery_charge= self.data['battery_charge']
-        params.high_pressure_limit = self.data['high_pressure_limit_set']
-        params.low_pressure_limit = self.data['low_pressure_limit_set']
-        params.high_volume_limit = self.data['high_volume_limit_set']
-        params.low_volume_llimit = self.data['low_volume_limit_set']
-        params.high_resp_rate_limit_set = self.data['high_respiratory_rate_limit_set']
-        params.low_resp_rate_limit_set = self.data['low_respiratory_rate_limit_set']
-        params.alarm_bits = self.data['alarm_bits']
-        return params
+        r = self.record
+        return Params(
+            seq_num=sequenceNo,
+            packet_version=4,
+            mode=r.mode_value,
+            resp_rate_meas=r.respiratory_rate_measured,
+            resp_rate_set=r.respiratory_rate_set,
+            tv_meas=Units.ecu_to_ml(r.tidal_volume_measured),
+            tv_set=Units.ecu_to_ml(r.tidal_volume_set),
+            ie_ratio_meas=self.ie_fixed_to_fraction(r.ie_ratio_measured),
+            ie_ratio_set=self.ie_fixed_to_fraction(r.ie_ratio_set),
+            peep=Units.ecu_to_cmh2o(r.peep_value_measured),
+            ppeak=Units.ecu_to_cmh2o(r.peak_pressure_measured),
+            pplat=Units.ecu_to_cmh2o(r.plateau_value_measured),
+            pressure=Units.ecu_to_cmh2o(r.pressure_measured),
+            flow=Units.ecu_to_slm(r.flow_measured),
+            tv_insp=Units.ecu_to_ml(r.volume_in_measured),
+            tv_exp=Units.ecu_to_ml(r.volume_out_measured),
+            tv_rate=Units.ecu_to_ml(r.volume_rate_measured),
+            control_state=r.control_state,
+            run_state=r.run_state,
+            battery_level=r.battery_level,
+            high_pressure_limit=r.high_pressure_limit_set,
+            low_pressure_limit=r.low_pressure_limit_set,
+            high_volume_limit=r.high_volume_limit_set,
+            low_volume_limit=r.low_volume_limit_set,
+            high_resp_rate_limit=r.high_respiratory_rate_limit_set,
+            low_resp_rate_limit=r.low_respiratory_rate_limit_set,
+            alarm_bits=r.alarm_bits,
+            battery_charge=r.battery_charge)
 
     def ie_fixed_to_fraction(self, n: int) -> float:
         if n == 0:
@@ -0,0 +1,86 @@
+# Copyright 2020 LifeMech  Inc
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+# associated documentation files (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge, publish, distribute,
+# sublicense, and/or sell copies of the Software, and to permit persons to whom the Software
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or
+# substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING
+# BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+
+
+"""
+In-memory latency histogram with fixed logarithmic buckets
+"""
+import math
+
+# Buckets cover 1 us to 10 s with 20 buckets per decade (~12% wide)
+MIN_LATENCY = 1e-6
+DECADES = 7
+BUCKETS_PER_DECADE = 20
+NUM_BUCKETS = DECADES * BUCKETS_PER_DECADE + 2
+
+
+class LatencyHistogram():
+    """
+    Records latencies in seconds with O(1) updates. Percentiles are
+    reported as the upper edge of the bucket they fall in.
+    """
+    def __init__(self, name: str = '') -> None:
+        self.name = name
+        self.reset()
+
+    def reset(self) -> None:
+        self.counts = [0] * NUM_BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds: float) -> None:
+        if seconds <= MIN_LATENCY:
+            idx = 0
+        else:
+            idx = min(int(math.log10(seconds / MIN_LATENCY) * BUCKETS_PER_DECADE) + 1,
+                      NUM_BUCKETS - 1)
+        self.counts[idx] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    @staticmethod
+    def bucket_upper_edge(idx: int) -> float:
+        return MIN_LATENCY * 10 ** (idx / BUCKETS_PER_DECADE)
+
+    def percentile(self, p: float) -> float:
+        if self.count == 0:
+            return 0.0
+        rank = p / 100.0 * self.count
+        seen = 0
+        for idx, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank and n:
+                return min(self.bucket_upper_edge(idx), self.max)
+        return self.max
+
+    def snapshot(self) -> dict:
+        """ Summary in milliseconds """
+        return {'name': self.name,
+                'count': self.count,
+                'mean_ms': self.total / self.count * 1e3 if self.count else 0.0,
+                'p50_ms': self.percentile(50) * 1e3,
+                'p99_ms': self.percentile(99) * 1e3,
+                'max_ms': self.max * 1e3}
+
+    def summary(self) -> str:
+        s = self.snapshot()
+        return '%s n=%d p50=%.2fms p99=%.2fms max=%.2fms' % (
+            s['name'], s['count'], s['p50_ms'], s['p99_ms'], s['max_ms'])
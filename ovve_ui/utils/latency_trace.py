@@ -0,0 +1,63 @@
+# Copyright 2020 LifeMech  Inc
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+# associated documentation files (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge, publish, distribute,
+# sublicense, and/or sell copies of the Software, and to permit persons to whom the Software
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or
+# substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING
+# BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+
+
+"""
+Packet-to-pixel latency tracing. When enabled, each Params carries
+time.perf_counter() stamps taken as it moves from the serial read to the
+finished graph repaint, and the UI records them here once painted.
+"""
+from typing import List
+
+from utils.latency_histogram import LatencyHistogram
+
+# Order of the stamps in Params.timestamps
+STAGES = ('read', 'decode', 'emit', 'ui', 'repaint')
+
+
+class LatencyTrace():
+    def __init__(self) -> None:
+        self.enabled = False
+        # each stage is timed from the stage before it
+        self.stages = {STAGES[i]: LatencyHistogram(STAGES[i - 1] + '-to-' + STAGES[i])
+                       for i in range(1, len(STAGES))}
+        self.total = LatencyHistogram(STAGES[0] + '-to-' + STAGES[-1])
+
+    def record(self, timestamps: List[float]) -> None:
+        for i in range(1, len(timestamps)):
+            self.stages[STAGES[i]].record(timestamps[i] - timestamps[i - 1])
+        if len(timestamps) == len(STAGES):
+            self.total.record(timestamps[-1] - timestamps[0])
+
+    def reset(self) -> None:
+        for histogram in self.stages.values():
+            histogram.reset()
+        self.total.reset()
+
+    def snapshot(self) -> dict:
+        result = {name: histogram.snapshot() for name, histogram in self.stages.items()}
+        result['total'] = self.total.snapshot()
+        return result
+
+    def summary(self) -> list:
+        return ['Latency ' + histogram.summary()
+                for histogram in list(self.stages.values()) + [self.total]]
+
+
+# shared by the comms thread and the UI, enabled with --latency_trace
+trace = LatencyTrace()
@@ -0,0 +1,146 @@
+# Copyright 2020 LifeMech  Inc
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+# associated documentation files (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge, publish, distribute,
+# sublicense, and/or sell copies of the Software, and to permit persons to whom the Software
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or
+# substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING
+# BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+
+
+"""
+Sliding-window serial link rates (frames/s, error rates, resyncs, gaps,
+bytes/s, TX failures) so a degrading cable shows up before the link is
+lost. The lifetime stat counters stay where they are counted; update()
+adds how much they moved into the current one-second row of a fixed
+array, and the window is the sum of the last WINDOW rows.
+"""
+import json
+import logging
+import time
+from bisect import bisect_left
+
+import numpy as np
+
+COUNTERS = ('frames', 'crc_errors', 'resyncs', 'length_errors', 'seq_errors',
+            'lost_frames', 'bytes', 'tx_ok', 'tx_fail')
+# upper edges of the sequence gap length bins, the last bin is open
+GAP_EDGES = (1, 2, 4, 8, 16, 64)
+GAP_LABELS = ('1', '2', '3-4', '5-8', '9-16', '17-64', '65+')
+
+WINDOW = 60
+INTERVAL = 1.0
+LOG_INTERVAL = 10.0
+# error or loss rates above this are logged as a warning
+DEGRADED_RATE = 0.01
+
+
+def gap_bin(length: int) -> int:
+    return bisect_left(GAP_EDGES, length)
+
+
+class LinkMetrics():
+    def __init__(self, window: int = WINDOW, interval: float = INTERVAL,
+                 log_interval: float = LOG_INTERVAL) -> None:
+        self.logger = logging.getLogger()
+        self.window = window
+        self.interval = interval
+        self.log_interval = log_interval
+        width = len(COUNTERS) + len(GAP_LABELS)
+        self.rows = np.zeros((window, width), np.int64)
+        self.totals = np.zeros(width, np.int64)
+        self._bucket = -1
+        self._startTime = 0.0
+        self._nextLog = 0.0
+
+    def update(self, now: float, totals: tuple) -> None:
+        """
+        totals are the lifetime counters in COUNTERS order followed by the
+        gap length bins. Logs a snapshot at most every log_interval.
+        """
+        bucket = int(now / self.interval)
+        if bucket != self._bucket:
+            self._advance(bucket, now)
+        totals = np.array(totals, np.int64)
+        self.rows[bucket % self.window] += totals - self.totals
+        self.totals = totals
+        if now >= self._nextLog:
+            self._nextLog = now + self.log_interval
+            self.log(now)
+
+    def _advance(self, bucket: int, now: float) -> None:
+        if self._bucket < 0:
+            self._startTime = now
+            self._nextLog = now + self.log_interval
+            steps = self.window
+        else:
+            steps = min(bucket - self._bucket, self.window)
+        # rows of seconds without an update are cleared on the way
+        for b in range(bucket - steps + 1, bucket + 1):
+            self.rows[b % self.window] = 0
+        self._bucket = bucket
+
+    def snapshot(self, now: float = None) -> dict:
+        """ Rates over the last window seconds and the lifetime totals """
+        if now is None:
+            now = time.perf_counter()
+        nowBucket = int(now / self.interval)
+        first = nowBucket - self.window + 1
+        sums = np.zeros(self.rows.shape[1], np.int64)
+        span = 0.0
+        if 0 <= self._bucket and first <= self._bucket:
+            buckets = np.arange(max(first, int(self._startTime / self.interval)), self._bucket + 1)
+            sums = self.rows[buckets % self.window].sum(axis=0)
+            span = now - max(first * self.interval, self._startTime)
+        counts = dict(zip(COUNTERS, sums.tolist()))
+        perSecond = 1.0 / span if span > 0 else 0.0
+        received = counts['frames'] + counts['crc_errors']
+        expected = counts['frames'] + counts['lost_frames']
+        sent = counts['tx_ok'] + counts['tx_fail']
+        return {
+            'window_s': round(span, 3),
+            'frames_per_s': counts['frames'] * perSecond,
+            'bytes_per_s': counts['bytes'] * perSecond,
+            'crc_error_rate': counts['crc_errors'] / received if received else 0.0,
+            'resyncs_per_s': counts['resyncs'] * perSecond,
+            'length_errors_per_s': counts['length_errors'] * perSecond,
+            'seq_errors_per_s': counts['seq_errors'] * perSecond,
+            'lost_frame_rate': counts['lost_frames'] / expected if expected else 0.0,
+            'tx_per_s': sent * perSecond,
+            'tx_fail_rate': counts['tx_fail'] / sent if sent else 0.0,
+            'gap_lengths': dict(zip(GAP_LABELS, sums[len(COUNTERS):].tolist())),
+            'totals': dict(zip(COUNTERS, self.totals[:len(COUNTERS)].tolist())),
+        }
+
+    def degraded(self, snapshot: dict) -> bool:
+        return (snapshot['crc_error_rate'] > DEGRADED_RATE or
+                snapshot['lost_frame_rate'] > DEGRADED_RATE or
+                snapshot['tx_fail_rate'] > DEGRADED_RATE)
+
+    def log(self, now: float = None) -> None:
+        snapshot = self.snapshot(now)
+        record = {'type': 'link'}
+        record.update(snapshot)
+        self.logger.log(25, json.dumps(record))
+        if self.degraded(snapshot):
+            self.logger.warning(self.summary(snapshot))
+
+    def summary(self, snapshot: dict = None) -> str:
+        if snapshot is None:
+            snapshot = self.snapshot()
+        return ('Serial link (last ' + str(round(snapshot['window_s'])) + 's): ' +
+                '%.1f frames/s %.0f B/s CRC %.2f%% lost %.2f%% resyncs %.2f/s '
+                'TX %.1f/s fail %.2f%%' % (
+                    snapshot['frames_per_s'], snapshot['bytes_per_s'],
+                    snapshot['crc_error_rate'] * 100, snapshot['lost_frame_rate'] * 100,
+                    snapshot['resyncs_per_s'], snapshot['tx_per_s'],
+                    snapshot['tx_fail_rate'] * 100))
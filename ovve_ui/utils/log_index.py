@@ -0,0 +1,199 @@
+# Copyright 2020 LifeMech  Inc
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+# associated documentation files (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge, publish, distribute,
+# sublicense, and/or sell copies of the Software, and to permit persons to whom the Software
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or
+# substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING
+# BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+
+
+"""
+Time and alarm index for the hourly patient logs. The file handler
+appends a fixed size entry to <base>.idx every MARK_INTERVAL seconds
+of records and for every record logged with extra={'alarm_bits': bits}.
+An entry holds the record time, the start of the hourly file it went to
+and its byte offset there, so LogIndex can find a time with a binary
+search and read from that offset, in the live file, a rotated one or
+its compressed segment.
+"""
+import logging
+import math
+import os
+import time
+from logging.handlers import TimedRotatingFileHandler
+
+import numpy as np
+
+from utils.segment_compressor import SUFFIX, SegmentReader, log_line_time
+
+INDEX_SUFFIX = '.idx'
+# TimedRotatingFileHandler suffix for when='H'
+HOURLY_SUFFIX = '%Y-%m-%d_%H'
+MARK_INTERVAL = 5.0
+KIND_MARK = 1
+KIND_ALARM = 2
+
+# record time, start of its hourly file, byte offset, kind, alarm bits
+INDEX_DTYPE = np.dtype([('time', '<f8'), ('file_start', '<f8'), ('offset', '<u8'),
+                        ('kind', 'u1'), ('pad', 'V3'), ('value', '<u4')])
+
+
+class IndexedRotatingFileHandler(TimedRotatingFileHandler):
+    """
+    TimedRotatingFileHandler that keeps the index. The only per record
+    cost is a time compare and an attribute lookup, the file position is
+    asked for once per entry.
+    """
+    def __init__(self, filename: str, when: str = 'h', interval: int = 1,
+                 backupCount: int = 0, mark_interval: float = MARK_INTERVAL) -> None:
+        TimedRotatingFileHandler.__init__(self, filename, when=when, interval=interval,
+                                          backupCount=backupCount)
+        self.mark_interval = mark_interval
+        self.indexFile = open(self.baseFilename + INDEX_SUFFIX, 'ab', buffering=0)
+        self.entry = np.zeros(1, INDEX_DTYPE)
+        self._nextMark = 0.0
+        #statistics
+        self.statEntries = 0
+
+    def emit(self, record: logging.LogRecord) -> None:
+        try:
+            if self.shouldRollover(record):
+                self.doRollover()
+                # the first record of every file is indexed
+                self._nextMark = 0.0
+            alarmbits = getattr(record, 'alarm_bits', None)
+            if alarmbits is not None or record.created >= self._nextMark:
+                self.index(record, alarmbits)
+            logging.FileHandler.emit(self, record)
+        except Exception:
+            self.handleError(record)
+
+    def index(self, record: logging.LogRecord, alarmbits) -> None:
+        if self.stream is None:
+            self.stream = self._open()
+        entry = self.entry[0]
+        entry['time'] = record.created
+        entry['file_start'] = self.rolloverAt - self.interval
+        # the stream is flushed after every record, tell() does not write
+        entry['offset'] = self.stream.tell()
+        if record.created >= self._nextMark:
+            self._nextMark = record.created + self.mark_interval
+            entry['kind'] = KIND_MARK
+            entry['value'] = 0
+            self.indexFile.write(self.entry.tobytes())
+            self.statEntries += 1
+        if alarmbits is not None:
+            entry['kind'] = KIND_ALARM
+            entry['value'] = alarmbits
+            self.indexFile.write(self.entry.tobytes())
+            self.statEntries += 1
+
+    def close(self) -> None:
+        self.acquire()
+        try:
+            self.indexFile.close()
+        finally:
+            self.release()
+        TimedRotatingFileHandler.close(self)
+
+
+def file_candidates(base: str, fileStart: float, suffix: str = HOURLY_SUFFIX) -> list:
+    """
+    Paths the hourly file starting at fileStart can have: rotated, as a
+    compressed segment, or still the live file. Rotation names are
+    shifted by an hour across a DST change, both are tried.
+    """
+    paths = []
+    for addend in (0, 3600, -3600):
+        name = base + '.' + time.strftime(suffix, time.localtime(fileStart + addend))
+        paths += [name, name + SUFFIX]
+    return paths + [base]
+
+
+def iter_lines(path: str, offset: int):
+    """ Lines of a log file or compressed segment from offset on, as bytes """
+    if path.endswith(SUFFIX):
+        reader = SegmentReader(path)
+        rest = b''
+        for data in reader.blocks(offset):
+            lines = (rest + data).split(b'\n')
+            rest = lines.pop()
+            for line in lines:
+                yield line + b'\n'
+        if rest:
+            yield rest
+        reader.close()
+        return
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        for line in f:
+            yield line
+
+
+class LogIndex():
+    """ Reads <base>.idx, call reload() to see entries written since """
+    def __init__(self, base: str, suffix: str = HOURLY_SUFFIX) -> None:
+        self.base = base
+        self.suffix = suffix
+        self.reload()
+
+    def reload(self) -> None:
+        path = self.base + INDEX_SUFFIX
+        size = os.path.getsize(path) // INDEX_DTYPE.itemsize
+        entries = np.fromfile(path, INDEX_DTYPE, size)
+        # records from several threads can be a little out of order
+        self.marks = np.sort(entries[entries['kind'] == KIND_MARK], order='time')
+        self.alarms = entries[entries['kind'] == KIND_ALARM]
+
+    def find(self, t: float) -> tuple:
+        """ (file_start, offset) of the last mark at or before t """
+        i = max(int(np.searchsorted(self.marks['time'], t, 'right')) - 1, 0)
+        mark = self.marks[i]
+        return float(mark['file_start']), int(mark['offset'])
+
+    def file_path(self, fileStart: float):
+        """ The existing path of the hourly file starting at fileStart, or None """
+        candidates = file_candidates(self.base, fileStart, self.suffix)
+        last = float(self.marks['file_start'][-1]) if len(self.marks) else None
+        if fileStart == last:
+            # the newest file is usually still the live one
+            candidates.insert(0, candidates.pop())
+        for path in candidates:
+            if os.path.exists(path):
+                return path
+        return None
+
+    def lines(self, start: float, end: float):
+        """ Log lines with times from start to end, across hourly files """
+        if not len(self.marks):
+            return
+        fileStart, offset = self.find(start)
+        fileStarts = np.unique(self.marks['file_start'])
+        started = False
+        for fileStart in fileStarts[fileStarts >= fileStart]:
+            path = self.file_path(float(fileStart))
+            if path is None:
+                # deleted by the rotation backup count
+                offset = 0
+                continue
+            for line in iter_lines(path, offset):
+                lineTime = log_line_time(line)
+                if lineTime > end:
+                    return
+                # lines without a time belong to the one before
+                if lineTime >= start or (started and math.isnan(lineTime)):
+                    started = True
+                    yield line
+                else:
+                    started = False
+            offset = 0
@@ -0,0 +1,155 @@
+# Copyright 2020 LifeMech  Inc
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+# associated documentation files (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge, publish, distribute,
+# sublicense, and/or sell copies of the Software, and to permit persons to whom the Software
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or
+# substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING
+# BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+
+
+"""
+Non-blocking logging: the root logger only puts records on a bounded
+queue and a listener thread formats them and does the file I/O. When
+the queue backs up, records are dropped by level instead of stalling
+the comms or GUI thread.
+"""
+import logging
+import queue
+import time
+from logging.handlers import QueueHandler, QueueListener
+
+QUEUE_SIZE = 4096
+# fraction of the queue each level may fill under 'drop_debug_first',
+# so debug goes first, then info and packet records, warnings last
+LEVEL_LIMITS = ((logging.DEBUG, 0.5), (25, 0.9), (logging.CRITICAL, 1.0))
+POLICIES = ('drop_debug_first', 'drop_newest')
+DROP_REPORT_INTERVAL = 10.0
+
+
+class DroppingQueueHandler(QueueHandler):
+    """
+    Never blocks. 'drop_newest' drops any record that finds the queue
+    full, 'drop_debug_first' admits each level only up to its share in
+    LEVEL_LIMITS. Drops are counted per level and reported as a warning.
+    """
+    def __init__(self, log_queue: queue.Queue, policy: str = 'drop_debug_first') -> None:
+        if policy not in POLICIES:
+            raise ValueError('unknown overflow policy ' + policy)
+        QueueHandler.__init__(self, log_queue)
+        self.policy = policy
+        size = log_queue.maxsize
+        if policy == 'drop_debug_first':
+            self.limits = tuple((level, max(1, int(size * share))) for level, share in LEVEL_LIMITS)
+        else:
+            self.limits = ((logging.CRITICAL, size),)
+        self._reported = 0
+        self._nextReport = 0.0
+        #statistics
+        self.statEnqueued = 0
+        self.statDropped = {}
+
+    def limit(self, levelno: int) -> int:
+        for level, limit in self.limits:
+            if levelno <= level:
+                return limit
+        return self.limits[-1][1]
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # the listener is in this process, formatting is left to it
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        if self.queue.qsize() >= self.limit(record.levelno):
+            self.drop(record)
+            return
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.drop(record)
+            return
+        self.statEnqueued += 1
+        if self._reported != self.dropped() and time.monotonic() >= self._nextReport:
+            self.report_drops()
+
+    def drop(self, record: logging.LogRecord) -> None:
+        self.statDropped[record.levelname] = self.statDropped.get(record.levelname, 0) + 1
+
+    def dropped(self) -> int:
+        return sum(self.statDropped.values())
+
+    def report_drops(self) -> None:
+        self._reported = self.dropped()
+        self._nextReport = time.monotonic() + DROP_REPORT_INTERVAL
+        record = logging.LogRecord('root', logging.WARNING, __file__, 0,
+                                   'Log queue overflow, dropped: %s', (self.statDropped,), None)
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            pass
+
+    def stats_summary(self) -> list:
+        return ['Log queue: depth:' + str(self.queue.qsize()) + ' enqueued:' +
+                str(self.statEnqueued) + ' dropped:' + str(self.statDropped)]
+
+
+class _Call():
+    """ Queued work for the listener thread, see LogPipeline.replace_handler """
+    def __init__(self, fn) -> None:
+        self.fn = fn
+
+
+class LogListener(QueueListener):
+    def enqueue_sentinel(self) -> None:
+        # waits for room, stop() must not be dropped
+        self.queue.put(self._sentinel)
+
+    def handle(self, record) -> None:
+        if isinstance(record, _Call):
+            record.fn()
+        else:
+            QueueListener.handle(self, record)
+
+
+class LogPipeline():
+    """
+    Puts a DroppingQueueHandler on logger and runs the given handlers on a
+    LogListener thread. Call stop() at exit to write out what is queued.
+    """
+    def __init__(self, logger: logging.Logger, handlers: list,
+                 size: int = QUEUE_SIZE, policy: str = 'drop_debug_first') -> None:
+        self.logger = logger
+        self.queue = queue.Queue(size)
+        self.handler = DroppingQueueHandler(self.queue, policy)
+        self.listener = LogListener(self.queue, *handlers, respect_handler_level=True)
+        self.listener.start()
+        logger.addHandler(self.handler)
+
+    def replace_handler(self, old: logging.Handler, new: logging.Handler) -> None:
+        """
+        Swaps old for new on the listener thread, between two records, and
+        closes old there, so no record is written to a closed handler.
+        """
+        def swap() -> None:
+            self.listener.handlers = tuple(new if h is old else h for h in self.listener.handlers)
+            old.close()
+        # not subject to the overflow policy
+        self.queue.put(_Call(swap))
+
+    def stop(self) -> None:
+        self.logger.removeHandler(self.handler)
+        self.listener.stop()
+        for handler in self.listener.handlers:
+            handler.close()
+
+    def stats_summary(self) -> list:
+        return self.handler.stats_summary()
@@ -20,11 +20,29 @@
 
 import struct
 
-from utils.crc import CRC
+from utils import crc
+from utils.frame_decoder import SYNC, PROTOCOL_VERSION, HEADER_LEN, CRC_LEN
+
+COMMAND_PACKET_TYPE = 0x02
+
+# v4 command payload, 28 bytes little endian
+COMMAND_STRUCT = struct.Struct('<BBHHhHhhhhhHHI')
+# payload_values() order
+COMMAND_FIELDS = ('mode_value', 'command', 'reserved', 'respiratory_rate_set',
+                  'tidal_volume_set', 'ie_ratio_set', 'pressure_set',
+                  'high_pressure_limit_set', 'low_pressure_limit_set',
+                  'high_volume_limit_set', 'low_volume_limit_set',
+                  'high_respiratory_rate_limit_set', 'low_respiratory_rate_limit_set',
+                  'alarm_bits')
+FRAME_HEADER_STRUCT = struct.Struct('<3sHBBB')
+CRC_STRUCT = struct.Struct('<H')
+COMMAND_FRAME_LEN = HEADER_LEN + COMMAND_STRUCT.size + CRC_LEN
 
 class OutPacket():
     def __init__(self) -> None:
-        self.crc = CRC()
+        # complete command frame, reused for every packet sent
+        self.frame = bytearray(COMMAND_FRAME_LEN)
+        self._frame_view = memoryview(self.frame)
         self.data = {
             'should_shut_down': 0,
             'mode_value': 0,                             # byte 3      - rpi unsigned char
@@ -43,29 +61,34 @@ class OutPacket():
             'alarm_bits':   0,              # bytes 16 - 19
             }                    # bytes 20 - 21 - rpi unsigned short int 
 
-    def to_bytes(self) -> bytes:
-        # create the return packet
-        endian = "little"
-        cmd_byteData = b""
-        #packet_version = 1
-        cmd_byteData += bytes(self.data['mode_value'].to_bytes(1, endian))        
-        cmd_byteData += bytes(self.data['command'].to_bytes(1, endian))  
-        cmd_byteData += bytes(self.data['reserved'].to_bytes(2, endian))   
-        cmd_byteData += bytes(self.data['respiratory_rate_set'].to_bytes(2, endian))   
-        cmd_byteData += bytes(self.data['tidal_volume_set'].to_bytes(2, endian, signed=True))     
-        cmd_byteData += bytes(self.data['ie_ratio_set'].to_bytes(2, endian))  
-        cmd_byteData += bytes(self.data['pressure_set'].to_bytes(2, endian, signed=True))
-        cmd_byteData += bytes(self.data['high_pressure_limit_set'].to_bytes(2, endian, signed=True))
-        cmd_byteData += bytes(self.data['low_pressure_limit_set'].to_bytes(2, endian, signed=True))         
-        cmd_byteData += bytes(self.data['high_volume_limit_set'].to_bytes(2, endian, signed=True))  
-        cmd_byteData += bytes(self.data['low_volume_limit_set'].to_bytes(2, endian, signed=True))
-        cmd_byteData += bytes(self.data['high_respiratory_rate_limit_set'].to_bytes(2, endian))
-        cmd_byteData += bytes(self.data['low_respiratory_rate_limit_set'].to_bytes(2, endian))        
+    def payload_values(self) -> tuple:
         # TO DO set alarmbits correctly if sequence or CRC failed
-        cmd_byteData += bytes(self.data['alarm_bits'].to_bytes(4, endian))
+        d = self.data
+        return (d['mode_value'], d['command'], d['reserved'],
+                d['respiratory_rate_set'], d['tidal_volume_set'], d['ie_ratio_set'],
+                d['pressure_set'], d['high_pressure_limit_set'], d['low_pressure_limit_set'],
+                d['high_volume_limit_set'], d['low_volume_limit_set'],
+                d['high_respiratory_rate_limit_set'], d['low_respiratory_rate_limit_set'],
+                d['alarm_bits'])
+
+    def to_bytes(self) -> bytes:
+        # command payload only, as logged
+        return COMMAND_STRUCT.pack(*self.payload_values())
+
+    def to_frame(self, sequenceNo: int, values: tuple = None) -> bytearray:
+        # Pack sync, header, payload and CRC into the preallocated frame so
+        # the whole packet goes out with a single write. The returned buffer
+        # is overwritten by the next call. values is a payload_values()
+        # snapshot taken on another thread, defaults to the current data.
+        if values is None:
+            values = self.payload_values()
+        FRAME_HEADER_STRUCT.pack_into(self.frame, 0, SYNC, sequenceNo, PROTOCOL_VERSION,
+                                      COMMAND_PACKET_TYPE, COMMAND_STRUCT.size)
+        COMMAND_STRUCT.pack_into(self.frame, HEADER_LEN, *values)
+        crcEnd = HEADER_LEN + COMMAND_STRUCT.size
+        CRC_STRUCT.pack_into(self.frame, crcEnd, crc.compute(self._frame_view[3:crcEnd]))
+        return self.frame
 
-        return cmd_byteData
-        
     def pack_command(self, run_state, upgrade_fw, should_shut_down, enable_calibration) -> int:
         return (((run_state == 1) << 0) |
                 ((enable_calibration == 1) << 1) |
@@ -22,284 +22,120 @@
 Read-only parameters from the MCU
 """
 import json
+import math
+from operator import attrgetter
 from typing import Union
 
+# Field order of Params, used by from_values(), to_dict() and to_JSON()
+FIELDS = ("seq_num", "packet_version", "mode", "resp_rate_meas", "resp_rate_set",
+          "tv_meas", "tv_set", "ie_ratio_meas", "ie_ratio_set", "peep", "ppeak", "pplat",
+          "pressure", "flow", "tv_insp", "tv_exp", "tv_rate", "control_state", "run_state",
+          "battery_level", "high_pressure_limit", "low_pressure_limit", "high_volume_limit",
+          "low_volume_limit", "high_resp_rate_limit", "low_resp_rate_limit", "alarm_bits",
+          "battery_charge")
 
-class Params():
-    """
-    Params defined in serialpacketv0.26.pptx
-    """
-    def __init__(self) -> None:
-        self._param: dict = {
-            "seq_num": 0,
-            "packet_version": 0,
-            "mode": 0,
-            "resp_rate_meas": 0,
-            "resp_rate_set": 0,
-            "tv_meas": 0,
-            "tv_set": 0,
-            "ie_ratio_meas": 0.0,
-            "ie_ratio_set": 0.0,
-            "peep": 0,
-            "ppeak": 0,
-            "pplat": 0,
-            "pressure": 0,
-            "flow": 0,
-            "tv_insp": 0,
-            "tv_exp": 0,
-            "tv_rate": 0,
-            "control_state": 0,
-            "run_state": 0,
-            "battery_level": 0,
-            'high_pressure_limit': 0,
-            'low_pressure_limit': 0,
-            'high_volume_limit': 0,
-            'low_volume_limit': 0,
-            'high_resp_rate_limit': 0,
-            'low_resp_rate_limit': 0,
-            'alarm_bits': 0,
-        }
-        #TODO: Do we need property and setter methods for alarm limits?
-
-    @property
-    def seq_num(self) -> int:
-        """ Sequence Number """
-        return self._param["seq_num"]
-
-    @seq_num.setter
-    def seq_num(self, value: int) -> None:
-        self._param["seq_num"] = value
-
-    @property
-    def packet_version(self) -> int:
-        return self._param["packet_version"]
-
-    @packet_version.setter
-    def packet_version(self, value: int) -> None:
-        self._param["packet_version"] = value
-
-    @property
-    def mode(self) -> int:
-        return self._param["mode"]
-
-    @mode.setter
-    def mode(self, value: int) -> None:
-        self._param["mode"] = value
-
-    @property
-    def resp_rate_meas(self) -> int:
-        return self._param["resp_rate_meas"]
-
-    @resp_rate_meas.setter
-    def resp_rate_meas(self, value: int) -> None:
-        self._param["resp_rate_meas"] = value
-
-    @property
-    def resp_rate_set(self) -> int:
-        return self._param["resp_rate_set"]
-
-    @resp_rate_set.setter
-    def resp_rate_set(self, value: int) -> None:
-        self._param["resp_rate_set"] = value
-
-    @property
-    def tv_meas(self) -> int:
-        return self._param["tv_meas"]
-
-    @tv_meas.setter
-    def tv_meas(self, value: int) -> None:
-        self._param["tv_meas"] = value
-
-    @property
-    def tv_set(self) -> int:
-        return self._param["tv_set"]
-
-    @tv_set.setter
-    def tv_set(self, value: int) -> None:
-        self._param["tv_set"] = value
-
-    @property
-    def ie_ratio_meas(self) -> float:
-        return self._param["ie_ratio_meas"]
-
-    @ie_ratio_meas.setter
-    def ie_ratio_meas(self, value: float) -> None:
-        self._param["ie_ratio_meas"] = value
-
-    @property
-    def ie_ratio_set(self) -> float:
-        return self._param["ie_ratio_set"]
-
-    @ie_ratio_set.setter
-    def ie_ratio_set(self, value: float) -> None:
-        self._param["ie_ratio_set"] = value
-
-    @property
-    def peep(self) -> int:
-        return self._param["peep"]
-
-    @peep.setter
-    def peep(self, value: int) -> None:
-        self._param["peep"] = value
-
-    @property
-    def ppeak(self) -> int:
-        return self._param["ppeak"]
-
-    @ppeak.setter
-    def ppeak(self, value: int) -> None:
-        self._param["ppeak"] = value
-
-    @property
-    def pplat(self) -> Union[int, float]:
-        return self._param["pplat"]
-
-    @pplat.setter
-    def pplat(self, value: Union[int, float]) -> None:
-        self._param["pplat"] = value
-
-    @property
-    def pressure(self) -> Union[int, float]:
-        return self._param["pressure"]
-
-    @pressure.setter
-    def pressure(self, value: Union[int, float]) -> None:
-        self._param["pressure"] = value
-
-    @property
-    def flow(self) -> Union[int, float]:
-        return self._param["flow"]
-
-    @flow.setter
-    def flow(self, value: Union[int, float]) -> None:
-        self._param["flow"] = value
+_get_fields = attrgetter(*FIELDS)
 
-    @property
-    def tv_insp(self) -> int:
-        return self._param["tv_insp"]
+# to_JSON output for plain int and float values, the same text json.dumps gives
+_JSON_TEMPLATE = '{' + ', '.join('"' + name + '": %r' for name in FIELDS) + '}'
+_JSON_TYPES = frozenset((int, float))
 
-    @tv_insp.setter
-    def tv_insp(self, value: int) -> None:
-        self._param["tv_insp"] = value
 
-    @property
-    def tv_exp(self) -> int:
-        return self._param["tv_exp"]
-
-    @tv_exp.setter
-    def tv_exp(self, value: int) -> None:
-        self._param["tv_exp"] = value
-
-    @property
-    def tv_rate(self) -> int:
-        return self._param["tv_rate"]
-
-    @tv_rate.setter
-    def tv_rate(self, value: int) -> None:
-        self._param["tv_rate"] = value
-
-    @property
-    def control_state(self) -> int:
-        return self._param["control_state"]
-
-    @control_state.setter
-    def control_state(self, value: int) -> None:
-        self._param["control_state"] = value
-
-    @property
-    def run_state(self) -> int:
-        return self._param["run_state"]
-
-    @run_state.setter
-    def run_state(self, value: int) -> None:
-        self._param["run_state"] = value
-
-    @property
-    def battery_level(self) -> int:
-        return self._param["battery_level"]
-
-    @battery_level.setter
-    def battery_level(self, value: int) -> None:
-        self._param["battery_level"] = value
-
-    def to_JSON(self) -> str:
-        """ Convert OVVE UI Params to JSON file """
-        return json.dumps(self._param)
-
-    @property
-    def battery_charge(self) -> int:
-        return self._param["battery_charge"]
-
-    @battery_charge.setter
-    def battery_charge(self, value: int) -> None:
-        self._param["battery_charge"] = value
-
-    @property
-    def high_pressure_limit(self) -> int:
-        return self._param["high_pressure_limit"]
-
-    @high_pressure_limit.setter
-    def high_pressure_limit(self, value: int) -> None:
-        self._param["high_pressure_limit"] = value
-
-    @property
-    def low_pressure_limit(self) -> int:
-        return self._param["low_pressure_limit"]
-
-    @low_pressure_limit.setter
-    def low_pressure_limit(self, value: int) -> None:
-        self._param["low_pressure_limit"] = value
-
-    @property
-    def high_volume_limit(self) -> int:
-        return self._param["high_volume_limit"]
-
-    @high_volume_limit.setter
-    def high_volume_limit(self, value: int) -> None:
-        self._param["high_volume_limit"] = value
-
-    @property
-    def low_volume_limit(self) -> int:
-        return self._param["low_volume_limit"]
-
-    @low_volume_limit.setter
-    def low_volume_limit(self, value: int) -> None:
-        self._param["low_volume_limit"] = value
-
-    @property
-    def high_resp_rate_limit(self) -> int:
-        return self._param["high_resp_rate_limit"]
-
-    @high_resp_rate_limit.setter
-    def high_resp_rate_limit(self, value: int) -> None:
-        self._param["high_resp_rate_imit"] = value
-
-    @property
-    def low_resp_rate_limit(self) -> int:
-        return self._param["low_resp_rate_limit"]
-
-    @low_resp_rate_limit.setter
-    def low_resp_rate_limit(self, value: int) -> None:
-        self._param["low_resp_rate_limit"] = value
-
-    @property
-    def alarm_bits(self) -> int:
-        return self._param["alarm_bits"]
+class Params():
+    """
+    Params defined in serialpacketv0.26.pptx
 
-    @alarm_bits.setter
-    def alarm_bits(self, value: int) -> None:
-        self._param["alarm_bits"] = value
+    One is created per status packet, so the fields are plain slot
+    attributes: no per-instance dict, and no property call on access.
+    """
+    __slots__ = FIELDS + ("timestamps",)
+
+    def __init__(self,
+                 seq_num: int = 0,
+                 packet_version: int = 0,
+                 mode: int = 0,
+                 resp_rate_meas: int = 0,
+                 resp_rate_set: int = 0,
+                 tv_meas: int = 0,
+                 tv_set: int = 0,
+                 ie_ratio_meas: float = 0.0,
+                 ie_ratio_set: float = 0.0,
+                 peep: int = 0,
+                 ppeak: int = 0,
+                 pplat: Union[int, float] = 0,
+                 pressure: Union[int, float] = 0,
+                 flow: Union[int, float] = 0,
+                 tv_insp: int = 0,
+                 tv_exp: int = 0,
+                 tv_rate: int = 0,
+                 control_state: int = 0,
+                 run_state: int = 0,
+                 battery_level: int = 0,
+                 high_pressure_limit: int = 0,
+                 low_pressure_limit: int = 0,
+                 high_volume_limit: int = 0,
+                 low_volume_limit: int = 0,
+                 high_resp_rate_limit: int = 0,
+                 low_resp_rate_limit: int = 0,
+                 alarm_bits: int = 0,
+                 battery_charge: int = 0) -> None:
+        self.seq_num = seq_num
+        self.packet_version = packet_version
+        self.mode = mode
+        self.resp_rate_meas = resp_rate_meas
+        self.resp_rate_set = resp_rate_set
+        self.tv_meas = tv_meas
+        self.tv_set = tv_set
+        self.ie_ratio_meas = ie_ratio_meas
+        self.ie_ratio_set = ie_ratio_set
+        self.peep = peep
+        self.ppeak = ppeak
+        self.pplat = pplat
+        self.pressure = pressure
+        self.flow = flow
+        self.tv_insp = tv_insp
+        self.tv_exp = tv_exp
+        self.tv_rate = tv_rate
+        self.control_state = control_state
+        self.run_state = run_state
+        self.battery_level = battery_level
+        self.high_pressure_limit = high_pressure_limit
+        self.low_pressure_limit = low_pressure_limit
+        self.high_volume_limit = high_volume_limit
+        self.low_volume_limit = low_volume_limit
+        self.high_resp_rate_limit = high_resp_rate_limit
+        self.low_resp_rate_limit = low_resp_rate_limit
+        self.alarm_bits = alarm_bits
+        self.battery_charge = battery_charge
+        # perf_counter() stamps per utils.latency_trace.STAGES, None
+        # unless latency tracing is enabled
+        self.timestamps = None
+
+    @classmethod
+    def from_values(cls, values) -> 'Params':
+        """ Build from a sequence of values in FIELDS order """
+        return cls(*values)
+
+    def to_values(self) -> tuple:
+        return _get_fields(self)
+
+    def to_dict(self) -> dict:
+        return dict(zip(FIELDS, _get_fields(self)))
 
     def to_JSON(self) -> str:
         """ Convert OVVE UI Params to JSON file """
-        return json.dumps(self._param)
+        values = _get_fields(self)
+        # json.dumps for anything else, e.g. bools, numpy scalars or NaN
+        if _JSON_TYPES.issuperset(map(type, values)) and math.isfinite(sum(values)):
+            return _JSON_TEMPLATE % values
+        return json.dumps(dict(zip(FIELDS, values)))
 
     def from_dict(self, input_dict: dict) -> None:
         """ Set OVVE UI params from input dictionary """
         for key in input_dict:
             # Check if key from input_dict exists in ours
-            if key in self._param:
-                self._param[key] = input_dict[key]
+            if key in FIELDS:
+                setattr(self, key, input_dict[key])
 
     def from_JSON(self, j_str: str) -> None:
         j = json.loads(j_str)
@@ -0,0 +1,151 @@
+# Copyright 2020 LifeMech  Inc
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+# associated documentation files (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge, publish, distribute,
+# sublicense, and/or sell copies of the Software, and to permit persons to whom the Software
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or
+# substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING
+# BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+
+
+
+"""
+Replay of a binary.log capture (or its compressed segment) as a
+transport, see make_transport's replay: spec and utils.tools.replay_capture
+"""
+import threading
+import time
+
+import numpy as np
+
+from utils.capture_reader import load_capture, scan_frames
+from utils.segment_compressor import SUFFIX, read_timestamps
+from utils.transports import READ_CHUNK, Transport, TransportError
+
+# MCU status period, paces a replay from sequence numbers
+STATUS_PERIOD = 0.01
+REPLAY_PACING = ('auto', 'seq', 'timestamps')
+
+
+class ReplayTransport(Transport):
+    """
+    Plays a binary.log capture (or its compressed segment) back as if the
+    MCU sent it, speed times faster than recorded, speed 0 as fast as it
+    is read. Replies are discarded.
+
+    Pacing 'timestamps' releases each frame at its time interpolated from
+    the capture's .ts sidecar. 'seq' releases each frame one STATUS_PERIOD per sequence
+    step after the one before, so lost frames keep their time. 'auto'
+    uses the sidecar when there is one.
+    """
+    def __init__(self, path: str, speed: float = 1.0, pacing: str = 'auto',
+                 loop: bool = False, timeout: float = 0.065) -> None:
+        super().__init__(timeout)
+        if pacing not in REPLAY_PACING:
+            raise ValueError('unknown replay pacing ' + pacing)
+        self.path = path
+        self.speed = speed
+        self.pacing = pacing
+        self.loop = loop
+        self.finished = False
+        self.data = None
+        # chunk i is data[ends[i - 1]:ends[i]], released due[i] after start
+        self.ends = None
+        self.due = None
+        self.pos = 0
+        self._start = None
+        self._closed = threading.Event()
+        #statistics
+        self.statBytesRead = 0
+        self.statBytesWritten = 0
+        self.statLoops = 0
+
+    def open(self) -> bool:
+        try:
+            self.data = load_capture(self.path)
+        except (OSError, ValueError):
+            self.logger.exception("Cannot replay %r" % self.path)
+            return False
+        base = self.path[:-len(SUFFIX)] if self.path.endswith(SUFFIX) else self.path
+        offsets, times = read_timestamps(base)
+        if self.pacing == 'timestamps' and not offsets:
+            self.logger.error("%r has no timestamp sidecar" % self.path)
+            return False
+        frames = scan_frames(self.data)
+        frames = frames[frames['crc_ok']]
+        starts = frames['offset']
+        if self.pacing != 'seq' and offsets:
+            # the sidecar has a stamp every TS_INTERVAL, frames in between
+            # are spread over it
+            due = np.interp(starts, offsets, times) - times[0]
+        else:
+            # a jump backwards is the MCU restarting, count it as one step
+            steps = (np.diff(frames['seq_num'].astype(np.int64)) - 1) % 65536 + 1
+            steps[steps >= 0x8000] = 1
+            due = np.concatenate(([0], np.cumsum(steps))) * STATUS_PERIOD
+        if len(starts) == 0:
+            starts = np.zeros(1, np.int64)
+            due = np.zeros(1)
+        # leading bytes go with the first chunk
+        self.ends = np.append(starts[1:], len(self.data))
+        self.due = due / self.speed if self.speed > 0 else np.zeros(len(due))
+        self.pos = 0
+        self._start = None
+        self.finished = False
+        self._closed.clear()
+        self.is_open = True
+        self.logger.info("Replaying %r, %d bytes over %.1f s" %
+                         (self.path, len(self.data), self.due[-1]))
+        return True
+
+    def close(self) -> None:
+        self.is_open = False
+        self._closed.set()
+
+    def read_available(self, timeout: float, size: int = READ_CHUNK) -> bytes:
+        if not self.is_open:
+            raise TransportError('Transport is closed')
+        now = time.monotonic()
+        if self._start is None:
+            # the clock starts at the first read, not at open()
+            self._start = now
+        if self.pos >= len(self.data):
+            if not self.loop:
+                self.finished = True
+                self._closed.wait(timeout)
+                return b''
+            self.pos = 0
+            self._start = now
+            self.statLoops += 1
+        chunk = int(np.searchsorted(self.ends, self.pos, 'right'))
+        wait = self._start + self.due[chunk] - now
+        if wait > timeout:
+            self._closed.wait(timeout)
+            return b''
+        if wait > 0 and self._closed.wait(wait):
+            return b''
+        released = int(np.searchsorted(self.due, time.monotonic() - self._start, 'right'))
+        end = min(int(self.ends[max(released, chunk + 1) - 1]), self.pos + size)
+        data = self.data[self.pos:end].tobytes()
+        self.pos = end
+        self.statBytesRead += len(data)
+        return data
+
+    def write(self, data) -> int:
+        if not self.is_open:
+            raise TransportError('Transport is closed')
+        self.statBytesWritten += len(data)
+        return len(data)
+
+    def reset_input_buffer(self) -> None:
+        # nothing has arrived before the first read
+        pass
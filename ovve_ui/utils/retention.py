@@ -0,0 +1,249 @@
+# Copyright 2020 LifeMech  Inc
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+# associated documentation files (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge, publish, distribute,
+# sublicense, and/or sell copies of the Software, and to permit persons to whom the Software
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or
+# substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING
+# BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+
+
+"""
+Disk budget for the log stores (/tmp/ovve_logs, /home/pi/logs). A low
+priority thread keeps each store under its byte budget by deleting the
+oldest files first, never touching protected paths (the current
+patient's logs, the files the comms engine has open) or files written
+in the last min_age seconds. A store only counts and deletes the files
+its match accepts. It also frees space when a filesystem gets close to
+full, sharing the shortfall between the stores on it.
+
+Sizes are kept in memory. After the first scan a directory is listed
+again only when its mtime changes (a file was added, removed or
+renamed) and only recently written files are stat'ed again, so a check
+costs a stat per directory and per live file, not a walk of the tree.
+"""
+import logging
+import os
+import threading
+import time
+from typing import Callable, Iterable, Optional
+
+from utils.capture_log import is_capture_file
+from utils.segment_compressor import NICE, SUFFIX
+from utils.session_recorder import is_session_file
+
+INTERVAL = 30.0
+# files written this recently are live or about to be compressed
+MIN_AGE = 600.0
+# files written this recently may still grow and are stat'ed every check
+HOT_AGE = 7200.0
+# evict down to this share of the budget, so eviction is not run per file
+LOW_WATER = 0.9
+# keep this much free on the filesystem whatever the budgets
+MIN_FREE = 64 * 1024 * 1024
+
+
+def is_capture_artifact(name: str) -> bool:
+    """ Capture pairs, their sidecars and compressed segments, session recordings """
+    for suffix in (SUFFIX, '.ts'):
+        if name.endswith(suffix):
+            name = name[:-len(suffix)]
+    return is_capture_file(name) or is_session_file(name)
+
+
+class RetentionStore():
+    """
+    One directory tree and its budget in bytes. protect returns the
+    directories and files that must be kept, it is called on the
+    retention thread. With match only files whose name it accepts are
+    counted and deleted.
+    """
+    def __init__(self, root: str, budget: int,
+                 protect: Optional[Callable[[], Iterable[str]]] = None,
+                 min_age: float = MIN_AGE,
+                 match: Optional[Callable[[str], bool]] = None) -> None:
+        self.logger = logging.getLogger()
+        self.root = root
+        self.budget = budget
+        self.protect = protect
+        self.min_age = min_age
+        self.match = match
+        # directory -> st_mtime_ns when it was listed, file -> (size, mtime)
+        self.dirs = {}
+        self.dirFiles = {}
+        self.files = {}
+        self.total = 0
+        #statistics
+        self.statListings = 0
+        self.statEvicted = 0
+        self.statEvictedBytes = 0
+
+    def refresh(self, now: float) -> None:
+        if not self.dirs:
+            self._list(self.root)
+        for dirName in list(self.dirs):
+            if dirName not in self.dirs:
+                continue
+            try:
+                mtime = os.stat(dirName).st_mtime_ns
+            except FileNotFoundError:
+                self._forget_dir(dirName)
+                continue
+            if mtime != self.dirs[dirName]:
+                self._list(dirName)
+        for path, (size, mtime) in list(self.files.items()):
+            if now - mtime < HOT_AGE:
+                self._stat(path)
+
+    def _list(self, dirName: str) -> None:
+        try:
+            self.dirs[dirName] = os.stat(dirName).st_mtime_ns
+            entries = list(os.scandir(dirName))
+        except FileNotFoundError:
+            self._forget_dir(dirName)
+            return
+        self.statListings += 1
+        seen = set()
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                if entry.path not in self.dirs:
+                    self._list(entry.path)
+            elif entry.is_file(follow_symlinks=False):
+                if self.match is not None and not self.match(entry.name):
+                    continue
+                seen.add(entry.path)
+                if entry.path not in self.files:
+                    self._stat(entry.path)
+        for path in self.dirFiles.get(dirName, set()) - seen:
+            self._forget(path)
+        self.dirFiles[dirName] = seen
+
+    def _stat(self, path: str) -> None:
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            self._forget(path)
+            return
+        old = self.files.get(path)
+        self.total += st.st_size - (old[0] if old else 0)
+        self.files[path] = (st.st_size, st.st_mtime)
+
+    def _forget(self, path: str) -> None:
+        old = self.files.pop(path, None)
+        if old is not None:
+            self.total -= old[0]
+
+    def _forget_dir(self, dirName: str) -> None:
+        self.dirs.pop(dirName, None)
+        for path in self.dirFiles.pop(dirName, set()):
+            self._forget(path)
+
+    def evict(self, now: float, target: int) -> None:
+        """ Deletes the oldest unprotected files until total <= target """
+        keep = set(self.protect()) if self.protect else set()
+        protected = tuple(os.path.join(path, '') for path in keep)
+        candidates = sorted((mtime, path) for path, (size, mtime) in self.files.items()
+                            if now - mtime >= self.min_age and path not in keep and
+                            not path.startswith(protected))
+        emptied = set()
+        for mtime, path in candidates:
+            if self.total <= target:
+                break
+            size = self.files[path][0]
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                self.logger.warning('Retention could not remove %s: %s', path, e)
+                continue
+            self._forget(path)
+            dirName = os.path.dirname(path)
+            self.dirFiles.get(dirName, set()).discard(path)
+            emptied.add(dirName)
+            self.statEvicted += 1
+            self.statEvictedBytes += size
+        for dirName in emptied:
+            if dirName != self.root and not self.dirFiles.get(dirName):
+                try:
+                    os.rmdir(dirName)
+                    self._forget_dir(dirName)
+                except OSError:
+                    pass
+
+    def stats_summary(self) -> list:
+        return ['Retention ' + self.root + ': used:' + str(self.total) + ' budget:' +
+                str(self.budget) + ' files:' + str(len(self.files)) + ' listings:' +
+                str(self.statListings) + ' evicted:' + str(self.statEvicted) +
+                ' evicted bytes:' + str(self.statEvictedBytes)]
+
+
+class RetentionManager(threading.Thread):
+    def __init__(self, stores: list, interval: float = INTERVAL,
+                 min_free: int = MIN_FREE) -> None:
+        threading.Thread.__init__(self, name='Retention', daemon=True)
+        self.logger = logging.getLogger()
+        self.stores = stores
+        self.interval = interval
+        self.min_free = min_free
+        self._done = threading.Event()
+
+    def stop(self) -> None:
+        self._done.set()
+
+    def run(self) -> None:
+        try:
+            # per thread on Linux, the comms and UI threads keep their priority
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), NICE)
+        except (AttributeError, OSError):
+            pass
+        while not self._done.is_set():
+            try:
+                self.check()
+            except Exception:
+                self.logger.exception('Retention check failed')
+            self._done.wait(self.interval)
+
+    def check(self) -> None:
+        now = time.time()
+        # st_dev -> bytes still to free on that filesystem, what one store
+        # frees is not asked of the next
+        missing = {}
+        for store in self.stores:
+            try:
+                dev = os.stat(store.root).st_dev
+            except OSError:
+                continue
+            store.refresh(now)
+            if dev not in missing:
+                missing[dev] = 0
+                try:
+                    st = os.statvfs(store.root)
+                    missing[dev] = self.min_free - st.f_bavail * st.f_frsize
+                except OSError:
+                    pass
+            target = store.budget
+            if missing[dev] > 0:
+                target = min(target, store.total - missing[dev])
+            if store.total > target:
+                evicted = store.statEvictedBytes
+                store.evict(now, int(target * LOW_WATER))
+                freed = store.statEvictedBytes - evicted
+                missing[dev] -= freed
+                self.logger.warning('Retention freed %d bytes in %s, %d used of %d',
+                                    freed, store.root, store.total, store.budget)
+
+    def stats_summary(self) -> list:
+        lines = []
+        for store in self.stores:
+            lines += store.stats_summary()
+        return lines
@@ -0,0 +1,156 @@
+# Copyright 2020 LifeMech  Inc
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+# associated documentation files (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge, publish, distribute,
+# sublicense, and/or sell copies of the Software, and to permit persons to whom the Software
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or
+# substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING
+# BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+
+
+"""
+Single-producer ring buffer of samples in a preallocated NumPy structured
+array. The comms thread writes, any number of readers each keep their own
+cursor and take everything written since their last read. No locks: the
+writer publishes a row by advancing head after storing it, and a reader
+checks after copying that the writer has not lapped the rows it copied.
+"""
+from multiprocessing import shared_memory
+
+import numpy as np
+
+HEAD_LEN = 8
+
+
+class SampleRing():
+    def __init__(self, dtype: np.dtype, capacity: int = 4096,
+                 buffer: np.ndarray = None) -> None:
+        if capacity & (capacity - 1):
+            raise ValueError('capacity must be a power of two')
+        self.buffer = np.zeros(capacity, dtype) if buffer is None else buffer
+        self.capacity = capacity
+        self._mask = capacity - 1
+        # total rows ever written, only the writer changes it
+        self.head = 0
+        self.readers = []
+
+    def write(self, row: tuple) -> None:
+        self.buffer[self.head & self._mask] = row
+        self.head += 1
+
+    def write_block(self, rows: np.ndarray) -> None:
+        total = len(rows)
+        # only the newest capacity rows survive, head moves once they are stored
+        skip = max(0, total - self.capacity)
+        rows = rows[skip:]
+        count = total - skip
+        start = (self.head + skip) & self._mask
+        first = min(count, self.capacity - start)
+        self.buffer[start:start + first] = rows[:first]
+        self.buffer[:count - first] = rows[first:]
+        self.head += total
+
+    def reader(self, name: str = '') -> 'RingReader':
+        """ New read cursor starting at the current head """
+        reader = RingReader(self, name)
+        self.readers.append(reader)
+        return reader
+
+    def stats_summary(self) -> list:
+        return ['Sample ring: written:' + str(self.head) + ' ' +
+                ' '.join(r.name + ' fill:' + str(r.fill()) + ' overruns:' + str(r.statOverruns)
+                         for r in self.readers)]
+
+
+class RingReader():
+    def __init__(self, ring: SampleRing, name: str) -> None:
+        self.ring = ring
+        self.name = name
+        self.cursor = ring.head
+        #statistics
+        self.statOverruns = 0
+        self.statRead = 0
+
+    def fill(self) -> int:
+        """ Rows waiting for this reader """
+        return min(self.ring.head - self.cursor, self.ring.capacity)
+
+    def read(self, head: int = None) -> np.ndarray:
+        """
+        Copy of every row written since the last read, oldest first. head
+        limits the read to rows the writer has announced, e.g. in a tick.
+        """
+        ring = self.ring
+        if head is None:
+            head = ring.head
+        start = max(self.cursor, head - ring.capacity)
+        self.statOverruns += start - self.cursor
+        first = start & ring._mask
+        end = first + (head - start)
+        if end <= ring.capacity:
+            rows = ring.buffer[first:end].copy()
+        else:
+            rows = np.concatenate((ring.buffer[first:], ring.buffer[:end - ring.capacity]))
+        # rows the writer reached while they were copied may be torn,
+        # including the one it may be storing right now
+        lapped = min(ring.head - ring.capacity - start + 1, len(rows))
+        if lapped > 0:
+            rows = rows[lapped:]
+            self.statOverruns += lapped
+        self.cursor = head
+        self.statRead += len(rows)
+        return rows
+
+
+class SharedSampleRing(SampleRing):
+    """
+    SampleRing in multiprocessing shared memory, head is kept in the first
+    8 bytes so a writer in another process can continue after a restart.
+    The creator owns the block and unlinks it in close().
+    """
+    def __init__(self, dtype: np.dtype, capacity: int = 4096, name: str = None) -> None:
+        if capacity & (capacity - 1):
+            raise ValueError('capacity must be a power of two')
+        dtype = np.dtype(dtype)
+        self.owner = name is None
+        if self.owner:
+            self.shm = shared_memory.SharedMemory(create=True,
+                                                  size=HEAD_LEN + capacity * dtype.itemsize)
+        else:
+            # a spawned child shares its parent's resource tracker, so
+            # attaching does not hand the block to this process
+            self.shm = shared_memory.SharedMemory(name=name)
+        self.name = self.shm.name
+        self._head = np.ndarray(1, np.int64, self.shm.buf, 0)
+        if self.owner:
+            self._head[0] = 0
+        # not SampleRing.__init__, which would reset a live head
+        self.buffer = np.ndarray(capacity, dtype, self.shm.buf, HEAD_LEN)
+        self.capacity = capacity
+        self._mask = capacity - 1
+        self.readers = []
+
+    @property
+    def head(self) -> int:
+        return int(self._head[0])
+
+    @head.setter
+    def head(self, value: int) -> None:
+        self._head[0] = value
+
+    def close(self) -> None:
+        # numpy views must go before the mapping can be closed
+        self._head = None
+        self.buffer = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
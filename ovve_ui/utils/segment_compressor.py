@@ -0,0 +1,328 @@
+# Copyright 2020 LifeMech  Inc
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+# associated documentation files (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge, publish, distribute,
+# sublicense, and/or sell copies of the Software, and to permit persons to whom the Software
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or
+# substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING
+# BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+
+
+"""
+Compression of finished log segments (rotated capture pairs and hourly
+log backups) on a low-priority thread. Only finished files are ever
+submitted, the live capture and log files are not read.
+
+A compressed segment is a plain multi-member gzip file, zcat gives back
+the original. Every BLOCK_SIZE bytes of input is its own gzip member and
+the file ends with an empty member whose header extra field holds the
+block index: (raw offset, compressed offset, time of first byte) per
+block. SegmentReader uses it to start decompressing at a time or offset.
+A capture file's .ts timestamp sidecar goes into empty members at the
+start of the file, in the same way, and is then removed with the file.
+"""
+import logging
+import logging.handlers
+import math
+import os
+import queue
+import re
+import struct
+import threading
+import zlib
+from bisect import bisect_right
+from datetime import datetime
+from typing import Callable, Optional
+
+from utils.capture_log import TS_STRUCT
+
+BLOCK_SIZE = 256 * 1024
+COMPRESS_LEVEL = 6
+# lowest CPU priority, the kernel also derives the IO priority from it
+NICE = 19
+SUFFIX = '.gz'
+
+# raw offset, compressed offset, time.time() of the first byte or nan
+INDEX_ENTRY = struct.Struct('<QQd')
+# raw size, block count, at the end of the index
+INDEX_TRAILER = struct.Struct('<QI')
+INDEX_ID = b'OI'
+TS_ID = b'OT'
+# gzip header with FEXTRA set, no mtime, unknown OS
+GZIP_EXTRA_HEADER = b'\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff'
+# empty deflate stream, CRC32 and size of nothing
+GZIP_EMPTY_TAIL = b'\x03\x00' + bytes(8)
+# an extra field is at most 65535 bytes
+MAX_BLOCKS = (0xffff - 4 - INDEX_TRAILER.size) // INDEX_ENTRY.size
+TS_CHUNK = (0xffff - 4) // TS_STRUCT.size * TS_STRUCT.size
+EXTRA_HEADER_LEN = len(GZIP_EXTRA_HEADER) + 2 + 2 + 2
+
+# start of a line written by the '%(asctime)s - ...' log formatter
+LOG_TIME = re.compile(rb'^(\d{4}-\d\d-\d\d \d\d:\d\d:\d\d),(\d{3}) ', re.M)
+
+
+def log_line_time(data: bytes) -> float:
+    """ Time of the first log line that starts in data, nan if none """
+    match = LOG_TIME.search(data)
+    if match is None:
+        return math.nan
+    stamp = datetime.strptime(match.group(1).decode(), '%Y-%m-%d %H:%M:%S')
+    return stamp.timestamp() + int(match.group(2)) / 1000
+
+
+def extra_member(fieldId: bytes, data: bytes) -> bytes:
+    """ Empty gzip member carrying data in its header extra field """
+    return (GZIP_EXTRA_HEADER + struct.pack('<H', len(data) + 4) + fieldId +
+            struct.pack('<H', len(data)) + data + GZIP_EMPTY_TAIL)
+
+
+def folded_timestamps(f) -> bytes:
+    """ Sidecar data from the TS_ID members at the start of a segment """
+    data = bytearray()
+    while True:
+        header = f.read(EXTRA_HEADER_LEN)
+        if (len(header) < EXTRA_HEADER_LEN or not header.startswith(GZIP_EXTRA_HEADER) or
+                header[-4:-2] != TS_ID):
+            return bytes(data)
+        data += f.read(struct.unpack_from('<H', header, EXTRA_HEADER_LEN - 2)[0])
+        f.seek(len(GZIP_EMPTY_TAIL), os.SEEK_CUR)
+
+
+def read_sidecar(path: str) -> bytes:
+    """ The path + '.ts' sidecar, or what its segment holds once compressed """
+    try:
+        with open(path + '.ts', 'rb') as f:
+            return f.read()
+    except FileNotFoundError:
+        pass
+    try:
+        with open(path + SUFFIX, 'rb') as f:
+            return folded_timestamps(f)
+    except FileNotFoundError:
+        return b''
+
+
+def read_timestamps(path: str) -> tuple:
+    """ (offsets, times) from the timestamp sidecar of capture file path """
+    offsets = []
+    times = []
+    data = read_sidecar(path)
+    for t, offset in TS_STRUCT.iter_unpack(data[:len(data) - len(data) % TS_STRUCT.size]):
+        offsets.append(offset)
+        times.append(t)
+    return offsets, times
+
+
+def compress_segment(src: str, dst: str, level: int = COMPRESS_LEVEL) -> tuple:
+    """
+    Writes the indexed gzip of src to dst. Block times come from the .ts
+    sidecar when src has one, which is folded in, otherwise from log line
+    timestamps. Returns (raw size, compressed size).
+    """
+    try:
+        with open(src + '.ts', 'rb') as f:
+            sidecar = f.read()
+    except FileNotFoundError:
+        sidecar = b''
+    sidecar = sidecar[:len(sidecar) - len(sidecar) % TS_STRUCT.size]
+    stampOffsets = []
+    stampTimes = []
+    for t, offset in TS_STRUCT.iter_unpack(sidecar):
+        stampOffsets.append(offset)
+        stampTimes.append(t)
+    rawSize = os.path.getsize(src)
+    blockSize = max(BLOCK_SIZE, -(-rawSize // MAX_BLOCKS))
+    index = bytearray()
+    rawOffset = 0
+    count = 0
+    with open(src, 'rb') as fin, open(dst, 'wb') as fout:
+        for start in range(0, len(sidecar), TS_CHUNK):
+            fout.write(extra_member(TS_ID, sidecar[start:start + TS_CHUNK]))
+        while True:
+            data = fin.read(blockSize)
+            if not data:
+                break
+            if stampOffsets:
+                i = bisect_right(stampOffsets, rawOffset) - 1
+                blockTime = stampTimes[max(i, 0)]
+            else:
+                blockTime = log_line_time(data)
+            index += INDEX_ENTRY.pack(rawOffset, fout.tell(), blockTime)
+            compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+            fout.write(compressor.compress(data) + compressor.flush())
+            rawOffset += len(data)
+            count += 1
+        index += INDEX_TRAILER.pack(rawOffset, count)
+        fout.write(extra_member(INDEX_ID, bytes(index)))
+        fout.flush()
+        os.fsync(fout.fileno())
+        return rawOffset, fout.tell()
+
+
+class SegmentReader():
+    """ Random access to a compressed segment through its block index """
+    def __init__(self, path: str) -> None:
+        self.file = open(path, 'rb')
+        self.file.seek(0, os.SEEK_END)
+        self.size = self.file.tell()
+        tailLen = INDEX_TRAILER.size + len(GZIP_EMPTY_TAIL)
+        if self.size < tailLen:
+            raise ValueError(path + ' has no block index')
+        self.file.seek(self.size - tailLen)
+        tail = self.file.read(tailLen)
+        self.rawSize, count = INDEX_TRAILER.unpack_from(tail)
+        indexLen = count * INDEX_ENTRY.size
+        memberLen = (len(GZIP_EXTRA_HEADER) + 2 + len(INDEX_ID) + 2 + indexLen +
+                     INDEX_TRAILER.size + len(GZIP_EMPTY_TAIL))
+        self.indexStart = self.size - memberLen
+        self.file.seek(self.indexStart)
+        member = self.file.read(memberLen)
+        headerLen = len(GZIP_EXTRA_HEADER) + 2 + len(INDEX_ID) + 2
+        if (not member.startswith(GZIP_EXTRA_HEADER) or
+                member[headerLen - 4:headerLen - 2] != INDEX_ID):
+            raise ValueError(path + ' has no block index')
+        entries = list(INDEX_ENTRY.iter_unpack(member[headerLen:headerLen + indexLen]))
+        self.offsets = [e[0] for e in entries]
+        self.compressedOffsets = [e[1] for e in entries] + [self.indexStart]
+        self.times = [e[2] for e in entries]
+
+    def block_at(self, offset: int) -> int:
+        return max(bisect_right(self.offsets, offset) - 1, 0)
+
+    def offset_at(self, t: float) -> int:
+        """
+        Raw offset of the block holding data from time t, so reading from
+        it can include up to one block from before t
+        """
+        known = [(blockTime, i) for i, blockTime in enumerate(self.times)
+                 if not math.isnan(blockTime)]
+        if not known:
+            raise ValueError('segment has no block times')
+        i = bisect_right([blockTime for blockTime, _ in known], t) - 1
+        return self.offsets[known[max(i, 0)][1]]
+
+    def blocks(self, offset: int = 0):
+        """ Decompressed data from offset to the end, one block at a time """
+        block = self.block_at(offset)
+        skip = offset - self.offsets[block] if self.offsets else 0
+        for i in range(block, len(self.offsets)):
+            self.file.seek(self.compressedOffsets[i])
+            data = self.file.read(self.compressedOffsets[i + 1] - self.compressedOffsets[i])
+            data = zlib.decompressobj(31).decompress(data)
+            if skip:
+                data = data[skip:]
+                skip = 0
+            yield data
+
+    def read(self, offset: int, size: int) -> bytes:
+        out = bytearray()
+        for data in self.blocks(offset):
+            out += data
+            if len(out) >= size:
+                break
+        return bytes(out[:size])
+
+    def close(self) -> None:
+        self.file.close()
+
+
+class SegmentCompressor(threading.Thread):
+    """
+    Compresses submitted files one at a time and replaces each with its
+    indexed gzip, never blocks the caller. The work is written to a
+    hidden temporary name first, so a segment is either the original or
+    the complete .gz, even if the process is killed part way.
+    """
+    def __init__(self, level: int = COMPRESS_LEVEL) -> None:
+        threading.Thread.__init__(self, name='SegmentCompressor', daemon=True)
+        self.logger = logging.getLogger()
+        self.level = level
+        self.queue = queue.Queue()
+        #statistics
+        self.statSegments = 0
+        self.statRawBytes = 0
+        self.statCompressedBytes = 0
+        self.statErrors = 0
+
+    def submit(self, path: str, close: Optional[Callable[[], None]] = None) -> None:
+        """ close, if given, is called on this thread before path is read """
+        self.queue.put((path, close))
+
+    def submit_pending(self, dirName: str, match) -> None:
+        """
+        Submits the files in dirName that match(name) accepts, to pick up
+        segments left over by an earlier run. Removes unfinished output.
+        """
+        try:
+            names = sorted(os.listdir(dirName))
+        except FileNotFoundError:
+            return
+        for name in names:
+            path = os.path.join(dirName, name)
+            if name.startswith('.') and name.endswith(SUFFIX + '.tmp'):
+                os.remove(path)
+            elif not name.endswith(SUFFIX) and match(name):
+                self.submit(path)
+
+    def attach(self, handler: logging.handlers.BaseRotatingHandler) -> None:
+        """ Compress the backups a rotating file handler rolls over """
+        def rotator(source: str, dest: str) -> None:
+            os.rename(source, dest)
+            self.submit(dest)
+        handler.rotator = rotator
+
+    def stop(self) -> None:
+        self.queue.put(None)
+
+    def run(self) -> None:
+        try:
+            # per thread on Linux, the comms and UI threads keep their priority
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), NICE)
+        except (AttributeError, OSError):
+            pass
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            path, close = item
+            if close is not None:
+                # e.g. the fsync of a rotated capture file, kept off the RX thread
+                close()
+            self.compress(path)
+
+    def compress(self, path: str) -> None:
+        dirName, name = os.path.split(path)
+        tmp = os.path.join(dirName, '.' + name + SUFFIX + '.tmp')
+        try:
+            rawSize, compressedSize = compress_segment(path, tmp, self.level)
+            os.rename(tmp, path + SUFFIX)
+            os.remove(path)
+            if os.path.exists(path + '.ts'):
+                # its stamps are in the segment now
+                os.remove(path + '.ts')
+        except OSError as e:
+            self.statErrors += 1
+            self.logger.warning('Compressing %s failed: %s', path, e)
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            return
+        self.statSegments += 1
+        self.statRawBytes += rawSize
+        self.statCompressedBytes += compressedSize
+        self.logger.info('Compressed %s %d -> %d bytes', path, rawSize, compressedSize)
+
+    def stats_summary(self) -> list:
+        return ['Segment compressor: segments:' + str(self.statSegments) + ' raw:' +
+                str(self.statRawBytes) + ' compressed:' + str(self.statCompressedBytes) +
+                ' errors:' + str(self.statErrors) + ' pending:' + str(self.queue.qsize())]
@@ -0,0 +1,231 @@
+# Copyright 2020 LifeMech  Inc
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+# associated documentation files (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge, publish, distribute,
+# sublicense, and/or sell copies of the Software, and to permit persons to whom the Software
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or
+# substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING
+# BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+
+
+"""
+Append-only binary record of every status and command packet, written
+in blocks instead of one formatted log line per packet. Each record is
+RECORD_LEN bytes: wall clock time, kind, payload length, sequence number
+and the raw payload, which decodes to the same fields the UI sees. The
+file starts with one header record. Use utils.tools.dump_session to
+turn a recording into JSON lines or a NumPy file.
+"""
+import json
+import logging
+import os
+import struct
+import time
+from datetime import datetime
+from threading import Lock
+
+import numpy as np
+
+from utils.in_packet import InPacket, STATUS_RAW_DTYPE, decode_status_array
+from utils.out_packet import COMMAND_STRUCT, COMMAND_FIELDS
+from utils.params import FIELDS
+
+RECORD_LEN = 64
+# time.time(), kind, payload length, sequence number
+RECORD_HEADER = struct.Struct('<dBBH')
+PAYLOAD_LEN = RECORD_LEN - RECORD_HEADER.size
+KIND_STATUS = 1
+KIND_COMMAND = 2
+
+FILE_MAGIC = b'OVVEREC\x01'
+# magic, record length, start time
+FILE_HEADER = struct.Struct('<8sHd')
+
+RECORD_DTYPE = np.dtype([('time', '<f8'), ('kind', 'u1'), ('length', 'u1'),
+                         ('seq_num', '<u2'), ('payload', 'V%d' % PAYLOAD_LEN)])
+STATUS_DTYPE = np.dtype([('time', 'f8')] + [(name, 'f8') for name in FIELDS])
+
+# 16 KiB, written when full or FLUSH_INTERVAL after the first record in it,
+# checked on each record and from poll()
+BLOCK_RECORDS = 256
+FLUSH_INTERVAL = 5.0
+MAX_FILE_SIZE = 64 * 1024 * 1024
+# failed writes are logged at most this often
+ERROR_LOG_INTERVAL = 10.0
+
+
+def is_session_file(name: str) -> bool:
+    return name.endswith('] session.rec')
+
+
+class SessionRecorder():
+    """
+    Called from the RX and TX threads, records are appended under a lock.
+    With an executor (a concurrent.futures one with a single worker) full
+    blocks are written on it instead of by the caller.
+    """
+    def __init__(self, log_dir: str = '/home/pi/logs') -> None:
+        self.dirName = log_dir
+        if not os.path.exists(self.dirName):
+            os.makedirs(self.dirName)
+        self.lock = Lock()
+        self.block = bytearray(BLOCK_RECORDS * RECORD_LEN)
+        self._blockView = memoryview(self.block)
+        self.count = 0
+        self._flushDue = 0.0
+        self.file = None
+        self.executor = None
+        self.open_file()
+        self._nextErrorLog = 0.0
+        #statistics
+        self.statRecords = 0
+        self.statBlocks = 0
+        self.statDropped = 0
+
+    def open_file(self) -> None:
+        dateStr = datetime.now().isoformat(timespec='seconds')
+        self.path = str(self.dirName) + "/[" + dateStr + "] session.rec"
+        self.file = open(self.path, "ab", buffering=0)
+        self.fileSize = self.file.tell()
+        if self.fileSize == 0:
+            header = bytearray(RECORD_LEN)
+            FILE_HEADER.pack_into(header, 0, FILE_MAGIC, RECORD_LEN, time.time())
+            self.file.write(header)
+            self.fileSize = RECORD_LEN
+
+    def record_status(self, sequenceNo: int, payload) -> None:
+        """ payload is the status payload, a memoryview is copied """
+        length = min(len(payload), PAYLOAD_LEN)
+        with self.lock:
+            offset = self.count * RECORD_LEN
+            RECORD_HEADER.pack_into(self.block, offset, time.time(), KIND_STATUS, length, sequenceNo)
+            start = offset + RECORD_HEADER.size
+            self.block[start:start + length] = payload[:length]
+            self.block[start + length:offset + RECORD_LEN] = bytes(PAYLOAD_LEN - length)
+            self._commit()
+
+    def record_command(self, sequenceNo: int, values: tuple) -> None:
+        """ values as returned by CommsProtocol.build_command() """
+        with self.lock:
+            offset = self.count * RECORD_LEN
+            RECORD_HEADER.pack_into(self.block, offset, time.time(), KIND_COMMAND,
+                                    COMMAND_STRUCT.size, sequenceNo)
+            start = offset + RECORD_HEADER.size
+            COMMAND_STRUCT.pack_into(self.block, start, *values)
+            self.block[start + COMMAND_STRUCT.size:offset + RECORD_LEN] = \
+                bytes(PAYLOAD_LEN - COMMAND_STRUCT.size)
+            self._commit()
+
+    def _commit(self) -> None:
+        self.count += 1
+        self.statRecords += 1
+        now = time.monotonic()
+        if self.count == 1:
+            self._flushDue = now + FLUSH_INTERVAL
+        if self.count == BLOCK_RECORDS or now >= self._flushDue:
+            self._flush()
+
+    def _flush(self) -> None:
+        if self.count == 0:
+            return
+        size = self.count * RECORD_LEN
+        count = self.count
+        self.count = 0
+        if self.executor is not None:
+            # a copy, the block is refilled while it is written
+            self.executor.submit(self._write, bytes(self._blockView[:size]), count)
+        else:
+            self._write(self._blockView[:size], count)
+
+    def _write(self, data, count: int) -> None:
+        try:
+            self.file.write(data)
+        except OSError as e:
+            # e.g. a full card, the block is dropped rather than stopping comms
+            self.statDropped += count
+            now = time.monotonic()
+            if now >= self._nextErrorLog:
+                self._nextErrorLog = now + ERROR_LOG_INTERVAL
+                logging.getLogger().warning('Session recording to %s failed, %d records dropped: %s',
+                                            self.path, self.statDropped, e)
+            return
+        self.fileSize += len(data)
+        self.statBlocks += 1
+        if self.fileSize >= MAX_FILE_SIZE:
+            self.file.close()
+            self.open_file()
+
+    def poll(self, now: float) -> None:
+        """ Writes a block that is due even when no record comes in, now is time.monotonic() """
+        # unlocked peek, a record arriving meanwhile does its own check
+        if self.count == 0 or now < self._flushDue:
+            return
+        with self.lock:
+            if self.count and now >= self._flushDue:
+                self._flush()
+
+    def flush(self) -> None:
+        with self.lock:
+            self._flush()
+
+    def close(self) -> None:
+        with self.lock:
+            self._flush()
+            self.file.close()
+
+    def stats_summary(self) -> list:
+        return ['Session recorder: records:' + str(self.statRecords) +
+                ' blocks:' + str(self.statBlocks) + ' dropped:' + str(self.statDropped)]
+
+
+def read_records(path: str) -> np.ndarray:
+    """ All complete records of a recording as a RECORD_DTYPE array """
+    with open(path, 'rb') as f:
+        data = f.read()
+    if len(data) < FILE_HEADER.size:
+        raise ValueError(path + ' is not a session recording')
+    magic, recordLen, startTime = FILE_HEADER.unpack_from(data, 0)
+    if magic != FILE_MAGIC or recordLen != RECORD_LEN:
+        raise ValueError(path + ' is not a session recording')
+    # a recorder that was killed may have left part of a record
+    count = (len(data) - RECORD_LEN) // RECORD_LEN
+    return np.frombuffer(data, RECORD_DTYPE, count, RECORD_LEN)
+
+
+def decode_status(records: np.ndarray) -> np.ndarray:
+    """ Status records decoded to the Params fields, as a STATUS_DTYPE array """
+    status = records[records['kind'] == KIND_STATUS]
+    out = np.zeros(len(status), STATUS_DTYPE)
+    payloads = np.ascontiguousarray(status['payload']).view(np.uint8).reshape(-1, PAYLOAD_LEN)
+    raw = np.ascontiguousarray(payloads[:, :STATUS_RAW_DTYPE.itemsize]).view(STATUS_RAW_DTYPE)
+    out['time'] = status['time']
+    decode_status_array(raw.reshape(-1), status['seq_num'], out)
+    return out
+
+
+def to_json_lines(records: np.ndarray):
+    """ One JSON object per record, in the style of the old packet log """
+    inPkt = InPacket()
+    for record in records:
+        payload = record['payload'].tobytes()[:record['length']]
+        item = {'time': float(record['time']), 'seq_num': int(record['seq_num'])}
+        if record['kind'] == KIND_STATUS:
+            inPkt.from_bytes(payload)
+            item['type'] = 'inpkt'
+            item.update(inPkt.to_params(item['seq_num']).to_dict())
+        elif record['kind'] == KIND_COMMAND:
+            item['type'] = 'outpkt'
+            item.update(zip(COMMAND_FIELDS, COMMAND_STRUCT.unpack(payload)))
+        else:
+            item['type'] = 'unknown'
+        item['bytes'] = payload.hex()
+        yield json.dumps(item)
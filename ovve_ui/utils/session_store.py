@@ -0,0 +1,369 @@
+# Copyright 2020 LifeMech  Inc
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+# associated documentation files (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge, publish, distribute,
+# sublicense, and/or sell copies of the Software, and to permit persons to whom the Software
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or
+# substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING
+# BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+
+
+"""
+Per-patient history in an SQLite database (WAL mode): one row per
+patient session, every settings change, every change of the alarm bits
+and one row of parameter aggregates per second.
+
+The UI thread only queues what happened. The store thread writes it in
+one transaction per BATCH_INTERVAL and takes the waveform samples from
+its own SampleRing reader when the comms engine has one, otherwise from
+the queued params. Reads (the settings page history) use a second
+connection, WAL lets them run while a batch is being written.
+
+sqlite3 is left out of some Python builds, the store is then not
+available and the UI runs without history.
+"""
+import logging
+import math
+import os
+import queue
+import threading
+import time
+
+import numpy as np
+
+try:
+    import sqlite3
+except ImportError:
+    sqlite3 = None
+
+from utils.segment_compressor import NICE
+from utils.waveform_batch import WAVEFORM_DTYPE
+
+# not under /home/pi/logs, retention deletes the oldest files there
+DEFAULT_PATH = '/home/pi/history/sessions.db'
+BATCH_INTERVAL = 1.0
+# aggregates older than this are deleted when the store starts
+KEEP_DAYS = 30
+# failed batches are logged at most this often
+ERROR_LOG_INTERVAL = 10.0
+# breath values carried into each second's row
+MEASURED = ('ppeak', 'peep', 'pplat', 'tv_meas', 'resp_rate_meas', 'ie_ratio_meas')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id INTEGER PRIMARY KEY,
+    patient_id TEXT NOT NULL,
+    patient_number INTEGER,
+    started REAL NOT NULL,
+    ended REAL
+);
+CREATE INDEX IF NOT EXISTS sessions_patient ON sessions (patient_id);
+CREATE TABLE IF NOT EXISTS settings_changes (
+    session_id INTEGER NOT NULL REFERENCES sessions (id),
+    time REAL NOT NULL,
+    run_state INTEGER,
+    mode INTEGER,
+    resp_rate INTEGER,
+    tv INTEGER,
+    ie_ratio_enum INTEGER,
+    settings TEXT
+);
+CREATE INDEX IF NOT EXISTS settings_changes_time ON settings_changes (session_id, time);
+CREATE TABLE IF NOT EXISTS alarm_events (
+    session_id INTEGER NOT NULL REFERENCES sessions (id),
+    time REAL NOT NULL,
+    alarm_bits INTEGER NOT NULL,
+    raised INTEGER NOT NULL,
+    cleared INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS alarm_events_time ON alarm_events (session_id, time);
+CREATE TABLE IF NOT EXISTS param_seconds (
+    session_id INTEGER NOT NULL REFERENCES sessions (id),
+    time INTEGER NOT NULL,
+    samples INTEGER NOT NULL,
+    pressure_min REAL, pressure_mean REAL, pressure_max REAL,
+    flow_min REAL, flow_mean REAL, flow_max REAL,
+    volume_max REAL,
+    run_state INTEGER,
+    alarm_bits INTEGER,
+    ppeak REAL, peep REAL, pplat REAL, tv_meas REAL, resp_rate_meas REAL, ie_ratio_meas REAL,
+    PRIMARY KEY (session_id, time)
+) WITHOUT ROWID;
+"""
+
+INSERT_SECOND = ('INSERT OR REPLACE INTO param_seconds VALUES (' +
+                 ', '.join('?' * 18) + ')')
+
+# the session of a patient_id, the newest if the id was ever reused
+SESSION_OF = '(SELECT max(id) FROM sessions WHERE patient_id = ?)'
+
+
+def connect(path: str) -> 'sqlite3.Connection':
+    db = sqlite3.connect(path)
+    db.execute('PRAGMA journal_mode=WAL')
+    # in WAL mode a commit is not synced, a power cut loses at most the
+    # last batches but never corrupts the database
+    db.execute('PRAGMA synchronous=NORMAL')
+    return db
+
+
+class SessionStore(threading.Thread):
+    """
+    The record_* and *_session methods are called from the UI thread and
+    only queue. The history queries open their own connection on the
+    thread that first calls one.
+    """
+    def __init__(self, path: str = DEFAULT_PATH, samples=None,
+                 interval: float = BATCH_INTERVAL) -> None:
+        threading.Thread.__init__(self, name='SessionStore', daemon=True)
+        if sqlite3 is None:
+            raise RuntimeError('sqlite3 is not available')
+        self.logger = logging.getLogger()
+        self.path = path
+        self.interval = interval
+        self.queue = queue.Queue()
+        # a reader taken now sees every sample from here on
+        self.reader = samples.reader('history') if samples is not None else None
+        dirName = os.path.dirname(path)
+        if dirName and not os.path.exists(dirName):
+            os.makedirs(dirName)
+        # the schema exists before any history query
+        try:
+            db = connect(path)
+            with db:
+                db.executescript(SCHEMA)
+            db.close()
+        except sqlite3.Error as e:
+            raise RuntimeError(path + ': ' + str(e))
+        self.db = None
+        self.readDb = None
+        # store thread state
+        self.session = None
+        self.alarmBits = 0
+        self.measured = (math.nan,) * len(MEASURED)
+        self.rows = []
+        self.pending = np.zeros(0, WAVEFORM_DTYPE)
+        self._nextErrorLog = 0.0
+        #statistics
+        self.statBatches = 0
+        self.statSeconds = 0
+        self.statEvents = 0
+        self.statErrors = 0
+
+    def start_session(self, patient_id, patient_number: int) -> None:
+        self.queue.put(('start', time.time(), (str(patient_id), patient_number)))
+
+    def record_settings(self, settings) -> None:
+        self.queue.put(('settings', time.time(),
+                        (settings.run_state, settings.mode, settings.resp_rate, settings.tv,
+                         settings.ie_ratio_enum, settings.to_JSON())))
+
+    def record_alarms(self, alarmbits: int) -> None:
+        self.queue.put(('alarms', time.time(), alarmbits))
+
+    def record_params(self, params) -> None:
+        """ Every status packet the UI gets, or only the changes with a sample ring """
+        self.queue.put(('params', time.time(), params))
+
+    def stop(self, timeout: float = 2.0) -> None:
+        """ Writes what is queued and ends the session """
+        self.queue.put(None)
+        self.join(timeout)
+
+    def run(self) -> None:
+        try:
+            # per thread on Linux, the comms and UI threads keep their priority
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), NICE)
+        except (AttributeError, OSError):
+            pass
+        self.db = connect(self.path)
+        self.prune(time.time() - KEEP_DAYS * 86400)
+        done = False
+        while not done:
+            items = []
+            deadline = time.monotonic() + self.interval
+            while True:
+                try:
+                    item = self.queue.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                if item is None:
+                    done = True
+                    break
+                items.append(item)
+            self.write_batch(items, done)
+        self.db.close()
+
+    def write_batch(self, items: list, final: bool = False) -> None:
+        try:
+            with self.db:
+                for kind, t, data in items:
+                    if kind == 'params':
+                        self.add_params(t, data)
+                    elif kind == 'alarms':
+                        self.add_alarms(t, data)
+                    elif kind == 'settings':
+                        self.add_settings(t, data)
+                    else:
+                        self.add_session(t, data)
+                self.aggregate(math.inf if final else None)
+                if final:
+                    self.end_session(time.time())
+        except sqlite3.Error as e:
+            # e.g. a full card, the batch is lost but recording goes on
+            self.statErrors += 1
+            now = time.monotonic()
+            if now >= self._nextErrorLog:
+                self._nextErrorLog = now + ERROR_LOG_INTERVAL
+                self.logger.warning('Session store write to %s failed: %s', self.path, e)
+            return
+        self.statBatches += 1
+
+    def add_session(self, t: float, data: tuple) -> None:
+        # samples from before the change belong to the previous patient
+        self.aggregate(t)
+        self.end_session(t)
+        patientId, patientNumber = data
+        cursor = self.db.execute(
+            'INSERT INTO sessions (patient_id, patient_number, started) VALUES (?, ?, ?)',
+            (patientId, patientNumber, t))
+        self.session = cursor.lastrowid
+        # same ventilator: with a sample ring record_params only follows
+        # changes, so the measured values carry over, and alarms still
+        # raised are the new session's first event
+        active = self.alarmBits
+        self.alarmBits = 0
+        self.add_alarms(t, active)
+
+    def end_session(self, t: float) -> None:
+        if self.session is not None:
+            self.db.execute('UPDATE sessions SET ended = ? WHERE id = ?', (t, self.session))
+
+    def add_settings(self, t: float, data: tuple) -> None:
+        if self.session is None:
+            return
+        self.db.execute('INSERT INTO settings_changes VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                        (self.session, t) + data)
+        self.statEvents += 1
+
+    def add_alarms(self, t: float, alarmbits: int) -> None:
+        if self.session is None or alarmbits == self.alarmBits:
+            return
+        self.db.execute('INSERT INTO alarm_events VALUES (?, ?, ?, ?, ?)',
+                        (self.session, t, alarmbits, alarmbits & ~self.alarmBits,
+                         self.alarmBits & ~alarmbits))
+        self.alarmBits = alarmbits
+        self.statEvents += 1
+
+    def add_params(self, t: float, params) -> None:
+        if self.reader is None:
+            self.rows.append((t, params.seq_num, params.pressure, params.flow, params.tv_meas,
+                              params.control_state, params.run_state, params.alarm_bits))
+        # the values as of the last sample queued, close enough for a second
+        self.measured = tuple(getattr(params, name) for name in MEASURED)
+
+    def aggregate(self, until: float = None) -> None:
+        """
+        Writes a row for every second of samples from before until. Without
+        until the samples of the last second wait for the next batch.
+        """
+        if self.reader is not None:
+            rows = self.reader.read()
+        else:
+            rows = np.array(self.rows, WAVEFORM_DTYPE)
+            self.rows = []
+        if len(self.pending):
+            rows = np.concatenate((self.pending, rows))
+        if not len(rows):
+            return
+        seconds = np.floor(rows['time']).astype(np.int64)
+        if until is None:
+            end = int(np.searchsorted(seconds, seconds[-1]))
+        else:
+            end = int(np.searchsorted(rows['time'], until))
+        self.pending = rows[end:]
+        rows = rows[:end]
+        seconds = seconds[:end]
+        if self.session is None or not end:
+            return
+        starts = np.concatenate(([0], np.flatnonzero(np.diff(seconds)) + 1))
+        counts = np.diff(np.append(starts, len(rows)))
+        pressure = rows['pressure']
+        flow = rows['flow']
+        out = zip(seconds[starts].tolist(), counts.tolist(),
+                  np.minimum.reduceat(pressure, starts).tolist(),
+                  (np.add.reduceat(pressure, starts, dtype=np.float64) / counts).tolist(),
+                  np.maximum.reduceat(pressure, starts).tolist(),
+                  np.minimum.reduceat(flow, starts).tolist(),
+                  (np.add.reduceat(flow, starts, dtype=np.float64) / counts).tolist(),
+                  np.maximum.reduceat(flow, starts).tolist(),
+                  np.maximum.reduceat(rows['volume'], starts).tolist(),
+                  np.maximum.reduceat(rows['run_state'], starts).tolist(),
+                  np.bitwise_or.reduceat(rows['alarm_bits'], starts).tolist())
+        self.db.executemany(INSERT_SECOND, [(self.session,) + row + self.measured for row in out])
+        self.statSeconds += len(starts)
+
+    def prune(self, before: float) -> None:
+        try:
+            with self.db:
+                self.db.execute('DELETE FROM param_seconds WHERE time < ?', (int(before),))
+        except sqlite3.Error as e:
+            self.logger.warning('Session store prune failed: %s', e)
+
+    def query(self, sql: str, args: tuple = ()) -> list:
+        if self.readDb is None:
+            self.readDb = sqlite3.connect(self.path)
+        try:
+            return self.readDb.execute(sql, args).fetchall()
+        except sqlite3.Error as e:
+            self.logger.warning('Session store query failed: %s', e)
+            return []
+
+    def session_info(self, patient_id) -> tuple:
+        """ (started, ended, settings changes, alarm events), None if not stored yet """
+        rows = self.query(
+            'SELECT started, ended, '
+            '(SELECT count(*) FROM settings_changes WHERE session_id = s.id), '
+            '(SELECT count(*) FROM alarm_events WHERE session_id = s.id AND raised != 0) '
+            'FROM sessions s WHERE id = ' + SESSION_OF, (str(patient_id),))
+        return rows[0] if rows else None
+
+    def settings_history(self, patient_id, limit: int = 5) -> list:
+        """ Newest first: (time, run_state, mode, resp_rate, tv, ie_ratio_enum) """
+        return self.query(
+            'SELECT time, run_state, mode, resp_rate, tv, ie_ratio_enum FROM settings_changes '
+            'WHERE session_id = ' + SESSION_OF + ' ORDER BY time DESC LIMIT ?',
+            (str(patient_id), limit))
+
+    def alarm_history(self, patient_id, limit: int = 5) -> list:
+        """ Newest first: (time, alarm_bits, raised, cleared) """
+        return self.query(
+            'SELECT time, alarm_bits, raised, cleared FROM alarm_events '
+            'WHERE session_id = ' + SESSION_OF + ' ORDER BY time DESC LIMIT ?',
+            (str(patient_id), limit))
+
+    def trend(self, patient_id, since: float, step: int = 1) -> np.ndarray:
+        """
+        Averages over step seconds from since on, columns time, ppeak,
+        peep, tv_meas, resp_rate_meas, pressure_max
+        """
+        rows = self.query(
+            'SELECT time / ? * ?, avg(ppeak), avg(peep), avg(tv_meas), avg(resp_rate_meas), '
+            'max(pressure_max) FROM param_seconds WHERE session_id = ' + SESSION_OF +
+            ' AND time >= ? GROUP BY time / ? ORDER BY time / ?',
+            (step, step, str(patient_id), int(since), step, step))
+        return np.array(rows, np.float64).reshape(-1, 6)
+
+    def stats_summary(self) -> list:
+        return ['Session store: batches:' + str(self.statBatches) + ' seconds:' +
+                str(self.statSeconds) + ' events:' + str(self.statEvents) + ' errors:' +
+                str(self.statErrors) + ' pending:' + str(self.queue.qsize())]
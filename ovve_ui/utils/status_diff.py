@@ -0,0 +1,80 @@
+# Copyright 2020 LifeMech  Inc
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+# associated documentation files (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge, publish, distribute,
+# sublicense, and/or sell copies of the Software, and to permit persons to whom the Software
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or
+# substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING
+# BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+
+
+"""
+Slow channel of the status stream. The waveform fields change every
+packet and reach the UI once per display tick; settings echoes, limits,
+breath measurements, states and battery rarely change, so they are
+compared with the previous packet and sent on only when one differs.
+"""
+from operator import attrgetter
+from typing import Callable
+
+from utils.params import Params, FIELDS
+
+# change every packet, the graphed ones are also in the waveform ring
+FAST_FIELDS = ("seq_num", "pressure", "flow", "tv_meas", "tv_insp", "tv_exp", "tv_rate")
+SLOW_FIELDS = tuple(f for f in FIELDS if f not in FAST_FIELDS)
+
+_get_slow = attrgetter(*SLOW_FIELDS)
+
+
+class StatusChange():
+    """
+    params is the packet with the change, changed maps each slow field
+    that differs from the previous packet to its new value.
+    """
+    __slots__ = ('params', 'changed')
+
+    def __init__(self, params: Params, changed: dict) -> None:
+        self.params = params
+        self.changed = changed
+
+
+class StatusDiff():
+    def __init__(self, change_handler: Callable[[StatusChange], None]) -> None:
+        self.change_handler = change_handler
+        self._last = None
+        #statistics
+        self.statChanges = 0
+        self.statUnchanged = 0
+
+    def reset(self) -> None:
+        """ The next packet reports every slow field """
+        self._last = None
+
+    def add(self, params: Params) -> None:
+        """ CommsProtocol params_handler """
+        values = _get_slow(params)
+        last = self._last
+        if values == last:
+            self.statUnchanged += 1
+            return
+        if last is None:
+            changed = dict(zip(SLOW_FIELDS, values))
+        else:
+            changed = {name: value for name, value, old in zip(SLOW_FIELDS, values, last)
+                       if value != old}
+        self._last = values
+        self.statChanges += 1
+        self.change_handler(StatusChange(params, changed))
+
+    def stats_summary(self) -> list:
+        return ['Status changes: ' + str(self.statChanges) +
+                ' unchanged: ' + str(self.statUnchanged)]
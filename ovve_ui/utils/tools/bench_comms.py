@@ -0,0 +1,271 @@
+# Copyright 2020 LifeMech  Inc
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+# associated documentation files (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge, publish, distribute,
+# sublicense, and/or sell copies of the Software, and to permit persons to whom the Software
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or
+# substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING
+# BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+
+
+"""
+Throughput and robustness benchmark for the comms receive path. Generates
+synthetic v4 status streams, optionally with corrupted frames, and runs
+them through CommsProtocol (decode, Params, reply framing) without Qt or
+pyserial. Results can be saved as JSON and compared against a baseline.
+
+Run from the ovve_ui directory:
+    python -m utils.tools.bench_comms [-n FRAMES] [-s clean,bad_crc,...]
+        [--json results.json] [--baseline old.json]
+"""
+import argparse
+import json
+import platform
+import random
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+from utils.comms_protocol import CommsProtocol
+from utils.frame_decoder import SYNC, HEADER_LEN, build_frame
+from utils.transports import Transport
+from utils.tools.pty_ecu import status_payload
+
+# Every kind of corruption the generator can inject. double_sync frames
+# (S1 S1 S2 S3) and seq_gap frames are valid and must still be decoded.
+ERRORS = ('bad_crc', 'double_sync', 'broken_sync', 'bad_len', 'truncated', 'seq_gap')
+SCENARIOS = ('clean',) + ERRORS + ('mixed',)
+
+
+class NullTransport(Transport):
+    """ Discards replies so the benchmark measures the engine alone """
+    def open(self) -> bool:
+        self.is_open = True
+        return True
+
+    def write(self, data) -> int:
+        return len(data)
+
+
+class StreamGenerator():
+    """
+    Builds a status frame stream where every error_every-th frame carries
+    one of the given errors. Records where each good frame starts and where
+    each error was injected so decoder results can be checked.
+    """
+    def __init__(self, frames: int, errors: tuple, error_every: int, seed: int = 0) -> None:
+        self.rnd = random.Random(seed)
+        self.parts = []
+        self.good = {}        # sequence number -> byte offset of the frame
+        self.injected = []    # (byte offset, error)
+        self.seqGaps = 0
+        offset = 0
+        sequenceNo = 0
+        for i in range(frames):
+            frame = build_frame(sequenceNo, 0x01, status_payload(sequenceNo, i * 0.01))
+            error = None
+            if errors and i % error_every == error_every - 1:
+                error = self.rnd.choice(errors)
+                frame = self.corrupt(frame, error)
+            if error is not None:
+                self.injected.append((offset, error))
+            if error in (None, 'double_sync', 'seq_gap'):
+                self.good[sequenceNo] = offset
+            if error == 'seq_gap':
+                self.seqGaps += 1
+            self.parts.append(frame)
+            offset += len(frame)
+            sequenceNo = (sequenceNo + 1) & 0xFFFF
+            if error == 'seq_gap':
+                # the frame after this one arrives with a skipped number
+                sequenceNo = (sequenceNo + 1) & 0xFFFF
+        self.stream = b''.join(self.parts)
+
+    def corrupt(self, frame: bytes, error: str) -> bytes:
+        frame = bytearray(frame)
+        if error == 'bad_crc':
+            frame[-1] ^= 0xFF
+        elif error == 'double_sync':
+            frame[0:0] = SYNC[:1]
+        elif error == 'broken_sync':
+            frame[1] = 0x00
+        elif error == 'bad_len':
+            frame[HEADER_LEN - 1] = 0xC8
+        elif error == 'truncated':
+            del frame[self.rnd.randrange(len(SYNC) + 1, len(frame) - 1):]
+        return bytes(frame)
+
+
+def feed_chunks(stream: bytes, chunk_size: int) -> list:
+    return [stream[i:i + chunk_size] for i in range(0, len(stream), chunk_size)]
+
+
+def make_protocol(decoded: list) -> CommsProtocol:
+    protocol = CommsProtocol(NullTransport(), params_handler=lambda params: None)
+    protocol.transport.open()
+    processPacket = protocol.decoder.packet_handler
+
+    def record(payload, packetType: int, sequenceNo: int) -> None:
+        decoded.append(sequenceNo)
+        processPacket(payload, packetType, sequenceNo)
+    protocol.decoder.packet_handler = record
+    return protocol
+
+
+def resync_stats(gen: StreamGenerator, decoded: list) -> dict:
+    """ Good frames lost and bytes skipped after each injected error """
+    decodedSet = set(decoded)
+    goodOffsets = sorted((offset, seq) for seq, offset in gen.good.items())
+    lostFrames = []
+    lostBytes = []
+    pos = 0
+    for errorOffset, error in gen.injected:
+        if error in ('double_sync', 'seq_gap'):
+            continue
+        while pos < len(goodOffsets) and goodOffsets[pos][0] <= errorOffset:
+            pos += 1
+        lost = 0
+        nextOffset = len(gen.stream)
+        for offset, seq in goodOffsets[pos:]:
+            if seq in decodedSet:
+                nextOffset = offset
+                break
+            lost += 1
+        lostFrames.append(lost)
+        lostBytes.append(nextOffset - errorOffset)
+    if not lostFrames:
+        return {'errors': 0, 'resync_lost_frames_max': 0, 'resync_lost_frames_mean': 0.0,
+                'resync_bytes_max': 0, 'resync_bytes_mean': 0.0}
+    return {'errors': len(lostFrames),
+            'resync_lost_frames_max': max(lostFrames),
+            'resync_lost_frames_mean': sum(lostFrames) / len(lostFrames),
+            'resync_bytes_max': max(lostBytes),
+            'resync_bytes_mean': sum(lostBytes) / len(lostBytes)}
+
+
+def run_scenario(name: str, frames: int, chunk_size: int, error_every: int, repeat: int) -> dict:
+    errors = () if name == 'clean' else ERRORS if name == 'mixed' else (name,)
+    gen = StreamGenerator(frames, errors, error_every)
+    chunks = feed_chunks(gen.stream, chunk_size)
+
+    best = None
+    for _ in range(repeat):
+        decoded = []
+        protocol = make_protocol(decoded)
+        wallStart = time.perf_counter()
+        cpuStart = time.process_time()
+        for chunk in chunks:
+            protocol.feed(chunk)
+        cpu = time.process_time() - cpuStart
+        wall = time.perf_counter() - wallStart
+        if best is None or wall < best[0]:
+            best = (wall, cpu, decoded, protocol)
+    wall, cpu, decoded, protocol = best
+
+    # Separate pass, tracing slows everything down. Release builds of
+    # CPython keep no allocation counter, so this reports the most memory
+    # any single read allocated on top of what was live before it.
+    tracemalloc.start()
+    traced = make_protocol([])
+    peak = 0
+    for chunk in chunks:
+        current = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        traced.feed(chunk)
+        peak = max(peak, tracemalloc.get_traced_memory()[1] - current)
+    tracemalloc.stop()
+
+    decoder = protocol.decoder
+    result = {
+        'frames_sent': frames,
+        'frames_expected': len(gen.good),
+        'frames_decoded': len(decoded),
+        'bytes': len(gen.stream),
+        'frames_per_sec': len(decoded) / wall,
+        'us_per_frame': cpu / max(1, len(decoded)) * 1e6,
+        'mbytes_per_sec': len(gen.stream) / wall / 1e6,
+        'peak_alloc_bytes_per_read': peak,
+        'peak_alloc_bytes_per_frame': peak * len(chunks) / max(1, len(decoded)),
+        'crc_fail': decoder.statPacketRxCntCrcFail,
+        'header_fail': decoder.statPacketRxCntHeaderFail,
+        'len_fail': decoder.statPacketRxCntLenFail,
+        'seq_error': protocol.statSeqError,
+        'seq_gaps_injected': gen.seqGaps,
+        'replies': protocol.statPacketTxCntOk,
+    }
+    result.update(resync_stats(gen, decoded))
+    return result
+
+
+def compare(results: dict, baseline: dict) -> None:
+    print('\nChange against baseline from ' + baseline.get('timestamp', '?'))
+    for name, result in results['scenarios'].items():
+        old = baseline.get('scenarios', {}).get(name)
+        if old is None:
+            continue
+        print('%-12s frames/s %+6.1f%%  us/frame %+6.1f%%  lost frames %d -> %d' %
+              (name,
+               (result['frames_per_sec'] / old['frames_per_sec'] - 1) * 100,
+               (result['us_per_frame'] / old['us_per_frame'] - 1) * 100,
+               old['frames_expected'] - old['frames_decoded'],
+               result['frames_expected'] - result['frames_decoded']))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Benchmark the comms receive path')
+    parser.add_argument('-n', '--frames', type=int, default=20000,
+                        help='Status frames per scenario')
+    parser.add_argument('-s', '--scenarios', default=','.join(SCENARIOS),
+                        help='Comma separated list from: ' + ', '.join(SCENARIOS))
+    parser.add_argument('-c', '--chunk', type=int, default=512,
+                        help='Bytes per read')
+    parser.add_argument('-e', '--error_every', type=int, default=50,
+                        help='Corrupt one frame in this many')
+    parser.add_argument('-r', '--repeat', type=int, default=3,
+                        help='Timing runs per scenario, the fastest is reported')
+    parser.add_argument('--json', help='Write results to this file')
+    parser.add_argument('--baseline', help='Compare against results saved with --json')
+    args = parser.parse_args()
+
+    results = {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'args': vars(args),
+        'scenarios': {},
+    }
+    # lost counts good frames that were not decoded, a frame dropped on a
+    # CRC failure was corrupted on purpose and shows up under crc instead
+    print('%-12s %10s %9s %9s %8s %8s %8s %10s' %
+          ('scenario', 'frames/s', 'us/frame', 'decoded', 'lost', 'crc', 'resync', 'B/frame'))
+    for name in args.scenarios.split(','):
+        if name not in SCENARIOS:
+            parser.error('unknown scenario ' + name)
+        result = run_scenario(name, args.frames, args.chunk, args.error_every, args.repeat)
+        results['scenarios'][name] = result
+        print('%-12s %10.0f %9.2f %9d %8d %8d %8d %10.0f' %
+              (name, result['frames_per_sec'], result['us_per_frame'], result['frames_decoded'],
+               result['frames_expected'] - result['frames_decoded'], result['crc_fail'],
+               result['resync_lost_frames_max'], result['peak_alloc_bytes_per_frame']))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
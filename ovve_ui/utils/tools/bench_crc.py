@@ -0,0 +1,89 @@
+# Copyright 2020 LifeMech  Inc
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+# associated documentation files (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge, publish, distribute,
+# sublicense, and/or sell copies of the Software, and to permit persons to whom the Software
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or
+# substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING
+# BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+
+
+"""
+Microbenchmarks for the CRC-16/XMODEM options on a 48 byte status payload
+and a 4 KiB block. Use the results to tune crc.EXTENSION_MIN_LEN.
+
+Run from the ovve_ui directory:
+    python -m utils.tools.bench_crc [-r REPEAT]
+"""
+import argparse
+import os
+import timeit
+
+from utils import crc
+from utils.crc import CRC
+
+
+def per_byte(data: bytes) -> int:
+    # what CommsLink.handleRxByte and sendPkts used to do
+    value = crc.CRC_INIT
+    for byte in data:
+        value = crc.compute(byte.to_bytes(1, 'little'), value)
+    return value
+
+
+def streaming(data: bytes) -> int:
+    engine = CRC()
+    view = memoryview(data)
+    for i in range(0, len(data), 16):
+        engine.update(view[i:i + 16])
+    return engine.value
+
+
+def options() -> dict:
+    legacy = CRC()
+    opts = {
+        'table': crc.update_table,
+        'compute(bytes)': crc.compute,
+        'compute(memoryview)': lambda data: crc.compute(memoryview(data)),
+        'streaming update(16B)': streaming,
+        'per-byte calls': per_byte,
+        'hexlify (crccitt)': lambda data: int(legacy.crccitt(data.hex()), 16),
+    }
+    if crc._extension is not None:
+        opts['crc16 extension'] = lambda data: crc._extension(data, crc.CRC_INIT)
+    return opts
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Benchmark CRC-16/XMODEM implementations')
+    parser.add_argument('-r', '--repeat', type=int, default=5,
+                        help='Number of timing runs, the best one is reported')
+    args = parser.parse_args()
+
+    if crc._extension is None:
+        print('crc16 extension not usable, comparing pure Python options only')
+
+    for size in (48, 4096):
+        data = os.urandom(size)
+        expected = crc.update_table(data)
+        number = max(1, 200000 // size)
+        print('\n%d byte input, %d calls per run' % (size, number))
+        for name, func in options().items():
+            if func(data) != expected:
+                raise RuntimeError(name + ' returned a wrong CRC')
+            best = min(timeit.repeat(lambda: func(data), number=number, repeat=args.repeat))
+            print('  %-24s %10.2f us/call %8.1f MB/s' %
+                  (name, best / number * 1e6, size * number / best / 1e6))
+
+
+if __name__ == '__main__':
+    main()
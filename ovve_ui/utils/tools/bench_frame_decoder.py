@@ -0,0 +1,198 @@
+# Copyright 2020 LifeMech  Inc
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+# associated documentation files (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge, publish, distribute,
+# sublicense, and/or sell copies of the Software, and to permit persons to whom the Software
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or
+# substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING
+# BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+
+
+"""
+Compares the buffer scanning FrameDecoder against the per-byte receive
+state machine that CommsLink used before.
+
+Before timing, checks that FrameDecoder gives the same result however a
+stream is split into reads.
+
+Run from the ovve_ui directory:
+    python -m utils.tools.bench_frame_decoder [-n FRAMES] [-c CHUNK]
+"""
+import argparse
+import random
+import time
+
+from utils import crc
+from utils.frame_decoder import FrameDecoder, build_frame
+
+STATUS_PAYLOAD_LEN = 48
+
+
+def make_stream(frames: int) -> bytes:
+    rnd = random.Random(0)
+    return b''.join(build_frame(i & 0xFFFF, 0x01,
+                               bytes(rnd.getrandbits(8) for _ in range(STATUS_PAYLOAD_LEN)))
+                    for i in range(frames))
+
+
+class LegacyRxStateMachine():
+    """ The per-byte receive state machine formerly in CommsLink.handleRxByte """
+    def __init__(self, packet_handler) -> None:
+        self.packet_handler = packet_handler
+        self.rxState = 0
+        self.statPacketRxCntOk = 0
+        self.statPacketRxCntCrcFail = 0
+        self.statPacketRxCntLenFail = 0
+        self.statPacketRxCntHeaderFail = 0
+
+    def feed(self, byteData: bytes) -> None:
+        for byte in byteData:
+            self.handleRxByte(byte)
+
+    def handleRxByte(self, byte) -> None:
+        if self.rxState == 0:
+            if byte == 0x26:
+                self.rxState = 1
+        elif self.rxState == 1:
+            if byte == 0x56:
+                self.rxState = 2
+            elif byte != 0x26:
+                self.rxState = 0
+                self.statPacketRxCntHeaderFail += 1
+        elif self.rxState == 2:
+            if byte == 0x7E:
+                self.rxState = 3
+            else:
+                self.rxState = 0
+                self.statPacketRxCntHeaderFail += 1
+        elif self.rxState == 3:
+            self.crcCalc = crc.compute(byte.to_bytes(1, 'little'), 0xffff)
+            self.seqNum = byte
+            self.rxState = 4
+        elif self.rxState == 4:
+            self.crcCalc = crc.compute(byte.to_bytes(1, 'little'), self.crcCalc)
+            self.seqNum += byte << 8
+            self.rxState = 5
+        elif self.rxState == 5:
+            self.crcCalc = crc.compute(byte.to_bytes(1, 'little'), self.crcCalc)
+            if byte != 4:
+                self.rxState = 0
+            else:
+                self.rxState = 6
+        elif self.rxState == 6:
+            self.crcCalc = crc.compute(byte.to_bytes(1, 'little'), self.crcCalc)
+            self.msgType = byte
+            self.rxState = 7
+            self.rxCnt = 0
+            self.rxData = bytearray()
+        elif self.rxState == 7:
+            self.crcCalc = crc.compute(byte.to_bytes(1, 'little'), self.crcCalc)
+            self.packetLen = byte
+            if (self.packetLen <= 128):
+                self.rxState = 8
+            else:
+                self.statPacketRxCntLenFail += 1
+                self.rxState = 0
+        elif self.rxState == 8:
+            self.crcCalc = crc.compute(byte.to_bytes(1, 'little'), self.crcCalc)
+            self.rxData.append(byte)
+            self.rxCnt += 1
+            if self.rxCnt == self.packetLen:
+                self.rxState = 9
+        elif self.rxState == 9:
+            self.recCrc = byte
+            self.rxState = 10
+        elif self.rxState == 10:
+            self.recCrc |= byte << 8
+            if self.recCrc == self.crcCalc:
+                self.statPacketRxCntOk += 1
+                self.packet_handler(self.rxData, self.msgType, self.seqNum)
+            else:
+                self.statPacketRxCntCrcFail += 1
+            self.rxState = 0
+
+
+def frame_ending_with(tail: bytes, sequenceNo: int) -> bytes:
+    """ A status frame whose CRC ends with tail, found by varying the payload """
+    for i in range(1 << 20):
+        frame = build_frame(sequenceNo, 0x01, i.to_bytes(4, 'little') + bytes(STATUS_PAYLOAD_LEN - 4))
+        if frame.endswith(tail):
+            return frame
+    raise RuntimeError('no frame ending with ' + tail.hex())
+
+
+def decode(stream: bytes, splits: tuple) -> tuple:
+    received = []
+    decoder = FrameDecoder(lambda payload, packetType, sequenceNo: received.append(sequenceNo))
+    last = 0
+    for split in splits + (len(stream),):
+        decoder.feed(stream[last:split])
+        last = split
+    return (received, decoder.statPacketRxCntOk, decoder.statPacketRxCntCrcFail,
+            decoder.statPacketRxCntLenFail, decoder.statPacketRxCntHeaderFail)
+
+
+def check_splits() -> None:
+    """
+    Frames whose CRC ends with the first sync bytes, each followed by the
+    rest of a frame without them. Those bytes belong to the CRC, so the
+    trailing frame must not be decoded, at any split of the stream.
+    """
+    stream = b''
+    for sequenceNo, tail in enumerate((b'\x26', b'\x26\x56')):
+        stream += frame_ending_with(tail, sequenceNo)
+        stream += build_frame(100 + sequenceNo, 0x01, bytes(STATUS_PAYLOAD_LEN))[len(tail):]
+    expected = decode(stream, ())
+    for split in range(1, len(stream)):
+        result = decode(stream, (split,))
+        if result != expected:
+            raise RuntimeError('FrameDecoder split at ' + str(split) + ' gave ' + str(result) +
+                               ', unsplit ' + str(expected))
+
+
+def run(decoder_class, stream: bytes, chunk_size: int, frames: int) -> dict:
+    received = []
+    decoder = decoder_class(lambda payload, packetType, sequenceNo: received.append(sequenceNo))
+    chunks = [stream[i:i + chunk_size] for i in range(0, len(stream), chunk_size)]
+
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    for chunk in chunks:
+        decoder.feed(chunk)
+    cpu = time.process_time() - cpu_start
+    wall = time.perf_counter() - wall_start
+
+    if len(received) != frames:
+        raise RuntimeError(decoder_class.__name__ + ' decoded ' + str(len(received)) +
+                           ' of ' + str(frames) + ' frames')
+    return {'frames_per_sec': frames / wall,
+            'cpu_us_per_frame': cpu / frames * 1e6}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Benchmark the serial frame decoder')
+    parser.add_argument('-n', '--frames', type=int, default=20000,
+                        help='Number of status frames to decode')
+    parser.add_argument('-c', '--chunk', type=int, default=512,
+                        help='Bytes per read, CommsLink.read_all uses 512')
+    args = parser.parse_args()
+
+    check_splits()
+    stream = make_stream(args.frames)
+    for decoder_class in (LegacyRxStateMachine, FrameDecoder):
+        result = run(decoder_class, stream, args.chunk, args.frames)
+        print('%-22s %12.0f frames/s %10.2f us CPU/frame' %
+              (decoder_class.__name__, result['frames_per_sec'], result['cpu_us_per_frame']))
+
+
+if __name__ == '__main__':
+    main()
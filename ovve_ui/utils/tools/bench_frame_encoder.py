@@ -0,0 +1,168 @@
+# Copyright 2020 LifeMech  Inc
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+# associated documentation files (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge, publish, distribute,
+# sublicense, and/or sell copies of the Software, and to permit persons to whom the Software
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or
+# substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING
+# BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+
+
+"""
+Compares encode+write time of the single-write command frame encoder
+against the old per-byte sendPkts path. Frames are written to a pty whose
+other end is drained by a thread, so every write is a real syscall.
+
+Run from the ovve_ui directory:
+    python -m utils.tools.bench_frame_encoder [-n FRAMES]
+"""
+import argparse
+import os
+import threading
+import time
+import tty
+
+from utils import crc
+from utils.frame_decoder import FrameDecoder
+from utils.out_packet import OutPacket
+
+try:
+    import serial
+except ImportError:
+    serial = None
+
+
+class FdWriter():
+    """ Minimal stand-in for serial.Serial.write when pyserial is missing """
+    def __init__(self, fd: int) -> None:
+        self.fd = fd
+
+    def write(self, data) -> int:
+        return os.write(self.fd, data)
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+def legacy_to_bytes(data: dict) -> bytes:
+    endian = "little"
+    cmd_byteData = b""
+    cmd_byteData += bytes(data['mode_value'].to_bytes(1, endian))
+    cmd_byteData += bytes(data['command'].to_bytes(1, endian))
+    cmd_byteData += bytes(data['reserved'].to_bytes(2, endian))
+    cmd_byteData += bytes(data['respiratory_rate_set'].to_bytes(2, endian))
+    cmd_byteData += bytes(data['tidal_volume_set'].to_bytes(2, endian, signed=True))
+    cmd_byteData += bytes(data['ie_ratio_set'].to_bytes(2, endian))
+    cmd_byteData += bytes(data['pressure_set'].to_bytes(2, endian, signed=True))
+    cmd_byteData += bytes(data['high_pressure_limit_set'].to_bytes(2, endian, signed=True))
+    cmd_byteData += bytes(data['low_pressure_limit_set'].to_bytes(2, endian, signed=True))
+    cmd_byteData += bytes(data['high_volume_limit_set'].to_bytes(2, endian, signed=True))
+    cmd_byteData += bytes(data['low_volume_limit_set'].to_bytes(2, endian, signed=True))
+    cmd_byteData += bytes(data['high_respiratory_rate_limit_set'].to_bytes(2, endian))
+    cmd_byteData += bytes(data['low_respiratory_rate_limit_set'].to_bytes(2, endian))
+    cmd_byteData += bytes(data['alarm_bits'].to_bytes(4, endian))
+    return cmd_byteData
+
+
+def legacy_send(ser, data: dict, sequenceNoTx: int) -> None:
+    # the old OutPacket.to_bytes followed by CommsLink.sendPkts
+    cmd_byteData = legacy_to_bytes(data)
+    ser.write(bytes([0x26, 0x56, 0x7e]))
+    ser.write(sequenceNoTx.to_bytes(2, 'little'))
+    txCrc = crc.compute(sequenceNoTx.to_bytes(2, 'little'), 0xFFFF)
+    ser.write(bytes([4]))
+    txCrc = crc.compute(bytes([4]), txCrc)
+    ser.write(bytes([0x02]))
+    txCrc = crc.compute(bytes([0x02]), txCrc)
+    ser.write(len(cmd_byteData).to_bytes(1, 'little'))
+    txCrc = crc.compute(len(cmd_byteData).to_bytes(1, 'little'), txCrc)
+    for i in range(len(cmd_byteData)):
+        txCrc = crc.compute(cmd_byteData[i:i + 1], txCrc)
+        ser.write(cmd_byteData[i:i + 1])
+    ser.write(txCrc.to_bytes(2, 'little'))
+
+
+def single_write_send(ser, cmd_pkt: OutPacket, sequenceNoTx: int) -> None:
+    ser.write(cmd_pkt.to_frame(sequenceNoTx))
+
+
+def open_loopback():
+    master, slave = os.openpty()
+    tty.setraw(master)
+    tty.setraw(slave)
+    if serial is not None:
+        ser = serial.Serial(os.ttyname(slave), baudrate=500000)
+        os.close(slave)
+    else:
+        ser = FdWriter(slave)
+    return master, ser
+
+
+def drain(master: int, decoder: FrameDecoder, stop: threading.Event) -> None:
+    while not stop.is_set():
+        try:
+            data = os.read(master, 65536)
+        except OSError:
+            return
+        decoder.feed(data)
+
+
+def run(name: str, send, frames: int) -> dict:
+    master, ser = open_loopback()
+    received = []
+    decoder = FrameDecoder(lambda payload, packetType, sequenceNo: received.append(sequenceNo))
+    stop = threading.Event()
+    reader = threading.Thread(target=drain, args=(master, decoder, stop), daemon=True)
+    reader.start()
+
+    cmd_pkt = OutPacket()
+    cmd_pkt.data['respiratory_rate_set'] = 20
+    cmd_pkt.data['tidal_volume_set'] = 475
+    cmd_pkt.data['ie_ratio_set'] = 128
+
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    for i in range(frames):
+        send(ser, cmd_pkt, i & 0xFFFF)
+    cpu = time.process_time() - cpu_start
+    wall = time.perf_counter() - wall_start
+
+    deadline = time.monotonic() + 5
+    while len(received) < frames and time.monotonic() < deadline:
+        time.sleep(0.01)
+    stop.set()
+    ser.close()
+    os.close(master)
+    if len(received) != frames:
+        raise RuntimeError(name + ': peer decoded ' + str(len(received)) + ' of ' +
+                           str(frames) + ' frames')
+    return {'us_per_frame': wall / frames * 1e6, 'cpu_us_per_frame': cpu / frames * 1e6}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Benchmark command frame encode+write')
+    parser.add_argument('-n', '--frames', type=int, default=5000,
+                        help='Number of command frames to send')
+    args = parser.parse_args()
+
+    if serial is None:
+        print('pyserial not installed, writing to the pty with os.write')
+    paths = (('per-byte writes', lambda ser, pkt, seq: legacy_send(ser, pkt.data, seq)),
+             ('single write', single_write_send))
+    for name, send in paths:
+        result = run(name, send, args.frames)
+        print('%-16s %10.2f us/frame %10.2f us CPU/frame' %
+              (name, result['us_per_frame'], result['cpu_us_per_frame']))
+
+
+if __name__ == '__main__':
+    main()
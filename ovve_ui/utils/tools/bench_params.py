@@ -0,0 +1,135 @@
+# Copyright 2020 LifeMech  Inc
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+# associated documentation files (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge, publish, distribute,
+# sublicense, and/or sell copies of the Software, and to permit persons to whom the Software
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or
+# substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING
+# BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+
+
+"""
+Compares the slot based Params with the dict-plus-properties layout it
+replaced: construction, field reads and writes, to_JSON and memory.
+
+Run from the ovve_ui directory:
+    python -m utils.tools.bench_params [-r REPEAT]
+"""
+import argparse
+import json
+import sys
+import timeit
+import tracemalloc
+
+from utils.in_packet import InPacket
+from utils.params import Params, FIELDS
+from utils.tools.pty_ecu import status_payload
+
+
+def _legacy_property(name: str) -> property:
+    def getter(self):
+        return self._param[name]
+
+    def setter(self, value):
+        self._param[name] = value
+    return property(getter, setter)
+
+
+class LegacyParams():
+    """ The former layout: a _param dict behind one property per field """
+    def __init__(self) -> None:
+        self._param = {name: 0 for name in FIELDS}
+
+    def to_JSON(self) -> str:
+        return json.dumps(self._param)
+
+
+for _name in FIELDS:
+    setattr(LegacyParams, _name, _legacy_property(_name))
+
+
+def legacy_to_params(values: tuple) -> LegacyParams:
+    # what InPacket.to_params did: construct, then one setter per field
+    params = LegacyParams()
+    for name, value in zip(FIELDS, values):
+        setattr(params, name, value)
+    return params
+
+
+def legacy_to_params_unrolled(values: tuple) -> LegacyParams:
+    params = LegacyParams()
+    (params.seq_num, params.packet_version, params.mode, params.resp_rate_meas,
+     params.resp_rate_set, params.tv_meas, params.tv_set, params.ie_ratio_meas,
+     params.ie_ratio_set, params.peep, params.ppeak, params.pplat, params.pressure,
+     params.flow, params.tv_insp, params.tv_exp, params.tv_rate, params.control_state,
+     params.run_state, params.battery_level, params.high_pressure_limit,
+     params.low_pressure_limit, params.high_volume_limit, params.low_volume_limit,
+     params.high_resp_rate_limit, params.low_resp_rate_limit, params.alarm_bits,
+     params.battery_charge) = values
+    return params
+
+
+def read_fields(params) -> float:
+    # the fields updateMainDisplays and updateGraphs read per packet
+    return (params.pressure + params.flow + params.tv_meas + params.peep + params.ppeak +
+            params.pplat + params.resp_rate_meas + params.tv_insp + params.tv_exp +
+            params.control_state + params.run_state + params.battery_level)
+
+
+def bytes_per_object(factory, count: int = 10000) -> float:
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    objects = [factory() for _ in range(count)]
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del objects
+    return used / count
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Benchmark the Params record')
+    parser.add_argument('-r', '--repeat', type=int, default=5,
+                        help='Number of timing runs, the best one is reported')
+    args = parser.parse_args()
+
+    in_pkt = InPacket()
+    in_pkt.from_bytes(status_payload(1, 0.3))
+    current = in_pkt.to_params(1)
+    values = current.to_values()
+    legacy = legacy_to_params(values)
+    number = 20000
+
+    cases = [
+        ('construct legacy + 28 setters', lambda: legacy_to_params_unrolled(values)),
+        ('construct Params(*values)', lambda: Params.from_values(values)),
+        ('InPacket.to_params (incl. units)', lambda: in_pkt.to_params(1)),
+        ('read 12 fields legacy', lambda: read_fields(legacy)),
+        ('read 12 fields Params', lambda: read_fields(current)),
+        ('write pressure legacy', lambda: setattr(legacy, 'pressure', 1.0)),
+        ('write pressure Params', lambda: setattr(current, 'pressure', 1.0)),
+        ('to_JSON legacy', legacy.to_JSON),
+        ('to_JSON Params', current.to_JSON),
+        ('to_dict Params', current.to_dict),
+    ]
+    print('%-34s %10s' % ('case', 'us/call'))
+    for name, func in cases:
+        best = min(timeit.repeat(func, number=number, repeat=args.repeat))
+        print('%-34s %10.3f' % (name, best / number * 1e6))
+
+    print('\nbytes per object: legacy %.0f, Params %.0f (python %s)' %
+          (bytes_per_object(lambda: legacy_to_params_unrolled(values)),
+           bytes_per_object(lambda: Params.from_values(values)),
+           sys.version.split()[0]))
+
+
+if __name__ == '__main__':
+    main()
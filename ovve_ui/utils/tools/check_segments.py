@@ -0,0 +1,103 @@
+# Copyright 2020 LifeMech  Inc
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+# associated documentation files (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge, publish, distribute,
+# sublicense, and/or sell copies of the Software, and to permit persons to whom the Software
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or
+# substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING
+# BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+
+
+"""
+Checks utils.segment_compressor on a synthetic capture pair: the data
+reads back the same through gzip and SegmentReader, block times and the
+.ts timestamps survive compression and no uncompressed file is left.
+
+Run from the ovve_ui directory:
+    python -m utils.tools.check_segments
+"""
+import gzip
+import os
+import sys
+import tempfile
+import time
+
+from utils.capture_log import CaptureLog, TS_STRUCT
+from utils.segment_compressor import SUFFIX, SegmentCompressor, SegmentReader, read_timestamps
+
+
+def write_pair(dirName: str, size: int) -> tuple:
+    """ A rotated capture pair of about size bytes, returns (paths, stamps) """
+    capture = CaptureLog(dirName, flush_interval=0.0)
+    paths = [capture.binaryLog.path, capture.textLog.path]
+    chunk = bytes(range(256)) * 16
+    for i in range(size // len(chunk)):
+        capture.write_binary(chunk)
+        if i % 64 == 0:
+            capture.write_text(b'line %d\n' % i)
+        # one stamp per chunk
+        capture.binaryLog._nextStamp = 0.0
+    capture.close()
+    with open(paths[0] + '.ts', 'rb') as f:
+        stamps = f.read()
+    return paths, stamps
+
+
+def check(dirName: str) -> list:
+    errors = []
+    paths, stamps = write_pair(dirName, 2 * 1024 * 1024)
+    originals = {}
+    for path in paths:
+        with open(path, 'rb') as f:
+            originals[path] = f.read()
+    before = read_timestamps(paths[0])
+
+    compressor = SegmentCompressor()
+    compressor.start()
+    for path in paths:
+        compressor.submit(path)
+    compressor.stop()
+    compressor.join(30)
+
+    left = sorted(name for name in os.listdir(dirName) if not name.endswith(SUFFIX))
+    if left:
+        errors.append('left uncompressed: ' + ', '.join(left))
+    for path, data in originals.items():
+        with gzip.open(path + SUFFIX, 'rb') as f:
+            if f.read() != data:
+                errors.append(path + ': gzip data differs')
+        reader = SegmentReader(path + SUFFIX)
+        if b''.join(reader.blocks()) != data:
+            errors.append(path + ': SegmentReader data differs')
+        reader.close()
+    if read_timestamps(paths[0]) != before or len(before[0]) != len(stamps) // TS_STRUCT.size:
+        errors.append('timestamps not kept: %d of %d' %
+                      (len(read_timestamps(paths[0])[0]), len(before[0])))
+    reader = SegmentReader(paths[0] + SUFFIX)
+    if reader.offset_at(time.time() + 60) != reader.offsets[-1]:
+        errors.append('block times missing')
+    reader.close()
+    return errors
+
+
+def main() -> None:
+    with tempfile.TemporaryDirectory() as dirName:
+        errors = check(dirName)
+    for error in errors:
+        print(error)
+    if errors:
+        sys.exit(1)
+    print('segments ok')
+
+
+if __name__ == '__main__':
+    main()
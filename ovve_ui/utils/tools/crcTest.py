@@ -21,10 +21,11 @@
 import serial
 import sys
 from time import sleep
-import binascii
-import crc16
 import codecs
 
+# run from the ovve_ui directory: python -m utils.tools.crcTest
+from utils.crc import CRC
+
 BAUD = 38400
 PORT = "/dev/ttyACM0"
 SER_TIMEOUT = 0.055
@@ -55,10 +56,7 @@ def init_serial():
 #Call the Serial Initilization Function, Main Program Starts from here
 init_serial()
 
-def crccitt(hex_string):
-    byte_seq = binascii.unhexlify(hex_string)
-    crc = crc16.crc16xmodem(byte_seq, 0xffff)
-    return '{:04X}'.format(crc & 0xffff)
+crccitt = CRC().crccitt
 
 def read_all(port, chunk_size=200):
     """Read all characters on the serial port and return them."""
@@ -0,0 +1,59 @@
+# Copyright 2020 LifeMech  Inc
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+# associated documentation files (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge, publish, distribute,
+# sublicense, and/or sell copies of the Software, and to permit persons to whom the Software
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or
+# substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING
+# BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+
+
+"""
+Turns a session recording (utils.session_recorder) into JSON lines, one
+per packet, or saves the decoded status fields as a NumPy .npy file.
+
+Run from the ovve_ui directory:
+    python -m utils.tools.dump_session RECORDING [--npy OUT] [-k status|command]
+"""
+import argparse
+import sys
+
+import numpy as np
+
+from utils.session_recorder import (read_records, decode_status, to_json_lines,
+                                    KIND_STATUS, KIND_COMMAND)
+
+KINDS = {'status': KIND_STATUS, 'command': KIND_COMMAND}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Decode a session recording')
+    parser.add_argument('recording')
+    parser.add_argument('--npy', help='Save the decoded status fields here instead of printing JSON')
+    parser.add_argument('-k', '--kind', choices=sorted(KINDS),
+                        help='Only print records of this kind')
+    args = parser.parse_args()
+
+    records = read_records(args.recording)
+    if args.npy:
+        status = decode_status(records)
+        np.save(args.npy, status)
+        print('Saved ' + str(len(status)) + ' status records to ' + args.npy)
+        return
+    if args.kind:
+        records = records[records['kind'] == KINDS[args.kind]]
+    for line in to_json_lines(records):
+        sys.stdout.write(line + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+# Copyright 2020 LifeMech  Inc
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+# associated documentation files (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge, publish, distribute,
+# sublicense, and/or sell copies of the Software, and to permit persons to whom the Software
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or
+# substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING
+# BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+
+
+"""
+MCU stand-in on a pty. Sends v4 status frames at a fixed rate and measures
+the time from sending a status frame to receiving the command reply, so
+the UI read loop can be compared without hardware.
+
+Run from the ovve_ui directory:
+    python -m utils.tools.pty_ecu [--period 0.01]
+and start the UI on the printed port:
+    python ovve_ui.py -w -d -p /dev/pts/N [-r poll]
+"""
+import argparse
+import math
+import os
+import select
+import threading
+import time
+import tty
+
+from utils.control_state import ControlState
+from utils.frame_decoder import FrameDecoder, build_frame
+from utils.in_packet import STATUS_STRUCT
+from utils.latency_histogram import LatencyHistogram
+
+
+def status_payload(sequenceNo: int, t: float) -> bytes:
+    breath = math.sin(2 * math.pi * t / 3.0)
+    return STATUS_STRUCT.pack(
+        0,                                  # mode
+        int(ControlState.INHALATION) | (1 << 7),  # control state, running
+        (1 << 7) | 90,                      # charging, 90%
+        0,                                  # reserved
+        20, 20,                             # respiratory rate set / measured
+        475, 470,                           # tidal volume set / measured
+        128, 128,                           # I:E set / measured
+        500, 2000, 1800,                    # peep, peak, plateau [0.01 cmH2O]
+        0, int(2000 * max(breath, 0)),      # pressure set / measured
+        int(3000 * breath),                 # flow [0.01 SLM]
+        int(475 * max(breath, 0)), 0, 0,    # volume in / out / rate
+        4000, -100, 570, 380,               # pressure and volume limits
+        30, 5,                              # respiratory rate limits
+        0)                                  # alarm bits
+
+
+class PtyEcu():
+    def __init__(self, period: float) -> None:
+        self.period = period
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.master)
+        tty.setraw(self.slave)
+        self.port = os.ttyname(self.slave)
+        self.lastSent = None
+        self.latency = LatencyHistogram('status-to-reply')
+        self.decoder = FrameDecoder(self.on_reply)
+
+    def on_reply(self, payload, packetType: int, sequenceNo: int) -> None:
+        if packetType == 0x02 and self.lastSent is not None:
+            self.latency.record(time.perf_counter() - self.lastSent)
+            self.lastSent = None
+
+    def reader(self) -> None:
+        while True:
+            ready, _, _ = select.select([self.master], [], [], 1.0)
+            if ready:
+                self.decoder.feed(os.read(self.master, 4096))
+
+    def run(self, duration: float) -> None:
+        threading.Thread(target=self.reader, daemon=True).start()
+        start = time.perf_counter()
+        nextSend = start
+        nextReport = start + 5
+        sequenceNo = 0
+        while duration <= 0 or time.perf_counter() - start < duration:
+            now = time.perf_counter()
+            if now < nextSend:
+                time.sleep(nextSend - now)
+            frame = build_frame(sequenceNo, 0x01, status_payload(sequenceNo, now - start))
+            self.lastSent = time.perf_counter()
+            os.write(self.master, frame)
+            sequenceNo += 1
+            nextSend += self.period
+            if now >= nextReport:
+                print(self.latency.summary() + ' sent=' + str(sequenceNo))
+                nextReport += 5
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='MCU stand-in on a pty')
+    parser.add_argument('--period', type=float, default=0.01,
+                        help='Seconds between status frames')
+    parser.add_argument('--duration', type=float, default=0,
+                        help='Seconds to run, 0 runs until interrupted')
+    args = parser.parse_args()
+
+    ecu = PtyEcu(args.period)
+    print('MCU stand-in on ' + ecu.port)
+    try:
+        ecu.run(args.duration)
+    except KeyboardInterrupt:
+        pass
+    print(ecu.latency.summary())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+# Copyright 2020 LifeMech  Inc
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+# associated documentation files (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge, publish, distribute,
+# sublicense, and/or sell copies of the Software, and to permit persons to whom the Software
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or
+# substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING
+# BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+"""
+Prints the patient log lines of a time window, or around an alarm,
+using the index the log handler keeps (utils.log_index) instead of
+reading every hourly file. Rotated and compressed files are read alike.
+
+Run from the ovve_ui directory:
+    python -m utils.tools.query_logs LOGDIR|BASE --alarms
+    python -m utils.tools.query_logs LOGDIR|BASE --from TIME [--to TIME]
+    python -m utils.tools.query_logs LOGDIR|BASE --alarm N [--window SECONDS]
+TIME is local 'YYYY-MM-DD HH:MM:SS' or seconds since the epoch.
+"""
+import argparse
+import os
+import sys
+from datetime import datetime
+
+from utils.log_index import LogIndex, INDEX_SUFFIX
+
+
+def parse_time(text: str) -> float:
+    try:
+        return float(text)
+    except ValueError:
+        return datetime.fromisoformat(text).timestamp()
+
+
+def find_base(path: str) -> str:
+    """ The log base name for a patient directory or an index file """
+    if path.endswith(INDEX_SUFFIX):
+        return path[:-len(INDEX_SUFFIX)]
+    if os.path.isdir(path):
+        for name in sorted(os.listdir(path)):
+            if name.endswith('.log' + INDEX_SUFFIX):
+                return os.path.join(path, name[:-len(INDEX_SUFFIX)])
+        raise SystemExit('No log index in ' + path)
+    return path
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Query the indexed patient logs')
+    parser.add_argument('logs', help='Patient log directory or log base name')
+    parser.add_argument('--alarms', action='store_true', help='List the alarm events')
+    parser.add_argument('--alarm', type=int, help='Print the window around this alarm event')
+    parser.add_argument('--from', dest='start', type=parse_time)
+    parser.add_argument('--to', dest='end', type=parse_time)
+    parser.add_argument('--window', type=float, default=60.0,
+                        help='Seconds before and after --alarm, or after --from without --to')
+    args = parser.parse_args()
+
+    index = LogIndex(find_base(args.logs))
+    if args.alarms:
+        for i, alarm in enumerate(index.alarms):
+            path = index.file_path(float(alarm['file_start']))
+            print('%d  %s  bits %s  %s:%d' % (
+                i, datetime.fromtimestamp(alarm['time']).isoformat(sep=' ', timespec='milliseconds'),
+                bin(int(alarm['value'])), path or 'deleted', int(alarm['offset'])))
+        return
+    if args.alarm is not None:
+        t = float(index.alarms[args.alarm]['time'])
+        start, end = t - args.window, t + args.window
+    elif args.start is not None:
+        start = args.start
+        end = args.end if args.end is not None else start + args.window
+    else:
+        parser.error('give --alarms, --alarm or --from')
+    out = sys.stdout.buffer
+    for line in index.lines(start, end):
+        out.write(line)
+
+
+if __name__ == '__main__':
+    main()
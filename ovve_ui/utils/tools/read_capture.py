@@ -0,0 +1,64 @@
+# Copyright 2020 LifeMech  Inc
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+# associated documentation files (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge, publish, distribute,
+# sublicense, and/or sell copies of the Software, and to permit persons to whom the Software
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or
+# substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING
+# BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+"""
+Decodes [date] binary.log captures (utils.capture_reader), plain or
+compressed, and prints frame counts, CRC errors and sequence gaps. With
+--npy the status packets are saved in the same layout as
+utils.tools.dump_session --npy. For a live port use testReader.
+
+Run from the ovve_ui directory:
+    python -m utils.tools.read_capture CAPTURE... [--npy OUT] [--json]
+"""
+import argparse
+import json
+import sys
+import time
+
+import numpy as np
+
+from utils.capture_reader import read_capture, summary
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Decode binary.log captures')
+    parser.add_argument('captures', nargs='+', help='Files in time order, they are joined')
+    parser.add_argument('--npy', help='Save the decoded status packets here')
+    parser.add_argument('--json', action='store_true',
+                        help='Print one JSON object per status packet')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    results = [read_capture(path) for path in args.captures]
+    status = np.concatenate([r[0] for r in results])
+    frames = np.concatenate([r[1] for r in results])
+    elapsed = time.perf_counter() - start
+
+    if args.json:
+        names = status.dtype.names
+        for row in status:
+            sys.stdout.write(json.dumps(dict(zip(names, row.tolist()))) + '\n')
+        return
+    print(json.dumps(summary(frames, status)))
+    print('Decoded in %.2f s' % elapsed)
+    if args.npy:
+        np.save(args.npy, status)
+        print('Saved ' + str(len(status)) + ' status packets to ' + args.npy)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+# Copyright 2020 LifeMech  Inc
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+# associated documentation files (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge, publish, distribute,
+# sublicense, and/or sell copies of the Software, and to permit persons to whom the Software
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or
+# substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING
+# BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+"""
+Writes a compressed log segment (utils.segment_compressor) to stdout,
+from a point in time on, without decompressing what comes before it.
+Log files start at the first line at or after --from, capture files at
+the start of the block holding it.
+
+Run from the ovve_ui directory:
+    python -m utils.tools.read_segment SEGMENT.gz [--from 'YYYY-MM-DD HH:MM:SS'] [--bytes N]
+"""
+import argparse
+import sys
+from datetime import datetime
+
+from utils.segment_compressor import SegmentReader, log_line_time
+
+
+def parse_time(text: str) -> float:
+    try:
+        return float(text)
+    except ValueError:
+        return datetime.fromisoformat(text).timestamp()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Read a compressed log segment')
+    parser.add_argument('segment')
+    parser.add_argument('--from', dest='start', type=parse_time,
+                        help='Local time or seconds since the epoch to start at')
+    parser.add_argument('--bytes', type=int, help='Stop after this many bytes')
+    args = parser.parse_args()
+
+    reader = SegmentReader(args.segment)
+    offset = 0 if args.start is None else reader.offset_at(args.start)
+    remaining = args.bytes
+    # text blocks start mid-line, skip to the first line from the start time
+    skipLines = args.start is not None and not args.segment.endswith('binary.log.gz')
+    midLine = offset > 0
+    out = sys.stdout.buffer
+    for data in reader.blocks(offset):
+        if skipLines:
+            start = data.find(b'\n') + 1 if midLine else 0
+            midLine = True
+            while start < len(data):
+                end = data.find(b'\n', start) + 1 or len(data)
+                # nan for lines without a time, which never compares true
+                if log_line_time(data[start:end]) >= args.start:
+                    skipLines = False
+                    break
+                start = end
+            if skipLines:
+                continue
+            data = data[start:]
+        if remaining is not None:
+            data = data[:remaining]
+            remaining -= len(data)
+        out.write(data)
+        if remaining == 0:
+            break
+    reader.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+# Copyright 2020 LifeMech  Inc
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+# associated documentation files (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge, publish, distribute,
+# sublicense, and/or sell copies of the Software, and to permit persons to whom the Software
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or
+# substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING
+# BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+"""
+Plays a binary.log capture through a real comms engine (decode, Params,
+replies and the Qt signals to the UI) without a ventilator, and reports
+what reached the UI side and how fast. To watch it in the UI instead:
+    python ovve_ui.py -w -d -p 'replay:CAPTURE?speed=10'
+
+Run from the ovve_ui directory:
+    python -m utils.tools.replay_capture CAPTURE [--speed 1|10|max]
+        [--pacing auto|seq|timestamps] [-e thread|asyncio] [--display_rate 25]
+"""
+import argparse
+import sys
+import tempfile
+import time
+
+from PyQt5.QtCore import QCoreApplication, QTimer
+
+from utils.comms_link import CommsLink
+from utils.comms_async import AsyncCommsLink
+from utils.latency_trace import trace
+from utils.replay_transport import ReplayTransport, REPLAY_PACING
+
+ENGINES = {'thread': CommsLink, 'asyncio': AsyncCommsLink}
+
+
+def parse_speed(text: str) -> float:
+    return 0.0 if text == 'max' else float(text.rstrip('x'))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Replay a capture through the comms engine')
+    parser.add_argument('capture')
+    parser.add_argument('--speed', type=parse_speed, default=1.0,
+                        help='Times faster than recorded, or max')
+    parser.add_argument('--pacing', choices=REPLAY_PACING, default='auto')
+    parser.add_argument('-e', '--engine', choices=sorted(ENGINES), default='thread')
+    parser.add_argument('--display_rate', type=float, default=25.0,
+                        help='Waveform blocks per second, 0 sends every packet')
+    parser.add_argument('-l', '--latency_trace', action='store_true')
+    args = parser.parse_args()
+
+    trace.enabled = args.latency_trace
+    app = QCoreApplication(sys.argv)
+    transport = ReplayTransport(args.capture, args.speed, args.pacing)
+    # the engine captures what it reads, keep that out of /home/pi/logs
+    logDir = tempfile.mkdtemp(prefix='ovve_replay_')
+    link = ENGINES[args.engine](None, transport=transport, log_dir=logDir,
+                                display_rate=args.display_rate)
+
+    counts = {'params': 0, 'waveform': 0, 'samples': 0, 'status': 0, 'alarms': 0}
+    reader = link.samples.reader('replay') if link.samples is not None else None
+
+    def on_waveform(block) -> None:
+        counts['waveform'] += 1
+        counts['samples'] += len(reader.read(block.head))
+
+    def count(name: str):
+        def handler(*_) -> None:
+            counts[name] += 1
+        return handler
+
+    link.new_params.connect(count('params'))
+    link.new_waveform.connect(on_waveform)
+    link.new_status.connect(count('status'))
+    link.new_alarms.connect(count('alarms'))
+
+    start = [None]
+
+    def check() -> None:
+        if start[0] is None and transport.statBytesRead:
+            start[0] = time.monotonic()
+        if transport.finished or link.isFinished():
+            link.stop()
+            link.wait()
+            app.quit()
+
+    timer = QTimer()
+    timer.timeout.connect(check)
+    timer.start(50)
+    link.start()
+    app.exec_()
+    if reader is not None:
+        # rows written after the last display tick
+        counts['samples'] += len(reader.read())
+
+    elapsed = time.monotonic() - start[0] if start[0] is not None else 0.0
+    packets = link.protocol.decoder.statPacketRxCntOk
+    print('Replayed %d bytes, %d frames in %.2f s (%.0f frames/s)' %
+          (transport.statBytesRead, packets, elapsed, packets / elapsed if elapsed else 0.0))
+    print('Signals: ' + ' '.join('%s:%d' % item for item in counts.items()))
+    for line in link.stats_summary():
+        print(line)
+    if trace.enabled:
+        for line in trace.summary():
+            print(line)
+
+
+if __name__ == '__main__':
+    main()
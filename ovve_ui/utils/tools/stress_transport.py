@@ -0,0 +1,120 @@
+# Copyright 2020 LifeMech  Inc
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+# associated documentation files (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge, publish, distribute,
+# sublicense, and/or sell copies of the Software, and to permit persons to whom the Software
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or
+# substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING
+# BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+
+
+"""
+Drives the protocol engine over a pty, TCP or in-memory loopback transport
+as fast as the peer can send status frames, and compares the achieved
+rate with what a 500 kbaud UART can carry.
+
+Run from the ovve_ui directory:
+    python -m utils.tools.stress_transport [-t loopback|pty|tcp] [-n FRAMES]
+"""
+import argparse
+import os
+import threading
+import time
+
+from utils.comms_protocol import CommsProtocol
+from utils.frame_decoder import build_frame, FrameDecoder
+from utils.transports import LoopbackTransport, PtyTransport, TcpTransport
+from utils.tools.pty_ecu import status_payload
+
+UART_BAUD = 500000
+
+
+class FdPeer():
+    """ Peer end of a PtyTransport in this process """
+    def __init__(self, fd: int) -> None:
+        self.fd = fd
+
+    def write(self, data) -> int:
+        return os.write(self.fd, data)
+
+    def read_available(self, timeout: float) -> bytes:
+        return os.read(self.fd, 65536)
+
+
+def make_pair(kind: str, port: int):
+    if kind == 'loopback':
+        engine_side, peer = LoopbackTransport.pair()
+        engine_side.open()
+        peer.open()
+        return engine_side, peer
+    if kind == 'pty':
+        engine_side = PtyTransport()
+        engine_side.open()
+        return engine_side, FdPeer(engine_side.peer_fd)
+    engine_side = TcpTransport('127.0.0.1', port, listen=True)
+    peer = TcpTransport('127.0.0.1', port)
+    opener = threading.Thread(target=engine_side.open)
+    opener.start()
+    while not peer.is_open:
+        if not peer.open():
+            time.sleep(0.05)
+    opener.join()
+    return engine_side, peer
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Stress the protocol engine over a transport')
+    parser.add_argument('-t', '--transport', choices=['loopback', 'pty', 'tcp'], default='loopback')
+    parser.add_argument('-n', '--frames', type=int, default=20000)
+    parser.add_argument('--tcp_port', type=int, default=5757)
+    args = parser.parse_args()
+
+    engine_side, peer = make_pair(args.transport, args.tcp_port)
+    received = []
+    protocol = CommsProtocol(engine_side, params_handler=received.append)
+
+    frames = [build_frame(i, 0x01, status_payload(i, i * 0.01)) for i in range(args.frames)]
+    frame_len = len(frames[0])
+    replies = [0]
+    reply_decoder = FrameDecoder(lambda payload, packetType, sequenceNo: replies.__setitem__(0, replies[0] + 1))
+
+    def drain_replies() -> None:
+        while replies[0] < args.frames:
+            reply_decoder.feed(peer.read_available(0.1))
+
+    def send() -> None:
+        for frame in frames:
+            peer.write(frame)
+
+    drainer = threading.Thread(target=drain_replies, daemon=True)
+    drainer.start()
+    sender = threading.Thread(target=send, daemon=True)
+    start = time.perf_counter()
+    sender.start()
+    while len(received) < args.frames:
+        data = engine_side.read_available(1.0)
+        if not data and not sender.is_alive():
+            break
+        protocol.feed(data)
+    elapsed = time.perf_counter() - start
+    drainer.join(5)
+
+    rate = len(received) / elapsed
+    uart_rate = UART_BAUD / 10 / frame_len
+    print('%s: %d/%d frames in %.2fs, %.0f frames/s (%.1fx a saturated %d baud UART), %d replies' %
+          (args.transport, len(received), args.frames, elapsed, rate, rate / uart_rate,
+           UART_BAUD, replies[0]))
+    print(protocol.replyLatency.summary())
+
+
+if __name__ == '__main__':
+    main()
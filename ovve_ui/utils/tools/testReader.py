@@ -21,9 +21,10 @@
 import serial
 import sys
 from time import sleep
-import binascii
-import crc16
 import codecs
+
+# run from the ovve_ui directory: python -m utils.tools.testReader
+from utils.crc import CRC
 import struct
 
 BAUD = 38400
@@ -63,10 +64,7 @@ def init_serial():
 init_serial()
 sleep(1)
 
-def crccitt(hex_string):
-    byte_seq = binascii.unhexlify(hex_string)
-    crc = crc16.crc16xmodem(byte_seq, 0xffff)
-    return '{:04X}'.format(crc & 0xffff)
+crccitt = CRC().crccitt
 
 def read_all(port, chunk_size=200):
     """Read all characters on the serial port and return them."""
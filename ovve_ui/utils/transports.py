@@ -0,0 +1,370 @@
+# Copyright 2020 LifeMech  Inc
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+# associated documentation files (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge, publish, distribute,
+# sublicense, and/or sell copies of the Software, and to permit persons to whom the Software
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or
+# substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING
+# BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+
+
+"""
+Byte stream transports the comms engine can run over: pyserial, a Linux
+pty pair, a localhost TCP socket, an in-memory loopback and the replay
+of a binary.log capture (utils.replay_transport, imported only for it)
+"""
+import logging
+import os
+import select
+import socket
+import threading
+import time
+import tty
+from collections import deque
+from typing import Optional, Tuple
+from urllib.parse import parse_qs
+
+try:
+    import serial
+except ImportError:
+    serial = None
+
+READ_CHUNK = 4096
+
+
+class TransportError(IOError):
+    pass
+
+
+class Transport():
+    """
+    Base class. Subclasses implement open, close, read_available, write and
+    optionally fileno when the transport can be waited on with select.
+    """
+    def __init__(self, timeout: float = 0.065) -> None:
+        self.logger = logging.getLogger()
+        self.timeout = timeout
+        self.is_open = False
+
+    def open(self) -> bool:
+        raise NotImplementedError
+
+    def close(self) -> None:
+        self.is_open = False
+
+    def fileno(self) -> Optional[int]:
+        return None
+
+    def read_available(self, timeout: float, size: int = READ_CHUNK) -> bytes:
+        """ Wait up to timeout for data and return what has arrived, b'' on timeout """
+        raise NotImplementedError
+
+    def read(self, size: int) -> bytes:
+        """ Read until size bytes have arrived or the transport timeout passes """
+        deadline = time.monotonic() + self.timeout
+        read_buffer = b''
+        while len(read_buffer) < size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            read_buffer += self.read_available(remaining, size - len(read_buffer))
+        return read_buffer
+
+    def write(self, data) -> int:
+        raise NotImplementedError
+
+    def reset_input_buffer(self) -> None:
+        while self.read_available(0):
+            pass
+
+
+class SerialTransport(Transport):
+    def __init__(self, port: str, baudrate: int = 500000, timeout: float = 0.065,
+                 write_timeout: Optional[float] = None) -> None:
+        super().__init__(timeout)
+        if serial is None:
+            raise TransportError('pyserial is not installed')
+        self.ser = serial.Serial()
+        self.ser.baudrate = baudrate
+        self.ser.port = port
+        self.ser.timeout = timeout
+        self.ser.write_timeout = write_timeout
+        self._fd = None
+
+    def open(self) -> bool:
+        try:
+            if self.ser.is_open:
+                self.ser.close()
+                self.logger.info("Disconnected current connection.")
+                return False
+            self.ser.open()
+            self.logger.info("Successfully connected to port %r." % self.ser.port)
+        except serial.SerialException:
+            return False
+        try:
+            self._fd = self.ser.fileno()
+        except (AttributeError, OSError, serial.SerialException):
+            self._fd = None
+        self.is_open = True
+        return True
+
+    def close(self) -> None:
+        self.ser.close()
+        self.is_open = False
+
+    def fileno(self) -> Optional[int]:
+        return self._fd
+
+    def read(self, size: int) -> bytes:
+        try:
+            return self.ser.read(size=size)
+        except serial.SerialException as e:
+            raise TransportError(str(e))
+
+    def read_available(self, timeout: float, size: int = READ_CHUNK) -> bytes:
+        try:
+            if self._fd is not None:
+                ready, _, _ = select.select([self._fd], [], [], timeout)
+                if not ready:
+                    return b''
+                return self.ser.read(min(size, max(1, self.ser.in_waiting)))
+            # no pollable descriptor: block on the first byte, then take the rest
+            read_buffer = self.ser.read(1)
+            if read_buffer:
+                read_buffer += self.ser.read(min(size - 1, self.ser.in_waiting))
+            return read_buffer
+        except serial.SerialException as e:
+            raise TransportError(str(e))
+
+    def write(self, data) -> int:
+        try:
+            return self.ser.write(data)
+        except serial.SerialException as e:
+            raise TransportError(str(e))
+
+    def reset_input_buffer(self) -> None:
+        self.ser.reset_input_buffer()
+
+
+class _FdTransport(Transport):
+    """ Shared select/read/write handling for transports backed by a descriptor """
+    def __init__(self, timeout: float) -> None:
+        super().__init__(timeout)
+        self._fd = None
+
+    def fileno(self) -> Optional[int]:
+        return self._fd
+
+    def _recv(self, size: int) -> bytes:
+        return os.read(self._fd, size)
+
+    def _send(self, data) -> int:
+        return os.write(self._fd, data)
+
+    def read_available(self, timeout: float, size: int = READ_CHUNK) -> bytes:
+        if not self.is_open:
+            raise TransportError('Transport is closed')
+        ready, _, _ = select.select([self._fd], [], [], timeout)
+        if not ready:
+            return b''
+        try:
+            data = self._recv(size)
+        except OSError as e:
+            raise TransportError(str(e))
+        if not data:
+            raise TransportError('Peer closed the connection')
+        return data
+
+    def write(self, data) -> int:
+        if not self.is_open:
+            raise TransportError('Transport is closed')
+        view = memoryview(data)
+        try:
+            while view:
+                view = view[self._send(view):]
+        except OSError as e:
+            raise TransportError(str(e))
+        return len(data)
+
+
+class PtyTransport(_FdTransport):
+    """
+    Creates a raw pty pair and talks on the master side. A peer in another
+    process opens peer_name like a serial port, a peer in this process can
+    use peer_fd directly.
+    """
+    def __init__(self, timeout: float = 0.065) -> None:
+        super().__init__(timeout)
+        self.peer_fd = None
+        self.peer_name = None
+
+    def open(self) -> bool:
+        self._fd, self.peer_fd = os.openpty()
+        tty.setraw(self._fd)
+        tty.setraw(self.peer_fd)
+        self.peer_name = os.ttyname(self.peer_fd)
+        self.is_open = True
+        self.logger.info("Opened pty, peer side is %r." % self.peer_name)
+        return True
+
+    def close(self) -> None:
+        if self.is_open:
+            os.close(self._fd)
+            os.close(self.peer_fd)
+        self.is_open = False
+
+
+class TcpTransport(_FdTransport):
+    """
+    TCP stream to a stand-in for the MCU. With listen=True open() waits for
+    the first connection on (host, port) instead of connecting out.
+    """
+    def __init__(self, host: str = '127.0.0.1', port: int = 5000, listen: bool = False,
+                 timeout: float = 0.065, connect_timeout: float = 10.0) -> None:
+        super().__init__(timeout)
+        self.address = (host, port)
+        self.listen = listen
+        self.connect_timeout = connect_timeout
+        self.sock = None
+
+    def open(self) -> bool:
+        try:
+            if self.listen:
+                server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+                server.bind(self.address)
+                server.listen(1)
+                server.settimeout(self.connect_timeout)
+                try:
+                    self.sock, _ = server.accept()
+                finally:
+                    server.close()
+            else:
+                self.sock = socket.create_connection(self.address, self.connect_timeout)
+        except OSError as e:
+            # the link retries, a traceback per attempt only floods the log
+            self.logger.warning("TCP transport could not connect to %r: %s", self.address, e)
+            return False
+        self.sock.setblocking(True)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._fd = self.sock.fileno()
+        self.is_open = True
+        return True
+
+    def close(self) -> None:
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+        self.is_open = False
+
+    def _recv(self, size: int) -> bytes:
+        return self.sock.recv(size)
+
+    def _send(self, data) -> int:
+        return self.sock.send(data)
+
+
+class LoopbackTransport(Transport):
+    """
+    In-memory transport, create connected ends with LoopbackTransport.pair().
+    Written bytes objects are handed to the peer as they are; mutable buffers
+    are copied once because callers reuse them.
+    """
+    def __init__(self, timeout: float = 0.065) -> None:
+        super().__init__(timeout)
+        self.peer = None
+        self._chunks = deque()
+        self._cond = threading.Condition()
+
+    @classmethod
+    def pair(cls, timeout: float = 0.065) -> Tuple['LoopbackTransport', 'LoopbackTransport']:
+        a = cls(timeout)
+        b = cls(timeout)
+        a.peer = b
+        b.peer = a
+        return a, b
+
+    def open(self) -> bool:
+        self.is_open = True
+        return True
+
+    def close(self) -> None:
+        with self._cond:
+            self.is_open = False
+            self._cond.notify_all()
+
+    def _deliver(self, data: bytes) -> None:
+        with self._cond:
+            self._chunks.append(data)
+            self._cond.notify()
+
+    def write(self, data) -> int:
+        if not self.is_open or self.peer is None:
+            raise TransportError('Transport is closed')
+        if type(data) is not bytes:
+            data = bytes(data)
+        self.peer._deliver(data)
+        return len(data)
+
+    def read_available(self, timeout: float, size: int = READ_CHUNK) -> bytes:
+        with self._cond:
+            if not self._chunks:
+                if not self.is_open:
+                    raise TransportError('Transport is closed')
+                self._cond.wait(timeout)
+                if not self._chunks:
+                    return b''
+            chunk = self._chunks.popleft()
+            if len(chunk) > size:
+                self._chunks.appendleft(chunk[size:])
+                return chunk[:size]
+            parts = [chunk]
+            total = len(chunk)
+            while self._chunks and total + len(self._chunks[0]) <= size:
+                chunk = self._chunks.popleft()
+                parts.append(chunk)
+                total += len(chunk)
+            # a single chunk is returned without copying
+            return parts[0] if len(parts) == 1 else b''.join(parts)
+
+    def reset_input_buffer(self) -> None:
+        with self._cond:
+            self._chunks.clear()
+
+
+def make_transport(spec: str, baudrate: int = 500000, timeout: float = 0.065,
+                   write_timeout: Optional[float] = None) -> Transport:
+    """
+    Builds a transport from a port argument:
+        tcp://HOST:PORT         connect to a TCP stand-in
+        tcp-listen://HOST:PORT  wait for a TCP stand-in to connect
+        pty                     new pty pair, the peer name is logged
+        replay:PATH[?speed=N|max][&pacing=auto|seq|timestamps][&loop=1]
+                                play back a binary.log capture
+        anything else           serial device path
+    """
+    for prefix, listen in (('tcp://', False), ('tcp-listen://', True)):
+        if spec.startswith(prefix):
+            host, _, port = spec[len(prefix):].rpartition(':')
+            return TcpTransport(host or '127.0.0.1', int(port), listen=listen, timeout=timeout)
+    if spec == 'pty':
+        return PtyTransport(timeout)
+    if spec.startswith('replay:'):
+        # numpy and the capture reader are only loaded for a replay
+        from utils.replay_transport import ReplayTransport
+        path, _, query = spec[len('replay:'):].partition('?')
+        options = {key: values[-1] for key, values in parse_qs(query).items()}
+        speed = options.get('speed', '1')
+        return ReplayTransport(path, 0.0 if speed == 'max' else float(speed.rstrip('x')),
+                               options.get('pacing', 'auto'), options.get('loop') == '1',
+                               timeout)
+    return SerialTransport(spec, baudrate, timeout, write_timeout)
@@ -0,0 +1,102 @@
+# Copyright 2020 LifeMech  Inc
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+# associated documentation files (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge, publish, distribute,
+# sublicense, and/or sell copies of the Software, and to permit persons to whom the Software
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or
+# substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING
+# BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+
+
+"""
+Command writer thread. The RX side posts each command it builds into a
+single-slot mailbox and carries on; a command that has not gone out yet
+is replaced by the newer one, so a stalled UART never blocks reception
+and never builds up a backlog of stale settings.
+
+A command that fails to build or write is counted and logged and the
+thread carries on with the next one, so replies do not stop silently.
+"""
+import logging
+import threading
+import time
+
+from utils.comms_protocol import CommsProtocol
+from utils.latency_histogram import LatencyHistogram
+
+# failed writes are logged at most this often
+ERROR_LOG_INTERVAL = 10.0
+
+
+class TxWriter(threading.Thread):
+    def __init__(self, protocol: CommsProtocol) -> None:
+        threading.Thread.__init__(self, name='TxWriter', daemon=True)
+        self.protocol = protocol
+        self.done = False
+        self._cond = threading.Condition()
+        self._slot = None
+        self._nextErrorLog = 0.0
+        #statistics
+        self.statTxPosted = 0
+        self.statTxCoalesced = 0
+        self.statTxErrors = 0
+        self.txQueueLatency = LatencyHistogram('Serial TX mailbox wait')
+        self.txWriteLatency = LatencyHistogram('Serial TX write')
+
+    def post(self, values: tuple, rxTime: float) -> None:
+        """ Never blocks on the UART, replaces a command still waiting """
+        with self._cond:
+            if self._slot is not None:
+                self.statTxCoalesced += 1
+            self._slot = (values, rxTime, time.perf_counter())
+            self.statTxPosted += 1
+            self._cond.notify()
+
+    def post_reply(self) -> None:
+        """ CommsProtocol reply_handler: build on the RX thread, send here """
+        self.post(self.protocol.build_command(), self.protocol.rxTime)
+
+    def stop(self) -> None:
+        with self._cond:
+            self.done = True
+            self._cond.notify()
+
+    def run(self) -> None:
+        while True:
+            with self._cond:
+                while self._slot is None and not self.done:
+                    self._cond.wait()
+                if self.done:
+                    return
+                values, rxTime, postTime = self._slot
+                self._slot = None
+            start = time.perf_counter()
+            self.txQueueLatency.record(start - postTime)
+            try:
+                self.protocol.send_command(values, rxTime)
+            except Exception as e:
+                self.write_error(e)
+                continue
+            self.txWriteLatency.record(time.perf_counter() - start)
+
+    def write_error(self, e: Exception) -> None:
+        self.statTxErrors += 1
+        now = time.monotonic()
+        if now >= self._nextErrorLog:
+            self._nextErrorLog = now + ERROR_LOG_INTERVAL
+            logging.getLogger().warning('Serial TX failed (%d so far): %r', self.statTxErrors, e)
+
+    def stats_summary(self) -> list:
+        return ['Serial TX-Queue: Posted:' + str(self.statTxPosted) + ' Coalesced:' + str(self.statTxCoalesced) +
+                ' Errors:' + str(self.statTxErrors),
+                self.txQueueLatency.summary(),
+                self.txWriteLatency.summary()]
@@ -0,0 +1,99 @@
+# Copyright 2020 LifeMech  Inc
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+# associated documentation files (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge, publish, distribute,
+# sublicense, and/or sell copies of the Software, and to permit persons to whom the Software
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or
+# substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING
+# BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+
+
+"""
+Stores decoded status samples in a SampleRing on the comms thread and
+signals once per display tick, so the UI runs once per frame it can draw
+instead of once per packet and reads the samples through its own cursor.
+"""
+import time
+from typing import Callable
+
+import numpy as np
+
+from utils.params import Params
+from utils.sample_ring import SampleRing
+
+WAVEFORM_DTYPE = np.dtype([
+    ('time', 'f8'),             # time.time() when the sample was decoded
+    ('seq_num', 'u2'),
+    ('pressure', 'f4'),         # cmH2O
+    ('flow', 'f4'),             # SLM
+    ('volume', 'f4'),           # tv_meas, mL
+    ('control_state', 'u1'),
+    ('run_state', 'u1'),
+    ('alarm_bits', 'u4'),
+])
+
+
+class WaveformBlock():
+    """
+    Sent per display tick. params is the newest sample in full, head the
+    ring position after it; readers take the samples from the ring.
+    """
+    __slots__ = ('params', 'head')
+
+    def __init__(self, params: Params, head: int) -> None:
+        self.params = params
+        self.head = head
+
+
+class WaveformBatcher():
+    def __init__(self, rate: float, block_handler: Callable[[WaveformBlock], None],
+                 samples: SampleRing) -> None:
+        self.interval = 1.0 / rate
+        self.block_handler = block_handler
+        self.samples = samples
+        self._count = 0
+        self._params = None
+        self._nextFlush = 0.0
+        #statistics
+        self.statBlocks = 0
+        self.statSamples = 0
+
+    def add(self, params: Params) -> None:
+        """ CommsProtocol params_handler """
+        self.samples.write((time.time(), params.seq_num, params.pressure, params.flow,
+                            params.tv_meas, params.control_state,
+                            params.run_state, params.alarm_bits))
+        self._count += 1
+        self._params = params
+        self.poll(time.perf_counter())
+
+    def poll(self, now: float) -> None:
+        """ Flush if the tick is due, call regularly even when no data arrives """
+        if self._count and now >= self._nextFlush:
+            self.flush(now)
+
+    def flush(self, now: float) -> None:
+        block = WaveformBlock(self._params, self.samples.head)
+        if self._params.timestamps is not None:
+            # the emit stamp includes the time spent waiting for the tick
+            self._params.timestamps[2] = now
+        self.statSamples += self._count
+        self.statBlocks += 1
+        self._count = 0
+        self._params = None
+        # keeps an even tick rate, an idle link sends its first sample
+        # without waiting
+        self._nextFlush = max(self._nextFlush + self.interval, now)
+        self.block_handler(block)
+
+    def stats_summary(self) -> list:
+        return ['Waveform blocks: ' + str(self.statBlocks) + ' samples: ' + str(self.statSamples)]